@@ -1,8 +1,9 @@
 from logging.config import fileConfig
-from os import getenv
 
 from alembic import context
+from backend.src.database import database_url
 from backend.src.models import Base
+from backend.src.partitions import is_feedback_archive, is_partition
 from sqlalchemy import engine_from_config, pool
 
 # this is the Alembic Config object, which provides
@@ -20,7 +21,22 @@ if config.config_file_name is not None:
 # target_metadata = mymodel.Base.metadata
 target_metadata = Base.metadata
 
-config.set_main_option("sqlalchemy.url", getenv("DATABASE_URL"))
+# Migrations run synchronously, whichever driver the API uses
+config.set_main_option(
+    "sqlalchemy.url",
+    database_url("psycopg2").render_as_string(hide_password=False).replace("%", "%%"),
+)
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    # Partitions of queries_ir are managed by backend.src.partitions
+    if type_ == "table" and (is_partition(name) or is_feedback_archive(name)):
+        return False
+    # So are the copies of the foreign keys referencing them
+    return not (
+        type_ == "foreign_key_constraint" and is_partition(object.referred_table.name)
+    )
+
 
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
@@ -45,6 +61,7 @@ def run_migrations_offline() -> None:
         url=url,
         target_metadata=target_metadata,
         literal_binds=True,
+        include_object=include_object,
         dialect_opts={"paramstyle": "named"},
     )
 
@@ -66,7 +83,11 @@ def run_migrations_online() -> None:
     )
 
     with connectable.connect() as connection:
-        context.configure(connection=connection, target_metadata=target_metadata)
+        context.configure(
+            connection=connection,
+            target_metadata=target_metadata,
+            include_object=include_object,
+        )
 
         with context.begin_transaction():
             context.run_migrations()
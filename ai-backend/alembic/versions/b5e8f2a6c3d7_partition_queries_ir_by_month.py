@@ -0,0 +1,124 @@
+"""partition queries_ir by month
+
+Revision ID: b5e8f2a6c3d7
+Revises: 7e2d4b8c1a95
+Create Date: 2026-10-19 16:47:09.731845
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "b5e8f2a6c3d7"
+down_revision: Union[str, None] = "7e2d4b8c1a95"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Tables referencing queries_ir, whose foreign keys must include the partition key
+REFERENCING = ["feedback", "query_jobs"]
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE queries_ir RENAME TO queries_ir_unpartitioned")
+    op.execute(
+        "ALTER TABLE queries_ir_unpartitioned "
+        "RENAME CONSTRAINT queries_ir_pkey TO queries_ir_unpartitioned_pkey"
+    )
+    op.execute(
+        "ALTER INDEX idx_queries_ir_timestamp "
+        "RENAME TO idx_queries_ir_unpartitioned_timestamp"
+    )
+
+    # The primary key of a partitioned table must include the partition key
+    op.execute(
+        "CREATE TABLE queries_ir ("
+        "LIKE queries_ir_unpartitioned INCLUDING DEFAULTS, "
+        'CONSTRAINT queries_ir_pkey PRIMARY KEY (id, "timestamp")'
+        ') PARTITION BY RANGE ("timestamp")'
+    )
+    op.execute('CREATE INDEX idx_queries_ir_timestamp ON queries_ir ("timestamp")')
+    op.execute("CREATE TABLE queries_ir_default PARTITION OF queries_ir DEFAULT")
+    # A partition per month from the oldest query, to three months from now.
+    # Later ones are created by `python -m backend.src.maintenance partitions`.
+    op.execute(
+        """
+        DO $$
+        DECLARE
+            month date;
+        BEGIN
+            FOR month IN
+                SELECT generate_series(
+                    date_trunc(
+                        'month',
+                        coalesce(
+                            (SELECT min("timestamp") FROM queries_ir_unpartitioned),
+                            now()
+                        )
+                    ),
+                    date_trunc('month', now()) + interval '3 months',
+                    interval '1 month'
+                )::date
+            LOOP
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF queries_ir '
+                    'FOR VALUES FROM (%L) TO (%L)',
+                    'queries_ir_' || to_char(month, 'YYYY_MM'),
+                    month,
+                    (month + interval '1 month')::date
+                );
+            END LOOP;
+        END $$
+        """
+    )
+    op.execute("INSERT INTO queries_ir SELECT * FROM queries_ir_unpartitioned")
+
+    for table in REFERENCING:
+        op.execute(f"ALTER TABLE {table} ADD COLUMN query_timestamp TIMESTAMP")
+        op.execute(
+            f"UPDATE {table} SET query_timestamp = q.timestamp "
+            f"FROM queries_ir_unpartitioned q WHERE q.id = {table}.query_id"
+        )
+        op.execute(f"ALTER TABLE {table} DROP CONSTRAINT {table}_query_id_fkey")
+        op.execute(
+            f"ALTER TABLE {table} ADD CONSTRAINT {table}_query_id_query_timestamp_fkey "
+            "FOREIGN KEY (query_id, query_timestamp) "
+            'REFERENCES queries_ir (id, "timestamp")'
+        )
+    op.execute("ALTER TABLE feedback ALTER COLUMN query_timestamp SET NOT NULL")
+
+    op.execute("DROP TABLE queries_ir_unpartitioned")
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE queries_ir RENAME TO queries_ir_partitioned")
+    op.execute(
+        "ALTER TABLE queries_ir_partitioned "
+        "RENAME CONSTRAINT queries_ir_pkey TO queries_ir_partitioned_pkey"
+    )
+    op.execute(
+        "ALTER INDEX idx_queries_ir_timestamp "
+        "RENAME TO idx_queries_ir_partitioned_timestamp"
+    )
+
+    op.execute(
+        "CREATE TABLE queries_ir ("
+        "LIKE queries_ir_partitioned INCLUDING DEFAULTS, "
+        "CONSTRAINT queries_ir_pkey PRIMARY KEY (id))"
+    )
+    op.execute('CREATE INDEX idx_queries_ir_timestamp ON queries_ir ("timestamp")')
+    op.execute("INSERT INTO queries_ir SELECT * FROM queries_ir_partitioned")
+
+    for table in REFERENCING:
+        op.execute(
+            f"ALTER TABLE {table} DROP CONSTRAINT {table}_query_id_query_timestamp_fkey"
+        )
+        op.execute(f"ALTER TABLE {table} DROP COLUMN query_timestamp")
+        op.execute(
+            f"ALTER TABLE {table} ADD CONSTRAINT {table}_query_id_fkey "
+            "FOREIGN KEY (query_id) REFERENCES queries_ir (id)"
+        )
+
+    # Drops the partitions with it
+    op.execute("DROP TABLE queries_ir_partitioned")
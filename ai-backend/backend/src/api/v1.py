@@ -1,34 +1,52 @@
-import csv
+import hashlib
+import json
 import logging
 import time
-from datetime import datetime
-from io import StringIO
+from datetime import date, datetime
 from os import getenv
-from typing import Annotated, Union
+from typing import Annotated, Optional, Union
 
-from backend.src.database import SessionLocal, get_db
+from backend.src.crud import upsert_feedback, upsert_feedbacks
+from backend.src.database import get_db
 from backend.src.ir_pipeline.orchestrator import (
-    search,
+    rebind_trace,
     search_playground,
     search_rag,
     search_rag_paper,
 )
 from backend.src.ir_pipeline.schema import Terms
 from backend.src.ir_pipeline.tools.inspire import InspireOSFullTextSearchTool
+from backend.src.jobs import enqueue_query, get_job, run_query
 from backend.src.models import Feedback, QueryIr, SearchFeedback
 from backend.src.schemas.feedback import (
+    BulkFeedbackRequest,
+    BulkFeedbackResponse,
     FeedbackRequest,
     RagFeedbackRequest,
     RagFeedbackResponse,
 )
 from backend.src.schemas.query import QueryPaperResponse, QueryRequest, QueryResponse
 from backend.src.schemas.search_feedback import SearchFeedbackRequest
-from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
+from backend.src.stats import get_stats
+from backend.src.utils.admission import OverloadedError
+from backend.src.utils.deadline import DeadlineExceededError
+from backend.src.utils.export import (
+    MEDIA_TYPES,
+    ExportFormat,
+    export_filename,
+    stream_export,
+)
+from backend.src.utils.resilience import BackendTimeoutError, CircuitOpenError
+from backend.src.utils.scheduler import SCHEDULER
+from backend.src.utils.singleflight import SingleFlight
+from backend.src.utils.tracing import TRACER
+from backend.src.utils.write_behind import QUERIES_IR_WRITER
+from fastapi import APIRouter, Depends, HTTPException
 from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
-from langfuse import Langfuse
 from pydantic import UUID4
-from requests import Session
+from sqlalchemy import Table, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 logger = logging.getLogger(__name__)
 
@@ -39,11 +57,25 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
-langfuse_client = Langfuse(
-    public_key=getenv("LANGFUSE_PUBLIC_KEY"),
-    secret_key=getenv("LANGFUSE_SECRET_KEY"),
-    host=getenv("LANGFUSE_HOST"),
-)
+# Identical concurrent requests (e.g. a shared query) run the pipeline only once
+COALESCING_ENABLED = getenv("REQUEST_COALESCING", "true").lower() == "true"
+PLAYGROUND_FLIGHTS = SingleFlight("query-playground")
+RAG_FLIGHTS = SingleFlight("query-rag")
+
+# Queries are stored as jobs for the query workers (backend.src.worker), instead of
+# running in the API process
+QUERY_JOB_QUEUE = getenv("QUERY_JOB_QUEUE", "true").lower() == "true"
+
+
+def coalescing_key(request: QueryRequest) -> tuple:
+    history_hash = (
+        hashlib.sha256(
+            json.dumps([msg.model_dump() for msg in request.history]).encode()
+        ).hexdigest()
+        if request.history
+        else None
+    )
+    return (request.query, request.model, request.control_number, history_hash)
 
 
 def authenticate(credentials: Annotated[HTTPBasicCredentials, Depends(security)]):
@@ -64,65 +96,82 @@ def authenticate(credentials: Annotated[HTTPBasicCredentials, Depends(security)]
 
 async def process_query_task(request: QueryRequest):
     try:
-        start_time = time.time()
-
-        query_response = await search(
-            request.query,
-            request.model,
-            user=str(request.matomo_client_id),
-            use_highlights=True,
-        )
-
-        response_time = time.time() - start_time
-
-        query_ir = QueryIr(
-            query=request.query,
-            brief=query_response.get("brief", ""),
-            response=query_response.get("response", ""),
-            references=query_response.get("references", []),
-            expanded_query=query_response.get("expanded_query", ""),
-            model=request.model,
-            backend_version=getenv("BACKEND_VERSION"),
-            matomo_client_id=request.matomo_client_id,
-            user=request.user,
-            response_time=response_time,
-        )
-
-        with SessionLocal() as db:
-            try:
-                db.add(query_ir)
-                db.commit()
-                db.refresh(query_ir)
-            except Exception as e:
-                logger.error(
-                    f"Database error when saving query_ir: {str(e)}", exc_info=True
-                )
-                db.rollback()
-
+        # Persisted in bulk with other queries, see QUERIES_IR_WRITER
+        QUERIES_IR_WRITER.add(await run_query(request))
     except Exception as e:
         logger.error(f"Error processing query: {str(e)}", exc_info=True)
 
 
 @router.post("/query")
-async def save_query(
-    request: QueryRequest,
-    background_tasks: BackgroundTasks,
-):
-    background_tasks.add_task(process_query_task, request)
+async def save_query(request: QueryRequest, db: AsyncSession = Depends(get_db)):
+    """
+    Queues the query for the query workers, returning the ID of the job. Without
+    the job queue, it runs in the background after interactive requests.
+    """
+    if QUERY_JOB_QUEUE:
+        return {"id": await enqueue_query(db, request)}
+
+    if not SCHEDULER.submit_background(process_query_task, request):
+        raise HTTPException(
+            status_code=503,
+            detail="Too many queries waiting to be processed",
+            headers={"Retry-After": "30"},
+        )
 
     return {}
 
 
+@router.get("/query/jobs/{job_id}")
+async def get_query_job(job_id: UUID4, db: AsyncSession = Depends(get_db)):
+    """Status of a query job and, once done, its result."""
+    job = await get_job(db, job_id)
+    if not job:
+        logger.warning(f"Query job not found: {job_id}")
+        raise HTTPException(status_code=404, detail="Query job not found")
+    return {
+        "id": job.id,
+        "status": job.status,
+        "attempts": job.attempts,
+        "error": job.error,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "result": (
+            await db.get(QueryIr, (job.query_id, job.query_timestamp))
+            if job.query_id
+            else None
+        ),
+    }
+
+
 @router.post("/query-playground")
 async def playground_query(request: QueryRequest):
     """Returns responses in a format suitable for the playground."""
-    response = await search_playground(request.query, request.model)
-    return response
+    async with SCHEDULER.interactive():
+        if not COALESCING_ENABLED:
+            return await search_playground(request.query, request.model)
+
+        response, _ = await PLAYGROUND_FLIGHTS.do(
+            coalescing_key(request), search_playground, request.query, request.model
+        )
+        return response
 
 
 @router.get("/query/{query_id}")
-async def get_query(query_id: UUID4, db: Session = Depends(get_db)):
-    query = db.query(QueryIr).filter(QueryIr.id == query_id).first()
+async def get_query(
+    query_id: UUID4,
+    timestamp: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    A stored query. With its timestamp, it is read from its month's partition
+    rather than looked up in all of them.
+    """
+    query = (
+        await db.get(QueryIr, (query_id, timestamp))
+        if timestamp
+        else await db.scalar(select(QueryIr).where(QueryIr.id == query_id))
+    )
     if not query:
         logger.warning(f"Query not found: {query_id}")
         raise HTTPException(status_code=404, detail="Query not found")
@@ -130,85 +179,109 @@ async def get_query(query_id: UUID4, db: Session = Depends(get_db)):
 
 
 @router.put("/query/{query_id}/feedback")
-async def upsert_feedback(
-    query_id: UUID4, request: FeedbackRequest, db: Session = Depends(get_db)
+async def put_feedback(
+    query_id: UUID4, request: FeedbackRequest, db: AsyncSession = Depends(get_db)
 ):
     """Creates or updates feedback for a query. Hence using a put method."""
-    # Check if query exists
-    query = db.query(QueryIr).filter(QueryIr.id == query_id).first()
-    if not query:
+    try:
+        feedback = await upsert_feedback(
+            db, query_id, request.rating, request.comment, request.query_timestamp
+        )
+    except Exception as e:
+        logger.error(f"Database error when saving feedback: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=500, detail=f"Database error when saving feedback: {str(e)}"
+        ) from e
+
+    if not feedback:
         logger.warning(f"Query not found for feedback: {query_id}")
         raise HTTPException(status_code=404, detail="Query not found")
+    return feedback
 
-    # Update or create feedback
-    feedback = db.query(Feedback).filter(Feedback.query_id == query_id).first()
-    if feedback:
-        feedback.rating = request.rating
-        feedback.comment = request.comment
-    else:
-        feedback = Feedback(
-            query_id=query_id,
-            rating=request.rating,
-            comment=request.comment,
-        )
-        db.add(feedback)
 
+@router.put("/query/feedback", response_model=BulkFeedbackResponse)
+async def put_feedbacks(
+    request: BulkFeedbackRequest, db: AsyncSession = Depends(get_db)
+) -> BulkFeedbackResponse:
+    """Creates or updates feedback for many queries, skipping unknown queries."""
     try:
-        db.commit()
-        db.refresh(feedback)
+        feedback = await upsert_feedbacks(
+            db, [record.model_dump() for record in request.feedback]
+        )
     except Exception as e:
         logger.error(f"Database error when saving feedback: {str(e)}", exc_info=True)
-        db.rollback()
         raise HTTPException(
             status_code=500, detail=f"Database error when saving feedback: {str(e)}"
         ) from e
 
-    return feedback
+    stored = {record["query_id"] for record in feedback}
+    return BulkFeedbackResponse(
+        feedback=feedback,
+        not_found=list(
+            dict.fromkeys(
+                record.query_id
+                for record in request.feedback
+                if record.query_id not in stored
+            )
+        ),
+    )
 
 
 @router.get("/query/{query_id}/feedback")
-async def get_feedback(query_id: UUID4, db: Session = Depends(get_db)):
-    feedback = db.query(Feedback).filter(Feedback.query_id == query_id).first()
+async def get_feedback(query_id: UUID4, db: AsyncSession = Depends(get_db)):
+    feedback = await db.get(Feedback, query_id)
     if not feedback:
         logger.warning(f"Feedback not found for query ID: {query_id}")
         raise HTTPException(status_code=404, detail="Feedback not found")
     return feedback
 
 
+def export_response(
+    table: Table,
+    prefix: str,
+    start_date: datetime,
+    end_date: datetime,
+    export_format: ExportFormat,
+    gzip: bool,
+) -> StreamingResponse:
+    filename = export_filename(prefix, start_date, end_date, export_format, gzip)
+    return StreamingResponse(
+        stream_export(table, start_date, end_date, export_format, gzip),
+        media_type="application/gzip" if gzip else MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
+
+
 @router.get("/export-ir")
 async def export_queries(
     start_date: datetime,
     end_date: datetime,
-    db: Session = Depends(get_db),
+    format: ExportFormat = "csv",
+    gzip: bool = False,
     _: str = Depends(authenticate),
 ):
-    """Export queries_ir in CSV format within the specified date range."""
-    queries = (
-        db.query(QueryIr)
-        .filter(QueryIr.timestamp >= start_date, QueryIr.timestamp <= end_date)
-        .all()
+    """
+    Export queries_ir within the specified date range, as CSV, JSONL or Parquet,
+    optionally gzipped. Rows are streamed as they are read from the database.
+    """
+    return export_response(
+        QueryIr.__table__, "queries_ir", start_date, end_date, format, gzip
     )
 
-    output = StringIO()
-    writer = csv.writer(output)
-
-    columns = [column.name for column in QueryIr.__table__.columns]
-    writer.writerow(columns)
 
-    for query in queries:
-        writer.writerow([getattr(query, column) for column in columns])
-
-    output.seek(0)
-    return StreamingResponse(
-        iter([output.getvalue()]),
-        media_type="text/csv",
-        headers={
-            "Content-Disposition": (
-                f"attachment; filename=queries_ir_"
-                f"{start_date.date()}_{end_date.date()}.csv"
-            )
-        },
-    )
+@router.get("/stats")
+async def stats(
+    start_date: date,
+    end_date: date,
+    model: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+    _: str = Depends(authenticate),
+):
+    """
+    Query volume, latency percentiles and feedback per model and day, and totals
+    per model, from the daily stats refreshed by the query workers.
+    """
+    return await get_stats(db, start_date, end_date, model)
 
 
 @router.post("/query-os")
@@ -226,7 +299,7 @@ async def query_os(
 @router.post("/search-feedback")
 async def create_search_feedback(
     request: SearchFeedbackRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     """Creates a new search feedback entry."""
     feedback = SearchFeedback(
@@ -237,13 +310,12 @@ async def create_search_feedback(
 
     try:
         db.add(feedback)
-        db.commit()
-        db.refresh(feedback)
+        await db.commit()
     except Exception as e:
         logger.error(
             f"Database error when saving search feedback: {str(e)}", exc_info=True
         )
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=500,
             detail=f"Database error when saving search feedback: {str(e)}",
@@ -256,42 +328,52 @@ async def create_search_feedback(
 async def export_feedback(
     start_date: datetime,
     end_date: datetime,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     export_csv: bool = False,
+    format: Optional[ExportFormat] = None,
+    gzip: bool = False,
     _: str = Depends(authenticate),
 ):
-    """Export search feedback within date range. In CSV format if csv=True."""
-    feedbacks = (
-        db.query(SearchFeedback)
-        .filter(
-            SearchFeedback.timestamp >= start_date, SearchFeedback.timestamp <= end_date
+    """
+    Export search feedback within date range. As a file if format is set (CSV if
+    export_csv=True), streamed as rows are read from the database.
+    """
+    if export_csv or format:
+        return export_response(
+            SearchFeedback.__table__,
+            "search_feedback",
+            start_date,
+            end_date,
+            format or "csv",
+            gzip,
         )
-        .all()
-    )
 
-    if csv:
-        output = StringIO()
-        writer = csv.writer(output)
+    return (
+        await db.scalars(
+            select(SearchFeedback).where(
+                SearchFeedback.timestamp >= start_date,
+                SearchFeedback.timestamp <= end_date,
+            )
+        )
+    ).all()
 
-        columns = [column.name for column in SearchFeedback.__table__.columns]
-        writer.writerow(columns)
 
-        for feedback in feedbacks:
-            writer.writerow([getattr(feedback, column) for column in columns])
+async def run_rag_query(
+    request: QueryRequest,
+) -> Union[QueryResponse, QueryPaperResponse]:
+    if request.control_number is not None:
+        chat_history = (
+            [msg.model_dump() for msg in request.history] if request.history else None
+        )
 
-        output.seek(0)
-        return StreamingResponse(
-            iter([output.getvalue()]),
-            media_type="text/csv",
-            headers={
-                "Content-Disposition": (
-                    f"attachment; filename=search_feedback_"
-                    f"{start_date.date()}_{end_date.date()}.csv"
-                )
-            },
+        return await search_rag_paper(
+            request.query,
+            request.model,
+            request.control_number,
+            request.user,
+            chat_history,
         )
-    else:
-        return feedbacks
+    return await search_rag(request.query, request.model, request.user)
 
 
 @router.post(
@@ -306,26 +388,26 @@ async def query_rag(request: QueryRequest) -> Union[QueryResponse, QueryPaperRes
         logger.info("[query_rag] Received RAG query: %s", request.query)
         start = time.time()
 
-        if request.control_number is not None:
-            chat_history = (
-                [msg.model_dump() for msg in request.history]
-                if request.history
-                else None
-            )
-
-            response = await search_rag_paper(
-                request.query,
-                request.model,
-                request.control_number,
-                request.user,
-                chat_history,
-            )
-        else:
-            response = await search_rag(request.query, request.model, request.user)
+        async with SCHEDULER.interactive():
+            if COALESCING_ENABLED:
+                response, shared = await RAG_FLIGHTS.do(
+                    coalescing_key(request), run_rag_query, request
+                )
+                if shared:
+                    response = rebind_trace(response, request.user)
+            else:
+                response = await run_rag_query(request)
 
         end = time.time()
         logger.info("[query_rag] RAG query processed in %.2fs", end - start)
         return response
+    except (
+        OverloadedError,
+        DeadlineExceededError,
+        CircuitOpenError,
+        BackendTimeoutError,
+    ):
+        raise
     except Exception as e:
         logger.error(f"Error processing RAG query: {str(e)}", exc_info=True)
         raise HTTPException(
@@ -335,11 +417,14 @@ async def query_rag(request: QueryRequest) -> Union[QueryResponse, QueryPaperRes
 
 @router.post("/rag-feedback", response_model=RagFeedbackResponse)
 async def rag_feedback(request: RagFeedbackRequest) -> RagFeedbackResponse:
-    """Stores feedback for a RAG pipeline response in Langfuse."""
+    """
+    Stores feedback for a RAG pipeline response in Langfuse. The score is sent in
+    the background; its ID is returned right away.
+    """
     try:
-        score = langfuse_client.score(
-            id=request.score_id,
-            trace_id=request.trace_id,
+        score_id = await TRACER.score(
+            request.trace_id,
+            score_id=request.score_id,
             data_type="BOOLEAN",
             name="helpful",
             value=request.helpful,
@@ -354,7 +439,7 @@ async def rag_feedback(request: RagFeedbackRequest) -> RagFeedbackResponse:
             )
         )
 
-        return RagFeedbackResponse(score_id=score.id)
+        return RagFeedbackResponse(score_id=score_id)
     except Exception as e:
         logger.error(f"Error submitting RAG feedback: {str(e)}", exc_info=True)
         raise HTTPException(
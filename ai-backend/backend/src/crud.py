@@ -0,0 +1,115 @@
+from datetime import datetime
+from typing import Dict, List, Optional
+from uuid import UUID
+
+from backend.src.models import Feedback, QueryIr
+from sqlalchemy import (
+    Boolean,
+    DateTime,
+    String,
+    Uuid,
+    cast,
+    column,
+    literal,
+    or_,
+    select,
+    values,
+)
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+def _upsert_feedback(rows):
+    """
+    INSERT ... SELECT of the feedback rows whose query exists, updating existing
+    feedback in place. rows selects query_id, query_timestamp, rating and comment.
+    """
+    statement = insert(Feedback).from_select(
+        ["query_id", "query_timestamp", "rating", "comment"], rows
+    )
+    return statement.on_conflict_do_update(
+        index_elements=[Feedback.query_id],
+        set_={
+            "rating": statement.excluded.rating,
+            "comment": statement.excluded.comment,
+        },
+    ).returning(
+        Feedback.query_id, Feedback.query_timestamp, Feedback.rating, Feedback.comment
+    )
+
+
+async def upsert_feedback(
+    db: AsyncSession,
+    query_id: UUID,
+    rating: bool,
+    comment: Optional[str],
+    query_timestamp: Optional[datetime] = None,
+) -> Optional[Dict]:
+    """
+    Creates or updates the feedback of a query in a single statement. Returns
+    None if the query does not exist. Without its timestamp, the query is looked
+    up in every partition of queries_ir.
+    """
+    rows = select(
+        QueryIr.id,
+        QueryIr.timestamp,
+        literal(rating, Boolean),
+        literal(comment, String),
+    ).where(QueryIr.id == query_id)
+    if query_timestamp:
+        rows = rows.where(QueryIr.timestamp == query_timestamp)
+    result = await db.execute(_upsert_feedback(rows))
+    feedback = result.mappings().first()
+    await db.commit()
+    return dict(feedback) if feedback else None
+
+
+async def upsert_feedbacks(db: AsyncSession, records: List[Dict]) -> List[Dict]:
+    """
+    Creates or updates the feedback of many queries in a single statement.
+    Records of queries that do not exist are skipped; for a query given more
+    than once, the last record wins. Returns the stored feedback. Queries are
+    looked up in the partitions of the records' query_timestamp if they all
+    have one, otherwise in every partition of queries_ir.
+    """
+    # A statement cannot update the same row twice
+    records = list({record["query_id"]: record for record in records}.values())
+    if not records:
+        return []
+    data = values(
+        column("query_id", Uuid),
+        column("query_timestamp", DateTime),
+        column("rating", Boolean),
+        column("comment", String),
+        name="data",
+    ).data(
+        [
+            (
+                record["query_id"],
+                record.get("query_timestamp"),
+                record["rating"],
+                record.get("comment"),
+            )
+            for record in records
+        ]
+    )
+    # Typed explicitly, as PostgreSQL reads a VALUES column of NULLs as text
+    query_timestamp = cast(data.c.query_timestamp, DateTime)
+    rows = select(
+        data.c.query_id, QueryIr.timestamp, data.c.rating, data.c.comment
+    ).join(
+        QueryIr,
+        (QueryIr.id == data.c.query_id)
+        & or_(
+            query_timestamp.is_(None),
+            QueryIr.timestamp == query_timestamp,
+        ),
+    )
+    timestamps = [record.get("query_timestamp") for record in records]
+    if all(timestamps):
+        # Constant bounds, so that the planner skips the other partitions
+        rows = rows.where(QueryIr.timestamp.between(min(timestamps), max(timestamps)))
+    result = await db.execute(_upsert_feedback(rows))
+    feedback = [dict(row) for row in result.mappings()]
+    await db.commit()
+    return feedback
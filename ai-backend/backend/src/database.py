@@ -1,15 +1,66 @@
 from os import getenv
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from prometheus_client import Counter, Gauge
+from sqlalchemy import event
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 
-engine = create_engine(getenv("DATABASE_URL"))
-SessionLocal = sessionmaker(autocommit=False, autoflush=True, bind=engine)
+POOL_CONNECTIONS = Gauge(
+    "db_pool_connections",
+    "Database connections of the API pool, by state",
+    ["state"],
+)
+POOL_CHECKOUTS = Counter(
+    "db_pool_checkouts_total",
+    "Database connections checked out of the API pool",
+)
+POOL_INVALIDATED = Counter(
+    "db_pool_invalidated_total",
+    "Database connections discarded by the API pool after an error",
+)
 
 
-def get_db():
-    db = SessionLocal()
-    try:
+def database_url(driver: str) -> URL:
+    """
+    DATABASE_URL with the given driver. The URL may name any PostgreSQL driver:
+    the API connects with asyncpg, Alembic and scripts with psycopg2.
+    """
+    return make_url(getenv("DATABASE_URL")).set(drivername=f"postgresql+{driver}")
+
+
+engine = create_async_engine(
+    database_url("asyncpg"),
+    pool_size=int(getenv("DB_POOL_SIZE", "10")),
+    max_overflow=int(getenv("DB_MAX_OVERFLOW", "10")),
+    pool_timeout=float(getenv("DB_POOL_TIMEOUT_SECONDS", "5")),
+    pool_recycle=int(getenv("DB_POOL_RECYCLE_SECONDS", "1800")),
+    pool_pre_ping=True,
+    connect_args={
+        "timeout": float(getenv("DB_CONNECT_TIMEOUT_SECONDS", "5")),
+        # Enforced by the server, so a slow statement also frees its backend
+        "server_settings": {
+            "statement_timeout": getenv("DB_STATEMENT_TIMEOUT_MS", "5000"),
+        },
+    },
+)
+SessionLocal = async_sessionmaker(engine, autoflush=True, expire_on_commit=False)
+
+_pool = engine.sync_engine.pool
+POOL_CONNECTIONS.labels("checked_out").set_function(_pool.checkedout)
+POOL_CONNECTIONS.labels("idle").set_function(_pool.checkedin)
+POOL_CONNECTIONS.labels("overflow").set_function(lambda: max(0, _pool.overflow()))
+
+
+@event.listens_for(engine.sync_engine, "checkout")
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    POOL_CHECKOUTS.inc()
+
+
+@event.listens_for(engine.sync_engine, "invalidate")
+def _on_invalidate(dbapi_connection, connection_record, exception):
+    POOL_INVALIDATED.inc()
+
+
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
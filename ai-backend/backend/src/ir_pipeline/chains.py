@@ -1,25 +1,80 @@
+import logging
+import re
+from os import getenv
+from typing import List, Type
+
 from backend.src.ir_pipeline.schema import LLMPaperResponse, LLMResponse, Terms
 from backend.src.utils.langfuse import get_prompt
 from langchain_core.language_models import BaseLanguageModel
-from langchain_core.output_parsers import PydanticOutputParser
+from langchain_core.output_parsers import PydanticOutputParser, StrOutputParser
+from langchain_core.outputs import Generation
+from langchain_core.prompts import PromptTemplate
 from langchain_core.runnables import RunnableConfig
+from pydantic import BaseModel, ValidationError
 
+logger = logging.getLogger(__name__)
 
-def create_query_expansion_chain(llm: BaseLanguageModel):
-    prompt_template, langfuse_prompt = get_prompt("expand-query")
-    output_parser = PydanticOutputParser(pydantic_object=Terms)
-    config = RunnableConfig(
-        run_name="expand-query", metadata={"langfuse_prompt": langfuse_prompt}
-    )
-    chain = prompt_template | llm | output_parser
-    return chain.with_config(config)
+# Constrain completions to the output schema with vLLM's guided decoding
+STRUCTURED_OUTPUT = getenv("LLM_STRUCTURED_OUTPUT", "true").lower() == "true"
 
+# Prompt variables from the most to the least shared between requests. vLLM can
+# only reuse the KV cache of a common prompt prefix, so they should appear in this
+# order, after the static instructions.
+PREFIX_CACHE_LAYOUT = ("context", "history", "question", "query")
 
-def create_answer_generation_chain(
-    llm: BaseLanguageModel, prompt_name: str = "generate-answer"
+
+def check_prefix_cache_layout(prompt_name: str, prompt_template: PromptTemplate):
+    """Warns if a prompt breaks the prefix-cache-friendly variable layout."""
+    positions = {
+        variable: match.start()
+        for match in re.finditer(r"\{(\w+)\}", prompt_template.template)
+        if (variable := match.group(1)) in PREFIX_CACHE_LAYOUT
+    }
+    variables = sorted(positions, key=positions.get)
+    expected = sorted(variables, key=PREFIX_CACHE_LAYOUT.index)
+    if variables != expected:
+        logger.warning(
+            f"Prompt '{prompt_name}' has variables in order {variables}, the "
+            f"prefix cache is only reused with the order {expected}"
+        )
+
+
+class GuidedJsonOutputParser(PydanticOutputParser):
+    """
+    Validates the completion as JSON directly, which is all guided decoding can
+    produce, and only falls back to the lenient parsing of PydanticOutputParser
+    (markdown fences, surrounding text...) if that fails.
+    """
+
+    def parse_result(self, result: List[Generation], *, partial: bool = False):
+        try:
+            return self.pydantic_object.model_validate_json(result[0].text)
+        except ValidationError:
+            return super().parse_result(result, partial=partial)
+
+
+def create_structured_chain(
+    llm: BaseLanguageModel, prompt_name: str, pydantic_object: Type[BaseModel]
 ):
+    """
+    Chain of a Langfuse prompt and the LLM whose output is parsed into
+    pydantic_object. With structured output, the model's JSON schema is passed to
+    vLLM's guided decoding, so the completion is valid JSON by construction and
+    prompts using a {format_instructions} variable get no instructions.
+    """
     prompt_template, langfuse_prompt = get_prompt(prompt_name)
-    output_parser = PydanticOutputParser(pydantic_object=LLMResponse)
+    check_prefix_cache_layout(prompt_name, prompt_template)
+    output_parser = GuidedJsonOutputParser(pydantic_object=pydantic_object)
+
+    if "format_instructions" in prompt_template.input_variables:
+        prompt_template = prompt_template.partial(
+            format_instructions=(
+                "" if STRUCTURED_OUTPUT else output_parser.get_format_instructions()
+            )
+        )
+    if STRUCTURED_OUTPUT:
+        llm = llm.bind(extra_body={"guided_json": pydantic_object.model_json_schema()})
+
     config = RunnableConfig(
         run_name=prompt_name, metadata={"langfuse_prompt": langfuse_prompt}
     )
@@ -27,21 +82,32 @@ def create_answer_generation_chain(
     return chain.with_config(config)
 
 
+def create_query_expansion_chain(llm: BaseLanguageModel):
+    return create_structured_chain(llm, "expand-query", Terms)
+
+
+def create_answer_generation_chain(
+    llm: BaseLanguageModel, prompt_name: str = "generate-answer"
+):
+    return create_structured_chain(llm, prompt_name, LLMResponse)
+
+
 def create_rag_answer_generation_chain(llm: BaseLanguageModel):
-    prompt_template, langfuse_prompt = get_prompt("rag-query")
-    output_parser = PydanticOutputParser(pydantic_object=LLMResponse)
-    config = RunnableConfig(
-        run_name="rag-query", metadata={"langfuse_prompt": langfuse_prompt}
-    )
-    chain = prompt_template | llm | output_parser
-    return chain.with_config(config)
+    return create_structured_chain(llm, "rag-query", LLMResponse)
 
 
 def create_rag_paper_answer_generation_chain(llm: BaseLanguageModel):
-    prompt_template, langfuse_prompt = get_prompt("rag-paper-query")
-    output_parser = PydanticOutputParser(pydantic_object=LLMPaperResponse)
+    return create_structured_chain(llm, "rag-paper-query", LLMPaperResponse)
+
+
+def create_history_summary_chain(llm: BaseLanguageModel):
+    """
+    Chain folding chat messages into a rolling summary. Its prompt takes the
+    previous `summary` (possibly empty) and the `messages` to add to it.
+    """
+    prompt_template, langfuse_prompt = get_prompt("summarize-history")
     config = RunnableConfig(
-        run_name="rag-paper-query", metadata={"langfuse_prompt": langfuse_prompt}
+        run_name="summarize-history", metadata={"langfuse_prompt": langfuse_prompt}
     )
-    chain = prompt_template | llm | output_parser
+    chain = prompt_template | llm | StrOutputParser()
     return chain.with_config(config)
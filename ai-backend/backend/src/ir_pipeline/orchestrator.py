@@ -1,8 +1,12 @@
+import functools
+import logging
 import uuid
 from os import getenv
+from typing import Callable, Optional
 
 from backend.src.ir_pipeline.chains import (
     create_answer_generation_chain,
+    create_history_summary_chain,
     create_query_expansion_chain,
     create_rag_answer_generation_chain,
     create_rag_paper_answer_generation_chain,
@@ -12,42 +16,93 @@ from backend.src.ir_pipeline.tools.inspire import (
     InspireOSFullTextSearchTool,
     InspireSearchTool,
 )
+from backend.src.ir_pipeline.utils.compression import (
+    compress_docs,
+    compress_hits,
+    get_compression_ratio,
+)
+from backend.src.ir_pipeline.utils.context_packer import (
+    get_token_budget,
+    get_token_counter,
+    pack_docs,
+    pack_hits,
+)
+from backend.src.ir_pipeline.utils.history import get_history_manager
+from backend.src.ir_pipeline.utils.hits import parse_hits
 from backend.src.ir_pipeline.utils.inspire_formatter import (
+    chunk_order,
     clean_refs,
     clean_refs_with_snippets,
     extract_context,
     format_docs,
     format_refs,
 )
+from backend.src.ir_pipeline.utils.model_router import get_model_router
+from backend.src.ir_pipeline.utils.query_classifier import fast_expand
+from backend.src.ir_pipeline.utils.record_store import get_record_store
 from backend.src.ir_pipeline.utils.utils import timer
 from backend.src.schemas.query import QueryPaperResponse, QueryResponse
+from backend.src.utils.admission import (
+    BACKGROUND,
+    get_admission_controller,
+    priority,
+)
+from backend.src.utils.deadline import (
+    ANSWER_RESERVE_SECONDS,
+    degrade,
+    no_deadline,
+    remaining,
+    time_is_short,
+    with_deadline,
+)
 from backend.src.utils.embeddings import VLLMOpenAIEmbeddings
+from backend.src.utils.langfuse import PROMPTS
 from backend.src.utils.reranker import CustomJinaRerank
+from backend.src.utils.resilience import ResilientBackend
+from backend.src.utils.tracing import TRACER
 from langchain.schema import Document
 from langchain_community.llms import VLLMOpenAI
 from langchain_community.vectorstores import OpenSearchVectorSearch
-from langfuse.callback import CallbackHandler
+from langchain_core.exceptions import OutputParserException
 
-LANGFUSE_HANDLER = CallbackHandler(
-    public_key=getenv("LANGFUSE_PUBLIC_KEY"),
-    secret_key=getenv("LANGFUSE_SECRET_KEY"),
-    host=getenv("LANGFUSE_HOST"),
-    release=getenv("BACKEND_VERSION"),
-)
+logger = logging.getLogger(__name__)
 
 CHAIN_CACHE = {}
+LLM_CACHE = {}
 RESOURCE_CACHE = {}
 
+# Embedding, search and rerank calls are idempotent, so they can be hedged
+BACKENDS = {
+    "embedding": ResilientBackend("embedding", timeout=15, hedge=True),
+    "vector_store": ResilientBackend("vector_store", timeout=30, hedge=True),
+    "reranker": ResilientBackend("reranker", timeout=40, hedge=True),
+    "inspire": ResilientBackend("inspire", timeout=30, hedge=True),
+}
+# One per model, so a failing or slow model (e.g. the small one queries are
+# routed to) neither trips the breaker nor stretches the timeout of the others
+LLM_BACKENDS = {}
+
+
+def get_llm_backend(model) -> ResilientBackend:
+    if model not in LLM_BACKENDS:
+        LLM_BACKENDS[model] = ResilientBackend(
+            f"llm:{model}", timeout=20, ignored_exceptions=(OutputParserException,)
+        )
+    return LLM_BACKENDS[model]
+
 
 def create_langfuse_config(user: str = None):
-    return {
-        "callbacks": [LANGFUSE_HANDLER],
-        "metadata": {
-            "langfuse_session_id": str(uuid.uuid4()),
-            **({"langfuse_user_id": user} if user else {}),
-        },
-        "run_id": str(uuid.uuid4()),  # Manual trace ID for feedback
-    }
+    return TRACER.config(user)
+
+
+def rebind_trace(response, user: str = None):
+    """
+    Gives a caller that shared another request's result (see SingleFlight) its own
+    trace ID for feedback, linked in Langfuse to the trace that did the work.
+    """
+    trace_id = str(uuid.uuid4())
+    TRACER.link(trace_id, user, coalesced_with=response.trace_id)
+    return response.model_copy(update={"trace_id": trace_id})
 
 
 def initialize_rag_resources():
@@ -63,7 +118,7 @@ def initialize_rag_resources():
                 if getenv("KUBEFLOW_EMBEDDING_HOST")
                 else {}
             ),
-            timeout=15,
+            timeout=BACKENDS["embedding"].timeout,
         )
 
     if "vector_store" not in RESOURCE_CACHE:
@@ -79,7 +134,7 @@ def initialize_rag_resources():
             verify_certs=False,
             ssl_show_warn=False,
             url_prefix="/os",
-            timeout=30,
+            timeout=BACKENDS["vector_store"].timeout,
         )
 
     if "reranker" not in RESOURCE_CACHE:
@@ -93,17 +148,83 @@ def initialize_rag_resources():
                 else {}
             ),
             top_n=10,
-            timeout=40,
+            timeout=BACKENDS["reranker"].timeout,
         )
 
 
+async def embed_documents(texts):
+    return await BACKENDS["embedding"].acall(
+        RESOURCE_CACHE["embedding_model"].embed_documents, texts
+    )
+
+
+async def invoke_llm(model, chain, inputs, config):
+    """
+    Runs an LLM chain once the model admits it, through the model's breaker and
+    timeout. Queue time does not count towards the generation timeout.
+    """
+    async with get_admission_controller(model).slot():
+        return await get_llm_backend(model).acall(chain.ainvoke, inputs, config=config)
+
+
+def shrink_context(model, config) -> int:
+    """
+    Tokens to take off the context budget, half of it when there is little time
+    left to generate the answer.
+    """
+    left = remaining()
+    if left is not None and left < ANSWER_RESERVE_SECONDS:
+        degrade(config, "shrink_context")
+        return get_token_budget(model) // 2
+    return 0
+
+
+# Chain name -> (prompt it is built from, builder taking the LLM)
+CHAIN_BUILDERS = {
+    "expand_chain": ("expand-query", create_query_expansion_chain),
+    "answer_chain": (
+        "generate-answer",
+        functools.partial(
+            create_answer_generation_chain, prompt_name="generate-answer"
+        ),
+    ),
+    "answer_chain_playground": (
+        "generate-answer-playground",
+        functools.partial(
+            create_answer_generation_chain, prompt_name="generate-answer-playground"
+        ),
+    ),
+    "answer_chain_rag": ("rag-query", create_rag_answer_generation_chain),
+    "answer_chain_rag_paper": (
+        "rag-paper-query",
+        create_rag_paper_answer_generation_chain,
+    ),
+    "history_summary_chain": ("summarize-history", create_history_summary_chain),
+}
+# Paper chats fall back to an extractive history summary without it
+OPTIONAL_CHAINS = {"history_summary_chain"}
+
+
+def build_chains(model, chain_names):
+    chains = {}
+    for name in chain_names:
+        _, builder = CHAIN_BUILDERS[name]
+        try:
+            chains[name] = builder(llm=LLM_CACHE[model])
+        except Exception as e:
+            if name not in OPTIONAL_CHAINS:
+                raise
+            logger.warning(f"Chain {name} disabled for {model}: {str(e)}")
+    return chains
+
+
 def initialize_chains(model):
     global CHAIN_CACHE
 
     if model in CHAIN_CACHE:
         return
 
-    llm = VLLMOpenAI(
+    LLM_CACHE[model] = VLLMOpenAI(
         model_name=model,
         openai_api_base=f"{getenv('API_BASE')}/v1",
         default_headers=(
@@ -112,20 +233,30 @@ def initialize_chains(model):
         openai_api_key=getenv("KUBEFLOW_API_KEY"),
         temperature=0,
         top_p=1,
-        timeout=20,
+        timeout=get_llm_backend(model).timeout,
     )
 
-    CHAIN_CACHE[model] = {
-        "expand_chain": create_query_expansion_chain(llm=llm),
-        "answer_chain": create_answer_generation_chain(
-            llm=llm, prompt_name="generate-answer"
-        ),
-        "answer_chain_playground": create_answer_generation_chain(
-            llm=llm, prompt_name="generate-answer-playground"
-        ),
-        "answer_chain_rag": create_rag_answer_generation_chain(llm=llm),
-        "answer_chain_rag_paper": create_rag_paper_answer_generation_chain(llm=llm),
-    }
+    CHAIN_CACHE[model] = build_chains(model, CHAIN_BUILDERS)
+
+
+def rebuild_chains(changed_prompts):
+    """
+    Rebuilds the chains using changed prompts and swaps each model's chains in
+    one assignment: requests in flight finish with the chains they started with.
+    """
+    affected = [
+        name
+        for name, (prompt_name, _) in CHAIN_BUILDERS.items()
+        if prompt_name in changed_prompts
+    ]
+    for model in list(CHAIN_CACHE):
+        CHAIN_CACHE[model] = {
+            **CHAIN_CACHE[model],
+            **build_chains(model, affected),
+        }
+
+
+PROMPTS.subscribe(rebuild_chains)
 
 
 async def search_common(
@@ -139,57 +270,111 @@ async def search_common(
     if model not in CHAIN_CACHE:
         initialize_chains(model)
 
+    # With a local record store, citation metadata comes from it instead of the
+    # search response
+    record_store = get_record_store()
     if use_highlights:
-        inspire_search_tool = InspireOSFullTextSearchTool()
+        inspire_search_tool = InspireOSFullTextSearchTool(
+            source_fields=["control_number"] if record_store else None
+        )
     else:
-        inspire_search_tool = InspireSearchTool()
+        inspire_search_tool = InspireSearchTool(
+            fields=["control_number", "titles", "abstracts"] if record_store else None
+        )
 
     config = create_langfuse_config(user)
 
     expand_chain = CHAIN_CACHE[model]["expand_chain"]
+
+    # Keyword searches don't need the LLM to get search terms
+    expanded_query = fast_expand(query)
+    if expanded_query is None:
+        if time_is_short(get_llm_backend(model).expected_latency(default=5)):
+            degrade(config, "skip_expansion")
+            expanded_query = Terms(terms=[query])
+        else:
+            expanded_query = await invoke_llm(
+                model, expand_chain, {"query": query}, config
+            )
+    raw_results = await BACKENDS["inspire"].acall(
+        inspire_search_tool.run, expanded_query
+    )
+    hits = parse_hits(raw_results, use_highlights=use_highlights)
+    del raw_results
+    if record_store:
+
+        async def fetch_records(control_numbers):
+            results = await BACKENDS["inspire"].acall(
+                inspire_search_tool.fetch_records, control_numbers
+            )
+            return parse_hits(results, use_highlights=use_highlights)
+
+        hits = await record_store.enrich(hits, fetch=fetch_records)
+
+    model = get_model_router().route(query, model, config=config)
+    initialize_chains(model)
     answer_chain = (
         CHAIN_CACHE[model]["answer_chain_playground"]
         if is_playground
         else CHAIN_CACHE[model]["answer_chain"]
     )
 
-    expanded_query: Terms = await expand_chain.ainvoke({"query": query}, config=config)
-    raw_results = inspire_search_tool.run(expanded_query)
+    context_hits = hits
+    compression_ratio = get_compression_ratio()
+    if compression_ratio and time_is_short(
+        BACKENDS["embedding"].expected_latency(default=2)
+    ):
+        degrade(config, "skip_compression")
+    elif compression_ratio:
+        initialize_rag_resources()
+        with timer("Context compression"):
+            context_hits = await compress_hits(
+                hits,
+                query,
+                embed_documents,
+                compression_ratio,
+                use_highlights=use_highlights,
+            )
 
-    context = extract_context(raw_results, use_highlights=use_highlights)
+    context_hits, context_tokens = pack_hits(
+        context_hits,
+        model,
+        use_highlights=use_highlights,
+        reserved_tokens=shrink_context(model, config),
+    )
+    context = extract_context(context_hits, use_highlights=use_highlights)
+    config["metadata"]["context_tokens"] = context_tokens
 
-    answer: LLMResponse = await answer_chain.ainvoke(
-        {"query": query, "context": context}, config=config
+    answer: LLMResponse = await invoke_llm(
+        model, answer_chain, {"query": query, "context": context}, config
     )
 
-    return answer, raw_results, expanded_query
+    return answer, hits, expanded_query
 
 
+@with_deadline
 async def search(query, model, user, use_highlights=False):
-    answer, raw_results, expanded_query = await search_common(
+    answer, hits, expanded_query = await search_common(
         query, model, user, use_highlights=use_highlights
     )
 
-    clean_response, references = clean_refs(
-        answer.response, raw_results, use_highlights=use_highlights
-    )
+    clean_response, references = clean_refs(answer.response, hits)
 
     return {
         "brief": answer.brief,
         "response": clean_response,
         "references": references,
-        "expanded_query": " OR ".join(
-            [f'ft "{term}"' for term in expanded_query.terms]
-        ),
+        "expanded_query": expanded_query.inspire_query(),
     }
 
 
+@with_deadline
 async def search_playground(query, model):
-    answer, raw_results, _ = await search_common(
+    answer, hits, _ = await search_common(
         query, model, use_highlights=True, is_playground=True
     )
 
-    clean_response, citations = clean_refs_with_snippets(answer.response, raw_results)
+    clean_response, citations = clean_refs_with_snippets(answer.response, hits)
 
     return {
         "brief": answer.brief,
@@ -199,8 +384,17 @@ async def search_playground(query, model):
 
 
 async def _rag_common(
-    query: str, model: str, user: str = None, control_number: int = None
+    query: str,
+    model: str,
+    user: str = None,
+    control_number: int = None,
+    reserve_tokens: Optional[Callable[[str], int]] = None,
 ):
+    """
+    Retrieves, reranks and packs the context of a RAG query, routing it to the
+    model that answers it. reserve_tokens, called with that model, returns the
+    tokens to keep out of the context (e.g. for the chat history).
+    """
     initialize_rag_resources()
     initialize_chains(model)
 
@@ -211,7 +405,9 @@ async def _rag_common(
     config = create_langfuse_config(user)
 
     with timer("RAG Embedding"):
-        query_embedding = embedding_model.embed_query(query)
+        query_embedding = await BACKENDS["embedding"].acall(
+            embedding_model.embed_query, query
+        )
 
     with timer("RAG Retrieval"):
         if control_number:
@@ -227,12 +423,14 @@ async def _rag_common(
             }
 
             try:
-                response = os_client.search(index=index_name, body=search_body)
+                response = await BACKENDS["vector_store"].acall(
+                    os_client.search, index=index_name, body=search_body
+                )
 
                 docs = [
                     Document(
                         page_content=hit["_source"]["text"],
-                        metadata=hit["_source"]["metadata"],
+                        metadata={**hit["_source"]["metadata"], "chunk_id": hit["_id"]},
                     )
                     for hit in response["hits"]["hits"]
                 ]
@@ -241,33 +439,85 @@ async def _rag_common(
                 print(f"OpenSearch query failed: {e}")
                 docs = []
         else:
-            docs = vector_store.similarity_search_by_vector(
+            docs = await BACKENDS["vector_store"].acall(
+                vector_store.similarity_search_by_vector,
                 embedding=query_embedding,
                 k=25,
             )
 
-    with timer("RAG Reranking"):
-        ranked_docs = reranker.compress_documents(
-            documents=docs,
-            query=query,
-        )
+    if time_is_short(BACKENDS["reranker"].expected_latency(default=5)):
+        degrade(config, "skip_rerank")
+        ranked_docs = docs[: reranker.top_n]
+    else:
+        with timer("RAG Reranking"):
+            ranked_docs = await BACKENDS["reranker"].acall(
+                reranker.compress_documents,
+                documents=docs,
+                query=query,
+            )
+
+    model = get_model_router().route(
+        query,
+        model,
+        scores=[
+            doc.metadata["relevance_score"]
+            for doc in ranked_docs
+            if "relevance_score" in doc.metadata
+        ],
+        config=config,
+    )
+    initialize_chains(model)
+
+    compression_ratio = get_compression_ratio()
+    if compression_ratio and time_is_short(
+        BACKENDS["embedding"].expected_latency(default=2)
+    ):
+        degrade(config, "skip_compression")
+    elif compression_ratio:
+        with timer("RAG Compression"):
+            ranked_docs = await compress_docs(
+                ranked_docs,
+                query,
+                embed_documents,
+                compression_ratio,
+                query_embedding=query_embedding,
+            )
 
+    reserved_tokens = reserve_tokens(model) if reserve_tokens else 0
+    ranked_docs, context_tokens = pack_docs(
+        ranked_docs, model, reserved_tokens + shrink_context(model, config)
+    )
+    if control_number:
+        # Same paper on every turn: a stable chunk order keeps the prompt prefix
+        # (and vLLM's prefix cache) shared between turns
+        ranked_docs = sorted(ranked_docs, key=chunk_order)
     context = format_docs(ranked_docs)
+    config["metadata"]["context_tokens"] = context_tokens
 
-    return ranked_docs, context, config
+    return ranked_docs, context, config, model
 
 
+@with_deadline
 async def search_rag(query: str, model: str, user: str = None):
-    ranked_docs, context, config = await _rag_common(query, model, user)
+    ranked_docs, context, config, model = await _rag_common(query, model, user)
 
     answer_chain = CHAIN_CACHE[model]["answer_chain_rag"]
 
     with timer("RAG LLM"):
-        response: LLMResponse = await answer_chain.ainvoke(
-            {"question": query, "context": context}, config=config
+        response: LLMResponse = await invoke_llm(
+            model, answer_chain, {"question": query, "context": context}, config
         )
 
-    formatted_response, citations = format_refs(response.response, ranked_docs)
+    record_store = get_record_store()
+    summaries = (
+        record_store.get_many(doc.metadata.get("control_number") for doc in ranked_docs)
+        if record_store
+        else None
+    )
+    formatted_response, citations = format_refs(
+        response.response, ranked_docs, summaries
+    )
+    TRACER.retain(config, "rag-query", query, formatted_response)
 
     return QueryResponse(
         brief_answer=response.brief,
@@ -277,6 +527,18 @@ async def search_rag(query: str, model: str, user: str = None):
     )
 
 
+async def summarize_history(model, user, summary, messages):
+    # Runs in the background, and may outlive the request that started it
+    with no_deadline(), priority(BACKGROUND):
+        return await invoke_llm(
+            model,
+            CHAIN_CACHE[model]["history_summary_chain"],
+            {"summary": summary or "", "messages": messages},
+            create_langfuse_config(user),
+        )
+
+
+@with_deadline
 async def search_rag_paper(
     query: str,
     model: str,
@@ -284,27 +546,54 @@ async def search_rag_paper(
     user: str = None,
     chat_history: list = None,
 ):
-    ranked_docs, context, config = await _rag_common(query, model, user, control_number)
-
-    answer_chain = CHAIN_CACHE[model]["answer_chain_rag_paper"]
-
     chat_messages = []
     if chat_history:
         for msg in chat_history:
             role = "user" if msg["type"] == "user" else "assistant"
             chat_messages.append({"role": role, "content": msg["content"]})
 
+    def prepare_history(answer_model) -> int:
+        # Older turns are folded into a summary, updated in the background; the
+        # rest of the history shares the token budget of the model the query is
+        # routed to with the context
+        nonlocal chat_messages
+        can_summarize = "history_summary_chain" in CHAIN_CACHE[answer_model]
+        chat_messages, history_tokens = get_history_manager().prepare(
+            chat_messages,
+            get_token_counter(answer_model),
+            summarize=(
+                functools.partial(summarize_history, answer_model, user)
+                if can_summarize
+                else None
+            ),
+        )
+        return history_tokens
+
+    ranked_docs, context, config, model = await _rag_common(
+        query, model, user, control_number, reserve_tokens=prepare_history
+    )
+
+    answer_chain = CHAIN_CACHE[model]["answer_chain_rag_paper"]
+
     with timer("RAG LLM"):
-        response: LLMPaperResponse = await answer_chain.ainvoke(
+        response: LLMPaperResponse = await invoke_llm(
+            model,
+            answer_chain,
             {
                 "question": query,
                 "context": context,
                 "history": chat_messages,
             },
-            config=config,
+            config,
         )
 
     formatted_response, _ = format_refs(response.response, ranked_docs)
+    TRACER.retain(
+        config,
+        "rag-paper-query",
+        {"question": query, "control_number": control_number},
+        formatted_response,
+    )
 
     return QueryPaperResponse(
         long_answer=formatted_response, trace_id=config.get("run_id")
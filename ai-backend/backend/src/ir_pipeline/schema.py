@@ -12,3 +12,7 @@ class LLMPaperResponse(BaseModel):
 
 class Terms(BaseModel):
     terms: list[str]
+
+    def inspire_query(self) -> str:
+        """Full text search of any of the terms, in INSPIRE search syntax."""
+        return " OR ".join(f'ft "{term}"' for term in self.terms)
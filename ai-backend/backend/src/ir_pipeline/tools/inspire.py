@@ -1,5 +1,5 @@
 from os import getenv
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 
 import requests
 from backend.src.ir_pipeline.schema import Terms
@@ -8,6 +8,15 @@ from langchain_core.tools import BaseTool
 from opensearchpy import OpenSearch
 from pydantic import Field
 
+# Record fields needed to cite a record (see RecordStore)
+CITATION_FIELDS = [
+    "control_number",
+    "titles.title",
+    "authors.full_name",
+    "publication_info.year",
+    "dois.value",
+]
+
 
 class InspireSearchTool(BaseTool):
     """Tool for searching on the INSPIRE HEP API."""
@@ -15,16 +24,20 @@ class InspireSearchTool(BaseTool):
     name: str = "inspire_search"
     description: str = "Search INSPIRE HEP database using fulltext search"
     size: int = Field(default=10, description="Number of results to return")
+    fields: Optional[List[str]] = Field(
+        default=None, description="Metadata fields to return (all if None)"
+    )
 
     def _run(
         self,
-        terms: list[str],
+        query: str,
         run_manager: Optional[CallbackManagerForToolRun] = None,
     ) -> Dict:
         """Executes the search and returns the raw JSON response."""
-        query = " OR ".join([f'ft "{term}"' for term in terms])
         base_url = "https://inspirehep.net/api/literature"
         params = {"q": query, "size": self.size, "format": "json"}
+        if self.fields:
+            params["fields"] = ",".join(self.fields)
         response = requests.get(base_url, params=params)
         response.raise_for_status()
         results = response.json()
@@ -32,13 +45,25 @@ class InspireSearchTool(BaseTool):
             run_manager.on_text(f"Returned {len(results['hits']['hits'])} results.")
         return results
 
+    def fetch_records(self, control_numbers: List[int]) -> Dict:
+        """Fetches the citation metadata of records, as a raw JSON response."""
+        params = {
+            "q": " or ".join(f"recid:{number}" for number in control_numbers),
+            "size": len(control_numbers),
+            "fields": ",".join(CITATION_FIELDS),
+            "format": "json",
+        }
+        response = requests.get("https://inspirehep.net/api/literature", params=params)
+        response.raise_for_status()
+        return response.json()
+
     def run(
         self,
         terms: Terms,
         run_manager: Optional[CallbackManagerForToolRun] = None,
     ) -> Dict:
         """Override run to handle Terms parameter"""
-        return self._run(terms.terms, run_manager=run_manager)
+        return self._run(terms.inspire_query(), run_manager=run_manager)
 
 
 class InspireOSFullTextSearchTool(BaseTool):
@@ -47,6 +72,9 @@ class InspireOSFullTextSearchTool(BaseTool):
     name: str = "inspire_elastic_search"
     description: str = "Search INSPIRE HEP OpenSearch database"
     size: int = Field(default=5, description="Number of results to return")
+    source_fields: Optional[List[str]] = Field(
+        default=None, description="Record fields to return in _source (all if None)"
+    )
 
     class Config:
         extra = "allow"
@@ -115,6 +143,8 @@ class InspireOSFullTextSearchTool(BaseTool):
                 }
             },
         }
+        if self.source_fields is not None:
+            body["_source"] = self.source_fields
 
         response = self.client.search(body=body, index="records-hep")
 
@@ -122,6 +152,15 @@ class InspireOSFullTextSearchTool(BaseTool):
             run_manager.on_text(f"Returned {len(response['hits']['hits'])} results.")
         return response
 
+    def fetch_records(self, control_numbers: List[int]) -> Dict:
+        """Fetches the citation metadata of records, as a raw search response."""
+        body = {
+            "query": {"terms": {"control_number": control_numbers}},
+            "size": len(control_numbers),
+            "_source": CITATION_FIELDS,
+        }
+        return self.client.search(body=body, index="records-hep")
+
     def run(
         self,
         terms: Terms,
@@ -0,0 +1,105 @@
+import math
+from dataclasses import replace
+from os import getenv
+from typing import Awaitable, Callable, List, Optional, Sequence
+
+import numpy as np
+from backend.src.ir_pipeline.utils.context_packer import SENTENCE_BOUNDARY
+from backend.src.ir_pipeline.utils.hits import Hit
+from langchain_core.documents import Document
+
+EmbedDocuments = Callable[[List[str]], Awaitable[List[List[float]]]]
+
+
+def get_compression_ratio() -> Optional[float]:
+    """Fraction of sentences kept per passage, or None if compression is disabled."""
+    ratio = getenv("CONTEXT_COMPRESSION_RATIO")
+    if not ratio or not 0 < float(ratio) < 1:
+        return None
+    return float(ratio)
+
+
+async def compress_passages(
+    passages: Sequence[str],
+    query: str,
+    embed_documents: EmbedDocuments,
+    ratio: float,
+    query_embedding: Optional[List[float]] = None,
+) -> List[str]:
+    """
+    Keeps, in each passage, the sentences most similar to the query (a `ratio`
+    fraction of them, at least one) in their original order.
+
+    Passages are never dropped or reordered, so citation indices into them stay
+    valid. All the sentences (and the query, unless its embedding is given) are
+    embedded in a single call.
+    """
+    sentences = [
+        [sentence for sentence in SENTENCE_BOUNDARY.split(passage) if sentence.strip()]
+        for passage in passages
+    ]
+    flat = [sentence for passage in sentences for sentence in passage]
+    if not flat:
+        return list(passages)
+
+    if query_embedding is None:
+        query_embedding, *embeddings = await embed_documents([query] + flat)
+    else:
+        embeddings = await embed_documents(flat)
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    query_embedding = np.asarray(query_embedding, dtype=np.float32)
+    similarities = (embeddings @ query_embedding) / (
+        np.linalg.norm(embeddings, axis=1) * np.linalg.norm(query_embedding) + 1e-12
+    )
+
+    compressed = []
+    offset = 0
+    for passage in sentences:
+        scores = similarities[offset : offset + len(passage)]
+        offset += len(passage)
+        keep = max(1, math.ceil(ratio * len(passage)))
+        kept = np.sort(np.argsort(-scores, kind="stable")[:keep])
+        compressed.append(" ".join(passage[i] for i in kept))
+    return compressed
+
+
+async def compress_docs(
+    docs: Sequence[Document],
+    query: str,
+    embed_documents: EmbedDocuments,
+    ratio: float,
+    query_embedding: Optional[List[float]] = None,
+) -> List[Document]:
+    compressed = await compress_passages(
+        [doc.page_content for doc in docs],
+        query,
+        embed_documents,
+        ratio,
+        query_embedding=query_embedding,
+    )
+    return [
+        Document(page_content=text, metadata=doc.metadata)
+        for doc, text in zip(docs, compressed, strict=True)
+    ]
+
+
+async def compress_hits(
+    hits: Sequence[Hit],
+    query: str,
+    embed_documents: EmbedDocuments,
+    ratio: float,
+    use_highlights: bool = False,
+) -> List[Hit]:
+    """Compresses the snippets (or abstract) of each hit, keeping snippet indices."""
+    passages = [
+        text
+        for hit in hits
+        for text in (hit.snippets if use_highlights else (hit.abstract or "",))
+    ]
+    compressed = iter(await compress_passages(passages, query, embed_documents, ratio))
+    if use_highlights:
+        return [
+            replace(hit, snippets=tuple(next(compressed) for _ in hit.snippets))
+            for hit in hits
+        ]
+    return [replace(hit, abstract=next(compressed) or None) for hit in hits]
@@ -0,0 +1,198 @@
+import asyncio
+import json
+import logging
+import re
+import threading
+import time
+from dataclasses import replace
+from os import getenv
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from backend.src.ir_pipeline.utils.hits import Hit
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+# Headers and separators added around each item by format_docs/extract_context
+ITEM_OVERHEAD_TOKENS = 8
+# Rough tokens per character for English, used if the tokenizer can't be loaded
+FALLBACK_CHARS_PER_TOKEN = 4
+
+TokenCounter = Callable[[str], int]
+
+
+# Token counters of the models whose tokenizer is loaded, and when each model's
+# tokenizer was last tried
+_TOKEN_COUNTERS: Dict[str, TokenCounter] = {}
+_LOAD_ATTEMPTS: Dict[str, float] = {}
+_LOAD_LOCK = threading.Lock()
+# A tokenizer that failed to load is tried again after this long
+TOKENIZER_RETRY_SECONDS = float(getenv("TOKENIZER_RETRY_SECONDS", "300"))
+
+
+def approximate_tokens(text: str) -> int:
+    return len(text) // FALLBACK_CHARS_PER_TOKEN + 1
+
+
+def load_token_counter(model: str) -> Optional[TokenCounter]:
+    """
+    Loads the served model's tokenizer (TOKENIZER_MODEL if the served name is not
+    a Hugging Face repo). Blocking, so it runs at startup or in a thread. Returns
+    None if it cannot be loaded; only loaded tokenizers are kept.
+    """
+    tokenizer_name = getenv("TOKENIZER_MODEL") or model
+    _LOAD_ATTEMPTS[model] = time.monotonic()
+    try:
+        from transformers import AutoTokenizer
+
+        tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+    except Exception as e:
+        logger.warning(
+            f"Could not load tokenizer '{tokenizer_name}', approximating token "
+            f"counts from text length: {str(e)}"
+        )
+        return None
+
+    counter = _TOKEN_COUNTERS[model] = lambda text: len(
+        tokenizer.encode(text, add_special_tokens=False)
+    )
+    return counter
+
+
+async def preload_token_counters(models: Iterable[Optional[str]]):
+    """Loads the tokenizers of the served models before serving."""
+    await asyncio.gather(
+        *(
+            asyncio.to_thread(load_token_counter, model)
+            for model in set(models)
+            if model
+        )
+    )
+
+
+def get_token_counter(model: str) -> TokenCounter:
+    """
+    Counts tokens with the model's tokenizer, without blocking: until it is loaded
+    (in a background thread, retried every TOKENIZER_RETRY_SECONDS if it fails),
+    token counts are approximated from text length.
+    """
+    counter = _TOKEN_COUNTERS.get(model)
+    if counter is not None:
+        return counter
+    with _LOAD_LOCK:
+        last_attempt = _LOAD_ATTEMPTS.get(model)
+        if last_attempt is None or (
+            time.monotonic() - last_attempt > TOKENIZER_RETRY_SECONDS
+        ):
+            _LOAD_ATTEMPTS[model] = time.monotonic()
+            threading.Thread(
+                target=load_token_counter, args=(model,), daemon=True
+            ).start()
+    return approximate_tokens
+
+
+def get_token_budget(model: str) -> int:
+    """Context token budget of a model, from CONTEXT_TOKEN_BUDGETS or the default."""
+    budgets = json.loads(getenv("CONTEXT_TOKEN_BUDGETS", "{}"))
+    return int(budgets.get(model, getenv("CONTEXT_TOKEN_BUDGET", "4096")))
+
+
+def truncate_to_budget(
+    text: str, max_tokens: int, count: TokenCounter
+) -> Tuple[str, int, bool]:
+    """
+    Truncates text to at most max_tokens at a sentence boundary, or at a word
+    boundary if not even the first sentence fits.
+
+    Returns the text, its token count and whether it was truncated.
+    """
+    tokens = count(text)
+    if tokens <= max_tokens:
+        return text, tokens, False
+    if max_tokens <= 0:
+        return "", 0, True
+
+    for units in (SENTENCE_BOUNDARY.split(text), text.split()):
+        kept, used = [], 0
+        for unit in units:
+            # +1 for the separator, so the pieces never add up to more than the whole
+            unit_tokens = count(unit) + 1
+            if used + unit_tokens > max_tokens:
+                break
+            kept.append(unit)
+            used += unit_tokens
+        if kept:
+            return " ".join(kept), used, True
+    return "", 0, True
+
+
+def pack_docs(
+    docs: Sequence[Document], model: str, reserved_tokens: int = 0
+) -> Tuple[List[Document], int]:
+    """
+    Fills the model's token budget (minus reserved_tokens, e.g. for the chat
+    history) with documents in decreasing rerank score. The first document that
+    doesn't fit is truncated and the following ones are dropped.
+
+    Returns the packed documents and the number of context tokens used.
+    """
+    count = get_token_counter(model)
+    budget = get_token_budget(model) - reserved_tokens
+    docs = sorted(
+        docs, key=lambda doc: doc.metadata.get("relevance_score", 0), reverse=True
+    )
+
+    packed, used = [], 0
+    for doc in docs:
+        text, tokens, truncated = truncate_to_budget(
+            doc.page_content, budget - used - ITEM_OVERHEAD_TOKENS, count
+        )
+        if not text:
+            break
+        packed.append(Document(page_content=text, metadata=doc.metadata))
+        used += tokens + ITEM_OVERHEAD_TOKENS
+        if truncated:
+            break
+    return packed, used
+
+
+def pack_hits(
+    hits: Sequence[Hit],
+    model: str,
+    use_highlights: bool = False,
+    reserved_tokens: int = 0,
+) -> Tuple[List[Hit], int]:
+    """
+    Same as pack_docs for search hits, which come in decreasing search score.
+    Their snippets (or abstract) are truncated; hit indices are kept, as only
+    trailing hits are dropped.
+    """
+    count = get_token_counter(model)
+    budget = get_token_budget(model) - reserved_tokens
+
+    packed, used = [], 0
+    for hit in hits:
+        title_tokens = count(hit.title or "N/A") + ITEM_OVERHEAD_TOKENS
+        if used + title_tokens >= budget:
+            break
+        used += title_tokens
+        texts = hit.snippets if use_highlights else (hit.abstract or "N/A",)
+        kept, truncated = [], False
+        for text in texts:
+            text, tokens, truncated = truncate_to_budget(
+                text, budget - used - ITEM_OVERHEAD_TOKENS, count
+            )
+            if text:
+                kept.append(text)
+                used += tokens + ITEM_OVERHEAD_TOKENS
+            if truncated:
+                break
+        packed.append(
+            replace(hit, snippets=tuple(kept))
+            if use_highlights
+            else replace(hit, abstract=kept[0] if kept else None)
+        )
+        if truncated:
+            break
+    return packed, used
@@ -0,0 +1,166 @@
+import asyncio
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from functools import lru_cache
+from os import getenv
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from backend.src.ir_pipeline.utils.context_packer import (
+    SENTENCE_BOUNDARY,
+    TokenCounter,
+    truncate_to_budget,
+)
+
+logger = logging.getLogger(__name__)
+
+Message = Dict[str, str]
+# (previous summary or None, messages to fold into it) -> new summary
+Summarize = Callable[[Optional[str], List[Message]], Awaitable[str]]
+
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+
+
+def prefix_fingerprints(messages: List[Message]) -> List[str]:
+    """Chained hashes identifying each prefix messages[: i + 1] of a conversation."""
+    fingerprints = []
+    digest = b""
+    for message in messages:
+        digest = hashlib.sha256(
+            digest + json.dumps(message, sort_keys=True).encode()
+        ).digest()
+        fingerprints.append(digest.hex())
+    return fingerprints
+
+
+def extractive_summary(messages: List[Message]) -> str:
+    """First sentence of each message, used when the LLM summary is unavailable."""
+    return " ".join(
+        f"{message['role']}: {SENTENCE_BOUNDARY.split(message['content'].strip())[0]}"
+        for message in messages
+    )
+
+
+class HistoryManager:
+    """
+    Keeps the last keep_messages chat messages verbatim and folds the older ones
+    into a rolling summary, so the history sent with each turn stays within
+    token_budget. Summaries are cached by the fingerprint of the messages they
+    cover, and computed in the background: a turn uses the summary cached for
+    the longest prefix of its older messages, plus an extractive summary of the
+    rest, while the LLM folds the rest into it for the next turns.
+    """
+
+    def __init__(self, keep_messages: int, token_budget: int, cache_size: int = 4096):
+        self.keep_messages = keep_messages
+        self.token_budget = token_budget
+        # A quarter of the budget goes to the summary, the rest to recent messages
+        self.summary_budget = token_budget // 4
+        self.cache_size = cache_size
+        self._summaries = OrderedDict()
+        # Background summarizations, by fingerprint of the messages they cover
+        self._pending: Dict[str, asyncio.Task] = {}
+
+    def _cached(self, fingerprint: str) -> Optional[str]:
+        summary = self._summaries.get(fingerprint)
+        if summary is not None:
+            self._summaries.move_to_end(fingerprint)
+        return summary
+
+    def _store(self, fingerprint: str, summary: str):
+        self._summaries[fingerprint] = summary
+        self._summaries.move_to_end(fingerprint)
+        if len(self._summaries) > self.cache_size:
+            self._summaries.popitem(last=False)
+
+    def split(
+        self, messages: List[Message], count: TokenCounter
+    ) -> Tuple[List[Message], List[Message]]:
+        """
+        Splits messages into the ones to fold and the recent ones kept verbatim.
+        The last message is always kept, truncated if it exceeds the budget of
+        the recent messages on its own.
+        """
+        split_at = max(0, len(messages) - self.keep_messages)
+        recent_budget = self.token_budget - self.summary_budget
+        tokens = [count(message["content"]) for message in messages]
+        # Fold more messages if the recent ones alone exceed their budget
+        while split_at < len(messages) - 1 and sum(tokens[split_at:]) > recent_budget:
+            split_at += 1
+        older, recent = messages[:split_at], messages[split_at:]
+        if recent and tokens[-1] > recent_budget:
+            content, _, _ = truncate_to_budget(
+                recent[-1]["content"], recent_budget, count
+            )
+            recent = recent[:-1] + [{**recent[-1], "content": content}]
+        return older, recent
+
+    def _fold(
+        self,
+        fingerprint: str,
+        previous: Optional[str],
+        messages: List[Message],
+        summarize: Summarize,
+    ):
+        """Summarizes messages on top of previous in the background, once."""
+        if fingerprint in self._pending:
+            return
+
+        async def fold():
+            try:
+                self._store(fingerprint, await summarize(previous, messages))
+            except Exception as e:
+                logger.warning(f"Could not summarize chat history: {str(e)}")
+            finally:
+                del self._pending[fingerprint]
+
+        self._pending[fingerprint] = asyncio.create_task(fold())
+
+    def summarize(self, older: List[Message], summarize: Optional[Summarize]) -> str:
+        """The summary of the older messages, without waiting for the LLM."""
+        fingerprints = prefix_fingerprints(older)
+        if summary := self._cached(fingerprints[-1]):
+            return summary
+
+        # Resume from the longest prefix summarized on a previous turn
+        previous, start = None, 0
+        for i in range(len(older) - 2, -1, -1):
+            if cached := self._cached(fingerprints[i]):
+                previous, start = cached, i + 1
+                break
+
+        if summarize is not None:
+            self._fold(fingerprints[-1], previous, older[start:], summarize)
+
+        summary = extractive_summary(older[start:])
+        return f"{previous} {summary}" if previous else summary
+
+    def prepare(
+        self,
+        messages: List[Message],
+        count: TokenCounter,
+        summarize: Optional[Summarize] = None,
+    ) -> Tuple[List[Message], int]:
+        """
+        Returns the history to send (a summary message, if any, then the recent
+        messages) and its token count. Without summarize, or until its summary
+        is ready, older messages are folded into an extractive summary.
+        """
+        older, recent = self.split(messages, count)
+        if not older:
+            return recent, sum(count(message["content"]) for message in recent)
+
+        summary = self.summarize(older, summarize)
+        summary, _, _ = truncate_to_budget(summary, self.summary_budget, count)
+        history = [{"role": "system", "content": SUMMARY_PREFIX + summary}] + recent
+        return history, sum(count(message["content"]) for message in history)
+
+
+@lru_cache(maxsize=None)
+def get_history_manager() -> HistoryManager:
+    """Manager configured by CHAT_HISTORY_KEEP_MESSAGES and CHAT_HISTORY_TOKEN_BUDGET"""
+    return HistoryManager(
+        keep_messages=int(getenv("CHAT_HISTORY_KEEP_MESSAGES", "6")),
+        token_budget=int(getenv("CHAT_HISTORY_TOKEN_BUDGET", "1024")),
+    )
@@ -0,0 +1,49 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+HIGHLIGHT_FIELD = "documents.attachment.content"
+
+
+@dataclass(slots=True, frozen=True)
+class Hit:
+    """The fields of an INSPIRE search hit used to build contexts and references."""
+
+    control_number: int
+    title: Optional[str] = None
+    abstract: Optional[str] = None
+    authors: Tuple[str, ...] = ()
+    year: Optional[int] = None
+    doi: Optional[str] = None
+    snippets: Tuple[str, ...] = ()
+
+
+def _first(metadata: Dict, field: str, key: str):
+    values = metadata.get(field)
+    return values[0].get(key) if values else None
+
+
+def parse_hit(hit: Dict, use_highlights: bool = False) -> Hit:
+    """
+    Parses a single hit, from the INSPIRE OpenSearch index if use_highlights is
+    True (record in `_source`), or from the INSPIRE API otherwise (`metadata`).
+    """
+    metadata = hit["_source" if use_highlights else "metadata"]
+    return Hit(
+        control_number=metadata["control_number"],
+        title=_first(metadata, "titles", "title"),
+        abstract=_first(metadata, "abstracts", "value"),
+        authors=tuple(
+            author.get("full_name", "") for author in metadata.get("authors", [])
+        ),
+        year=_first(metadata, "publication_info", "year"),
+        doi=_first(metadata, "dois", "value"),
+        snippets=tuple(hit.get("highlight", {}).get(HIGHLIGHT_FIELD, [])),
+    )
+
+
+def parse_hits(results: Dict, use_highlights: bool = False) -> List[Hit]:
+    """
+    Parses a raw search response into Hits right after the search, so the (large)
+    response does not have to be kept alive for the rest of the request.
+    """
+    return [parse_hit(hit, use_highlights) for hit in results["hits"]["hits"]]
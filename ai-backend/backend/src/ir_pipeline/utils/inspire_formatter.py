@@ -1,27 +1,30 @@
 import re
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 
+from backend.src.ir_pipeline.utils.citations import (
+    SNIPPET_CITATION_PATTERN,
+    renumber_citations,
+)
+from backend.src.ir_pipeline.utils.hits import Hit
 from backend.src.schemas.query import Citation
+from langchain_core.documents import Document
 
 
-def extract_context(results: Dict, use_highlights: bool = False) -> str:
+def extract_context(hits: List[Hit], use_highlights: bool = False) -> str:
     """
     Extracts context from search results. If use_highlights is True,
     include highlight snippets instead of abstracts.
     """
     if not use_highlights:
         context_items = []
-        for i, hit in enumerate(results["hits"]["hits"]):
-            title = hit["metadata"].get("titles", [{}])[0].get("title", "N/A")
-            abstract = hit["metadata"].get("abstracts", [{}])[0].get("value", "N/A")
+        for i, hit in enumerate(hits):
             context_items.append(
-                f"Result [{i}]\n\nTitle: {title}\n\nAbstract: {abstract}\n\n"
+                f"Result [{i}]\n\nTitle: {hit.title or 'N/A'}\n\n"
+                f"Abstract: {hit.abstract or 'N/A'}\n\n"
             )
     else:
         context_items = []
-        for i, hit in enumerate(results["hits"]["hits"]):
-            source = hit["_source"]
-            snippets = hit.get("highlight", {}).get("documents.attachment.content", [])
+        for i, hit in enumerate(hits):
             formatted_snippets = (
                 "".join(
                     "Snippet "
@@ -29,101 +32,85 @@ def extract_context(results: Dict, use_highlights: bool = False) -> str:
                     + ": "
                     + re.sub(r"\s+|</?em>", " ", snippet)
                     + "\n\n"
-                    for s_index, snippet in enumerate(snippets)
+                    for s_index, snippet in enumerate(hit.snippets)
                 )
                 or "N/A\n\n"
             )
             context_items.append(
                 f"Result [{i}]\n\n"
-                f"Title: {source.get('titles', [{}])[0].get('title', 'N/A')}\n\n"
+                f"Title: {hit.title or 'N/A'}\n\n"
                 "Snippets:\n" + formatted_snippets
             )
     return "\n".join(context_items)
 
 
-def format_reference(metadata: Dict) -> str:
+def format_reference(hit: Hit) -> str:
     """Formats a single INSPIRE record into a human-readable reference."""
-    authors = ", ".join(
-        author.get("full_name", "") for author in metadata.get("authors", [])
-    )
-    year = (
-        metadata.get("publication_info", [{}])[0].get("year", "N/A")
-        if metadata.get("publication_info")
-        else "N/A"
-    )
-    title = metadata.get("titles", [{}])[0].get("title", "N/A")
-    doi = (
-        metadata.get("dois", [{}])[0].get("value", "N/A")
-        if metadata.get("dois")
-        else "N/A"
-    )
-    inspire_id = metadata["control_number"]
+    authors = ", ".join(hit.authors)
+    year = hit.year or "N/A"
+    title = hit.title or "N/A"
+    doi = hit.doi or "N/A"
+    inspire_id = hit.control_number
 
     output = f"{authors} ({year}). *{title}*. DOI: {doi}. [INSPIRE record {inspire_id}](https://inspirehep.net/literature/{inspire_id})\n\n"
     return output
 
 
-def clean_refs(
-    answer: str, results: Dict, use_highlights: bool = False
-) -> Tuple[str, List[str]]:
+def clean_refs(answer: str, hits: List[Hit]) -> Tuple[str, List[str]]:
     """Clean the references from the answer"""
+    answer, cited = renumber_citations(
+        answer,
+        key=lambda i: i if i < len(hits) else None,
+        template=" **[{}]**",
+    )
 
-    # Find references
-    unique_ordered = []
-    for match in re.finditer(r"\[(\d+)\]", answer):
-        ref_num = int(match.group(1))
-        if ref_num not in unique_ordered:
-            unique_ordered.append(ref_num)
-
-    # Filter references
-    formatted_references = []
-    for i, hit in enumerate(results["hits"]["hits"]):
-        if i not in unique_ordered:
-            continue
-        formatted_references.append(
-            format_reference(hit["_source" if use_highlights else "metadata"])
-        )
-
-    new_i = 1
-    for i in unique_ordered:
-        answer = answer.replace(f"[{i}]", f" **[__NEW_REF_ID_{new_i}]**")
-        new_i += 1
-    answer = answer.replace("__NEW_REF_ID_", "")
+    # References in the order of their new numbers
+    formatted_references = [format_reference(hits[i]) for _, (i,), _ in cited]
 
     return answer, formatted_references
 
 
 def clean_refs_with_snippets(
     answer: str,
-    results: Dict,
-) -> Tuple[str, List[str]]:
+    hits: List[Hit],
+) -> Tuple[str, Dict[str, Dict]]:
     """Returns an object with [paper:snippet] references as keys and paperId, snippet
     and display (citation numbers to display starting from 1) as values"""
-    count = 1
-    paper_order = {}
+    _, cited = renumber_citations(
+        answer,
+        key=lambda paper, _: paper if paper < len(hits) else None,
+        template=None,
+        pattern=SNIPPET_CITATION_PATTERN,
+    )
 
     citations = {}
+    for marker, (paper, snippet), display in cited:
+        snippets = hits[paper].snippets
+        citations[marker] = {
+            "paperId": hits[paper].control_number,
+            "snippet": snippets[snippet] if len(snippets) > snippet else "",
+            "display": display,
+        }
 
-    for match in re.finditer(r"\[(\d+):(\d+)\]", answer):
-        full_match = match.group(0)
-        paper = int(match.group(1))
-        snippet = int(match.group(2))
+    return answer, citations
 
-        if paper not in paper_order:
-            paper_order[paper] = count
-            count += 1
 
-        hit = results["hits"]["hits"][paper]
+EMBEDDING_TYPE_ORDER = {"title": 0, "title_abstract": 1, "abstract": 1, "fulltext": 2}
 
-        snippets = hit.get("highlight", {}).get("documents.attachment.content", [])
 
-        citations[full_match] = {
-            "paperId": hit["_source"]["control_number"],
-            "snippet": snippets[snippet] if len(snippets) > snippet else "",
-            "display": paper_order[paper],
-        }
-
-    return answer, citations
+def chunk_order(doc: Document) -> Tuple:
+    """
+    Sort key placing chunks in reading order (title, abstract, then full text by
+    position), grouped by paper. Sending the chunks of a paper in this order keeps
+    the prompt prefix stable between turns of a paper chat.
+    """
+    metadata = doc.metadata
+    return (
+        metadata.get("control_number") or 0,
+        EMBEDDING_TYPE_ORDER.get(metadata.get("embedding_type"), 3),
+        metadata.get("start_index", -1),
+        metadata.get("chunk_id", ""),
+    )
 
 
 def format_docs(docs):
@@ -133,38 +120,41 @@ def format_docs(docs):
     return res
 
 
-def format_refs(answer, docs):
-    unique_ordered = []
-    for match in re.finditer(r"\[(\d+)\]", answer):
-        ref_num = int(match.group(1))
-        if ref_num not in unique_ordered:
-            unique_ordered.append(ref_num)
+def format_refs(answer, docs, summaries: Optional[Dict[int, Hit]] = None):
+    """
+    Renumbers [n] citations of the n-th document by paper, and builds the
+    Citations, with the paper's metadata when its summary is available.
+    """
+    summaries = summaries or {}
 
-    doc_id_map = {}
-    new_i = 1
-    citations = []
+    def paper(i):
+        return (
+            docs[i - 1].metadata.get("control_number") if 0 < i <= len(docs) else None
+        )
 
-    for i in unique_ordered:
+    formatted_answer, cited = renumber_citations(answer, key=paper)
+
+    citations = []
+    for _, (i,), doc_id in cited:
         doc = docs[i - 1]
         control_number = doc.metadata.get("control_number")
-
-        if control_number in doc_id_map:
-            doc_id = doc_id_map[control_number]
-        else:
-            doc_id = new_i
-            doc_id_map[control_number] = new_i
-            new_i += 1
-
-        answer = answer.replace(f"[{i}]", f"[__NEW_REF_ID_{doc_id}]")
-
+        summary = summaries.get(control_number)
         citations.append(
             Citation(
                 doc_id=doc_id,
                 control_number=control_number,
                 snippet=doc.page_content,
+                **(
+                    {
+                        "title": summary.title,
+                        "authors": list(summary.authors),
+                        "year": summary.year,
+                        "doi": summary.doi,
+                    }
+                    if summary
+                    else {}
+                ),
             )
         )
 
-    formatted_answer = answer.replace("__NEW_REF_ID_", "")
-
     return formatted_answer, citations
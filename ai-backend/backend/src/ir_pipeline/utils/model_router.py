@@ -0,0 +1,164 @@
+import json
+import logging
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from os import getenv
+from typing import Dict, Optional, Sequence, Set
+
+from prometheus_client import Counter
+
+logger = logging.getLogger(__name__)
+
+ROUTING_DECISIONS = Counter(
+    "model_router_decisions_total",
+    "Answer generations by query complexity and chosen model",
+    ["mode", "complexity", "model"],
+)
+
+# arXiv identifiers, DOIs, LaTeX, quoted phrases and acronyms or particle names
+# with capitals and digits (CMS, LHCb, B0, H->bb...)
+ENTITY_PATTERN = re.compile(
+    r"\b\d{4}\.\d{4,5}\b"
+    r"|\b10\.\d{4,9}/\S+"
+    r"|\$[^$]+\$"
+    r'|"[^"]+"'
+    r"|\b[A-Za-z]*[A-Z][A-Za-z]*[A-Z0-9][\w+\-/>]*"
+)
+# Questions asking for reasoning over several sources rather than a lookup
+REASONING_PATTERN = re.compile(
+    r"\b(compare|comparison|differences?|versus|vs\.?|why|explain|derive|"
+    r"relation(ship)?|implications?|pros|cons|advantages?|review)\b",
+    re.IGNORECASE,
+)
+
+DEFAULT_RULES = {
+    # Easy queries have at most max_words words and max_entities entities...
+    "max_words": 12,
+    "max_entities": 2,
+    # ...and, when retrieval scores are known, a top result standing out from the
+    # following ones by at least min_score_spread
+    "min_score_spread": 0.2,
+    "score_spread_rank": 4,
+}
+
+
+@dataclass(frozen=True)
+class QueryFeatures:
+    words: int
+    entities: int
+    reasoning: bool
+    score_spread: Optional[float] = None
+
+
+def score_spread(scores: Sequence[float], rank: int) -> Optional[float]:
+    """Difference between the best score and the one at `rank` (or the last)."""
+    if len(scores) < 2:
+        return None
+    scores = sorted(scores, reverse=True)
+    return scores[0] - scores[min(rank, len(scores) - 1)]
+
+
+class ModelRouter:
+    """
+    Sends answer generation for easy queries to a smaller, faster model and keeps
+    the large model for hard ones. Complexity is judged from cheap features: query
+    length, detected entities, reasoning keywords and the spread of retrieval
+    scores. Only requests for the default model are routed, an explicitly chosen
+    model is always used. In shadow mode the decision is only logged.
+    """
+
+    def __init__(
+        self,
+        mode: str,
+        default_model: Optional[str],
+        small_model: Optional[str],
+        large_model: Optional[str],
+        rules: Dict,
+    ):
+        self.mode = mode
+        self.default_model = default_model
+        self.small_model = small_model
+        self.large_model = large_model or default_model
+        self.rules = {**DEFAULT_RULES, **rules}
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode in ("on", "shadow") and bool(self.small_model)
+
+    @property
+    def models(self) -> Set[str]:
+        """Models answers can be generated with."""
+        return {
+            model
+            for model in (self.default_model, self.small_model, self.large_model)
+            if model
+        }
+
+    def features(
+        self, query: str, scores: Optional[Sequence[float]] = None
+    ) -> QueryFeatures:
+        return QueryFeatures(
+            words=len(query.split()),
+            entities=len(ENTITY_PATTERN.findall(query)),
+            reasoning=bool(REASONING_PATTERN.search(query)),
+            score_spread=score_spread(scores or [], self.rules["score_spread_rank"]),
+        )
+
+    def is_easy(self, features: QueryFeatures) -> bool:
+        return (
+            features.words <= self.rules["max_words"]
+            and features.entities <= self.rules["max_entities"]
+            and not features.reasoning
+            and (
+                features.score_spread is None
+                or features.score_spread >= self.rules["min_score_spread"]
+            )
+        )
+
+    def route(
+        self,
+        query: str,
+        model: str,
+        scores: Optional[Sequence[float]] = None,
+        config: Optional[Dict] = None,
+    ) -> str:
+        """
+        Returns the model to generate the answer with, and records the decision
+        in the Langfuse metadata of config.
+        """
+        if not self.enabled or model != self.default_model:
+            return model
+
+        features = self.features(query, scores)
+        complexity = "easy" if self.is_easy(features) else "hard"
+        chosen = self.small_model if complexity == "easy" else self.large_model
+        ROUTING_DECISIONS.labels(self.mode, complexity, chosen).inc()
+
+        if config is not None:
+            config["metadata"]["router"] = {
+                "mode": self.mode,
+                "complexity": complexity,
+                "model": chosen,
+            }
+        if self.mode == "shadow":
+            logger.info(
+                "Model router (shadow) would use %s for %s query: %s",
+                chosen,
+                complexity,
+                features,
+            )
+            return model
+        return chosen
+
+
+@lru_cache(maxsize=None)
+def get_model_router() -> ModelRouter:
+    """Router configured by MODEL_ROUTING (off, shadow or on) and MODEL_ROUTER_*."""
+    return ModelRouter(
+        mode=getenv("MODEL_ROUTING", "off").lower(),
+        default_model=getenv("LLM_MODEL"),
+        small_model=getenv("MODEL_ROUTER_SMALL_MODEL"),
+        large_model=getenv("MODEL_ROUTER_LARGE_MODEL"),
+        rules=json.loads(getenv("MODEL_ROUTER_RULES", "{}")),
+    )
@@ -0,0 +1,145 @@
+import json
+import re
+from functools import lru_cache
+from os import getenv
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from backend.src.ir_pipeline.schema import Terms
+from prometheus_client import Counter
+
+QUERY_EXPANSIONS = Counter(
+    "query_expansion_total",
+    "Query expansions by path (fast or llm) and detected query kind",
+    ["path", "kind"],
+)
+
+SYNONYMS_PATH = Path(__file__).parent.parent / "data" / "hep_synonyms.json"
+
+ARXIV_ID = re.compile(
+    r"^(?:arxiv:|eprint\s+)?(\d{4}\.\d{4,5}(?:v\d+)?|[a-z\-]+(?:\.[A-Z]{2})?/\d{7})$",
+    re.IGNORECASE,
+)
+QUOTED = re.compile(r'"([^"]+)"')
+# INSPIRE search syntax: [find] <field> <value> [and|or <field> <value>...]
+INSPIRE_FIELD = re.compile(
+    r"^(?:a|au|author|ea|exactauthor|t|ti|title|k|keyword|keywords|ft|fulltext"
+    r"|eprint|arxiv)\s+(.+)$",
+    re.IGNORECASE,
+)
+INSPIRE_PREFIX = re.compile(r"^(?:find|fin|f)\s+", re.IGNORECASE)
+INSPIRE_CONNECTIVE = re.compile(r"\s+(?:and|or)\s+", re.IGNORECASE)
+# Queries starting with these words, or with a question mark, are questions
+QUESTION_WORDS = {
+    "what",
+    "which",
+    "who",
+    "whom",
+    "whose",
+    "when",
+    "where",
+    "why",
+    "how",
+    "is",
+    "are",
+    "was",
+    "were",
+    "do",
+    "does",
+    "did",
+    "can",
+    "could",
+    "should",
+    "would",
+    "will",
+    "explain",
+    "describe",
+    "compare",
+    "summarize",
+    "list",
+    "tell",
+    "give",
+    "show",
+}
+FUNCTION_WORDS = {"of", "the", "for", "in", "on", "to", "with", "from", "by", "a"}
+MAX_KEYWORD_WORDS = 4
+
+
+@lru_cache(maxsize=None)
+def load_synonyms() -> Dict[str, Tuple[str, ...]]:
+    """HEP term -> synonyms table, from HEP_SYNONYMS_PATH or the bundled one."""
+    with open(getenv("HEP_SYNONYMS_PATH") or SYNONYMS_PATH) as f:
+        return {
+            term.lower(): tuple(synonyms) for term, synonyms in json.load(f).items()
+        }
+
+
+def expand_synonyms(terms: List[str]) -> List[str]:
+    """Appends the synonyms of each term, without duplicates."""
+    synonyms = load_synonyms()
+    expanded = list(terms)
+    seen = {term.lower() for term in terms}
+    for term in terms:
+        for synonym in synonyms.get(term.lower(), ()):
+            if synonym.lower() not in seen:
+                seen.add(synonym.lower())
+                expanded.append(synonym)
+    return expanded
+
+
+def classify_query(query: str) -> Tuple[str, Optional[List[str]]]:
+    """
+    Detects queries that are already searches and extracts their terms.
+
+    Returns the query kind (arxiv, quoted, inspire, keywords or question) and its
+    terms, or None for natural language questions that need LLM expansion.
+    """
+    query = query.strip()
+    lowered = query.lower()
+
+    if match := ARXIV_ID.match(query):
+        return "arxiv", [match.group(1)]
+
+    if query.endswith("?") or lowered.split(" ", 1)[0] in QUESTION_WORDS:
+        return "question", None
+
+    quoted = QUOTED.findall(query)
+    if quoted and not QUOTED.sub("", query).strip(" ,;+"):
+        return "quoted", [phrase.strip() for phrase in quoted]
+
+    clauses = INSPIRE_CONNECTIVE.split(INSPIRE_PREFIX.sub("", query))
+    fields = [INSPIRE_FIELD.match(clause.strip()) for clause in clauses]
+    # "a" and "t" are also English words: "a review of ..." is not an author search
+    if all(fields) and not any(
+        FUNCTION_WORDS.intersection(match.group(1).lower().split())
+        for match in fields
+        if not QUOTED.fullmatch(match.group(1).strip())
+    ):
+        return "inspire", [match.group(1).strip().strip('"') for match in fields]
+
+    # Short phrases with function words ("effects of gravity") are natural
+    # language, whose search terms the LLM picks better
+    words = lowered.split()
+    if len(words) <= MAX_KEYWORD_WORDS and not FUNCTION_WORDS.intersection(words):
+        return "keywords", [query]
+
+    return "question", None
+
+
+def fast_expand(query: str) -> Optional[Terms]:
+    """
+    Builds the search Terms of keyword and quoted queries directly (plus synonyms
+    from the HEP table), so they skip the LLM expansion. Returns None for the
+    queries that still go to the LLM, including INSPIRE syntax and arXiv ids: the
+    full text search used for queries does not parse INSPIRE syntax, and turning
+    their clauses into terms would lose their fields and connectives.
+    """
+    kind, terms = classify_query(query)
+    if (
+        kind not in ("quoted", "keywords")
+        or getenv("QUERY_EXPANSION_FAST_PATH", "true").lower() != "true"
+    ):
+        QUERY_EXPANSIONS.labels("llm", kind).inc()
+        return None
+    QUERY_EXPANSIONS.labels("fast", kind).inc()
+    return Terms(terms=expand_synonyms(terms))
@@ -0,0 +1,154 @@
+import json
+import logging
+import sqlite3
+import threading
+from dataclasses import replace
+from functools import lru_cache
+from os import getenv
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+from backend.src.ir_pipeline.utils.hits import Hit, parse_hit
+
+logger = logging.getLogger(__name__)
+
+# Collaboration papers can have thousands of authors, only the first are cited
+MAX_AUTHORS = 10
+ET_AL = "et al."
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    control_number INTEGER PRIMARY KEY,
+    title TEXT,
+    authors TEXT NOT NULL,
+    year INTEGER,
+    doi TEXT,
+    updated TEXT
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class RecordStore:
+    """
+    Local SQLite store of the metadata needed to cite a record (title, first
+    authors, year, DOI), keyed by control_number. It is filled by the indexing
+    scripts, so searches don't have to fetch `_source` just to format references.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def get_many(self, control_numbers: Iterable[int]) -> Dict[int, Hit]:
+        control_numbers = list(set(control_numbers))
+        if not control_numbers:
+            return {}
+        placeholders = ",".join("?" * len(control_numbers))
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT control_number, title, authors, year, doi FROM records "
+                f"WHERE control_number IN ({placeholders})",
+                control_numbers,
+            ).fetchall()
+        return {
+            row[0]: Hit(
+                control_number=row[0],
+                title=row[1],
+                authors=tuple(json.loads(row[2])),
+                year=row[3],
+                doi=row[4],
+            )
+            for row in rows
+        }
+
+    def upsert_many(self, hits: Iterable[Hit], updated: Optional[str] = None):
+        rows = []
+        for hit in hits:
+            authors = list(hit.authors[:MAX_AUTHORS])
+            if len(hit.authors) > MAX_AUTHORS:
+                authors.append(ET_AL)
+            rows.append(
+                (hit.control_number, hit.title, json.dumps(authors), hit.year, hit.doi)
+            )
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO records (control_number, title, authors, year, doi, "
+                "updated) VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(control_number) DO "
+                "UPDATE SET title = excluded.title, authors = excluded.authors, "
+                "year = excluded.year, doi = excluded.doi, updated = excluded.updated",
+                [row + (updated,) for row in rows],
+            )
+
+    def upsert_records(self, records: Iterable[Dict], updated: Optional[str] = None):
+        """Upserts raw records-hep OpenSearch hits."""
+        self.upsert_many(
+            (parse_hit(record, use_highlights=True) for record in records), updated
+        )
+
+    def get_sync_state(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM sync_state WHERE key = ?", (key,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_sync_state(self, key: str, value: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO sync_state (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, value),
+            )
+
+    async def enrich(
+        self,
+        hits: List[Hit],
+        fetch: Optional[Callable[[List[int]], Awaitable[List[Hit]]]] = None,
+    ) -> List[Hit]:
+        """
+        Fills citation metadata from the store, keeping what the hit already has.
+        Records missing from the store (e.g. newer than its last sync) are fetched
+        with fetch in a single call, and stored for the next searches.
+        """
+        summaries = self.get_many(hit.control_number for hit in hits)
+        missing = [
+            hit.control_number for hit in hits if hit.control_number not in summaries
+        ]
+        if missing and fetch:
+            try:
+                fetched = await fetch(missing)
+            except Exception as e:
+                logger.warning(f"Could not fetch {len(missing)} records: {str(e)}")
+            else:
+                self.upsert_many(fetched)
+                summaries.update(self.get_many(missing))
+
+        enriched = []
+        for hit in hits:
+            summary = summaries.get(hit.control_number)
+            if summary is None:
+                enriched.append(hit)
+                continue
+            enriched.append(
+                replace(
+                    hit,
+                    title=hit.title or summary.title,
+                    authors=hit.authors or summary.authors,
+                    year=hit.year or summary.year,
+                    doi=hit.doi or summary.doi,
+                )
+            )
+        return enriched
+
+
+@lru_cache(maxsize=1)
+def get_record_store() -> Optional[RecordStore]:
+    """The store at RECORD_STORE_PATH, or None if no store is configured."""
+    path = getenv("RECORD_STORE_PATH")
+    return RecordStore(path) if path else None
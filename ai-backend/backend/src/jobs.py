@@ -0,0 +1,142 @@
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from os import getenv
+from typing import Dict, List, Optional
+
+from backend.src.ir_pipeline.orchestrator import search
+from backend.src.models import QueryIr, QueryJob
+from backend.src.schemas.query import QueryRequest
+from sqlalchemy import and_, func, insert, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+MAX_ATTEMPTS = int(getenv("QUERY_JOB_MAX_ATTEMPTS", "3"))
+# A running job not finished after this long is assumed lost with its worker
+LEASE_SECONDS = float(getenv("QUERY_JOB_LEASE_SECONDS", "300"))
+
+
+async def run_query(request: QueryRequest) -> Dict:
+    """Runs the search pipeline for a query, returning its queries_ir row."""
+    start_time = time.time()
+
+    query_response = await search(
+        request.query,
+        request.model,
+        user=str(request.matomo_client_id),
+        use_highlights=True,
+    )
+
+    return {
+        "query": request.query,
+        "brief": query_response.get("brief", ""),
+        "response": query_response.get("response", ""),
+        "references": query_response.get("references", []),
+        "expanded_query": query_response.get("expanded_query", ""),
+        "model": request.model,
+        "backend_version": getenv("BACKEND_VERSION"),
+        "matomo_client_id": request.matomo_client_id,
+        "user": request.user,
+        # Set here, as the row may be inserted much later than the query ran
+        "timestamp": datetime.now(timezone.utc).replace(tzinfo=None),
+        "response_time": time.time() - start_time,
+    }
+
+
+async def enqueue_query(db: AsyncSession, request: QueryRequest) -> uuid.UUID:
+    job_id = await db.scalar(
+        insert(QueryJob)
+        .values(request=request.model_dump(mode="json"))
+        .returning(QueryJob.id)
+    )
+    await db.commit()
+    return job_id
+
+
+async def claim_jobs(db: AsyncSession, limit: int) -> List[QueryJob]:
+    """
+    Marks up to limit jobs as running and returns them, oldest first. Jobs
+    locked by another worker's claim are skipped, so concurrent workers never
+    wait on each other. Running jobs whose lease expired are claimed again.
+    """
+    claimable = (
+        select(QueryJob.id)
+        .where(
+            or_(
+                QueryJob.status == QUEUED,
+                and_(
+                    QueryJob.status == RUNNING,
+                    QueryJob.started_at
+                    < func.localtimestamp() - timedelta(seconds=LEASE_SECONDS),
+                ),
+            )
+        )
+        .order_by(QueryJob.created_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    jobs = (
+        await db.scalars(
+            update(QueryJob)
+            .where(QueryJob.id.in_(claimable.scalar_subquery()))
+            .values(
+                status=RUNNING,
+                attempts=QueryJob.attempts + 1,
+                started_at=func.localtimestamp(),
+            )
+            .returning(QueryJob)
+            .execution_options(synchronize_session=False)
+        )
+    ).all()
+    await db.commit()
+    return jobs
+
+
+def _owned(job: QueryJob):
+    # The claim is lost if the lease expired and another worker claimed the job
+    return and_(
+        QueryJob.id == job.id,
+        QueryJob.status == RUNNING,
+        QueryJob.attempts == job.attempts,
+    )
+
+
+async def complete_job(db: AsyncSession, job: QueryJob, row: Dict) -> bool:
+    """Stores the query result and marks the job done, in one transaction."""
+    query_id = uuid.uuid4()
+    await db.execute(insert(QueryIr).values(id=query_id, **row))
+    result = await db.execute(
+        update(QueryJob)
+        .where(_owned(job))
+        .values(
+            status=DONE,
+            query_id=query_id,
+            query_timestamp=row["timestamp"],
+            finished_at=func.localtimestamp(),
+        )
+    )
+    if result.rowcount == 0:
+        await db.rollback()
+        return False
+    await db.commit()
+    return True
+
+
+async def fail_job(db: AsyncSession, job: QueryJob, error: str):
+    """Queues the job again, or marks it failed after MAX_ATTEMPTS attempts."""
+    failed = job.attempts >= MAX_ATTEMPTS
+    await db.execute(
+        update(QueryJob)
+        .where(_owned(job))
+        .values(
+            status=FAILED if failed else QUEUED,
+            error=error,
+            finished_at=func.localtimestamp() if failed else None,
+        )
+    )
+    await db.commit()
+
+
+async def get_job(db: AsyncSession, job_id: uuid.UUID) -> Optional[QueryJob]:
+    return await db.get(QueryJob, job_id)
@@ -1,17 +1,108 @@
+import asyncio
 import logging
+from contextlib import asynccontextmanager
 from os import getenv
 
 from backend.src.api import v1
-from fastapi import FastAPI
+from backend.src.database import engine
+from backend.src.ir_pipeline.utils.context_packer import preload_token_counters
+from backend.src.ir_pipeline.utils.model_router import get_model_router
+from backend.src.stats import refresh_stats_forever
+from backend.src.utils.admission import OverloadedError
+from backend.src.utils.deadline import DeadlineExceededError
+from backend.src.utils.langfuse import PROMPTS
+from backend.src.utils.resilience import BackendTimeoutError, CircuitOpenError
+from backend.src.utils.scheduler import SCHEDULER
+from backend.src.utils.tracing import TRACER
+from backend.src.utils.write_behind import QUERIES_IR_WRITER, RETAINED_TRACES_WRITER
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from prometheus_fastapi_instrumentator import Instrumentator
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 
 logging.basicConfig(format="%(levelname)s - %(name)s:%(lineno)d - %(message)s")
 
-app = FastAPI(root_path=getenv("ROOT_PATH", ""))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Prompts are loaded before serving and kept up to date in the background
+    await asyncio.to_thread(PROMPTS.load)
+    refresh_task = asyncio.create_task(PROMPTS.refresh_forever())
+    # Tokenizers are loaded from disk or downloaded, not on the first request
+    await preload_token_counters(get_model_router().models)
+    QUERIES_IR_WRITER.start()
+    RETAINED_TRACES_WRITER.start()
+    TRACER.exports.start()
+    # Without the job queue, no query worker refreshes the daily stats
+    stopping = asyncio.Event()
+    stats_task = (
+        None
+        if v1.QUERY_JOB_QUEUE
+        else asyncio.create_task(refresh_stats_forever(stopping))
+    )
+    yield
+    refresh_task.cancel()
+    stopping.set()
+    if stats_task:
+        await stats_task
+    await SCHEDULER.close(float(getenv("SCHEDULER_SHUTDOWN_SECONDS", "30")))
+    await QUERIES_IR_WRITER.close()
+    await RETAINED_TRACES_WRITER.close()
+    await asyncio.to_thread(
+        TRACER.exports.close, float(getenv("LANGFUSE_EXPORT_SHUTDOWN_SECONDS", "5"))
+    )
+    await engine.dispose()
+
+
+app = FastAPI(root_path=getenv("ROOT_PATH", ""), lifespan=lifespan)
 
 app.include_router(v1.router, prefix="/v1")
 
+
+@app.exception_handler(OverloadedError)
+async def overloaded_error_handler(request: Request, exc: OverloadedError):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+@app.exception_handler(DeadlineExceededError)
+async def deadline_exceeded_error_handler(request: Request, exc: DeadlineExceededError):
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
+
+@app.exception_handler(CircuitOpenError)
+async def circuit_open_error_handler(request: Request, exc: CircuitOpenError):
+    # A backend is failing: fail fast until its breaker lets a probe through
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+@app.exception_handler(BackendTimeoutError)
+async def backend_timeout_error_handler(request: Request, exc: BackendTimeoutError):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": "5"},
+    )
+
+
+@app.exception_handler(PoolTimeoutError)
+async def pool_timeout_error_handler(request: Request, exc: PoolTimeoutError):
+    # Every database connection is busy: shed the request instead of queueing it
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Database is busy, please retry later"},
+        headers={"Retry-After": "1"},
+    )
+
+
 allowed_origins = getenv("CORS_ALLOW_ORIGINS", "http://localhost:5173").split(",")
 
 app.add_middleware(
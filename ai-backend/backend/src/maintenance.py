@@ -0,0 +1,138 @@
+"""
+Database maintenance commands, e.g. for a cron job:
+
+    python -m backend.src.maintenance refresh-stats [--since YYYY-MM-DD | --full]
+    python -m backend.src.maintenance partitions [--retention-months N]
+    python -m backend.src.maintenance prune-traces [--days N]
+"""
+
+import argparse
+import asyncio
+import logging
+from datetime import date, timedelta
+from os import getenv
+
+from backend.src.database import SessionLocal, engine
+from backend.src.models import RetainedTrace
+from backend.src.partitions import (
+    MONTHS_AHEAD,
+    RETENTION_MONTHS,
+    create_partitions,
+    default_partition_rows,
+    drop_expired_partitions,
+    move_default_rows,
+)
+from backend.src.stats import refresh_stats
+from sqlalchemy import delete, func, text
+
+logging.basicConfig(
+    format="%(levelname)s - %(name)s:%(lineno)d - %(message)s", level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+
+async def refresh_stats_command(args: argparse.Namespace):
+    since = date.min if args.full else args.since
+    async with SessionLocal() as db:
+        rows = await refresh_stats(db, since)
+    logger.info(f"Refreshed {rows} daily query stats")
+
+
+async def partitions_command(args: argparse.Namespace):
+    async with SessionLocal() as db:
+        await create_partitions(db, args.months_ahead)
+        # Before dropping expired months, which may include the moved ones
+        await move_default_rows(db)
+        if args.retention_months:
+            await drop_expired_partitions(
+                db, args.retention_months, detach_only=args.detach_only
+            )
+        if rows := await default_partition_rows(db):
+            logger.warning(
+                f"{rows} queries are still in the default partition of queries_ir, "
+                "they could not be moved to partitions of their months"
+            )
+
+
+async def prune_traces_command(args: argparse.Namespace):
+    async with SessionLocal() as db, db.begin():
+        await db.execute(text("SET LOCAL statement_timeout = 0"))
+        result = await db.execute(
+            delete(RetainedTrace).where(
+                RetainedTrace.created_at < func.now() - timedelta(days=args.days)
+            )
+        )
+    logger.info(f"Deleted {result.rowcount} retained traces without feedback")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    stats = commands.add_parser(
+        "refresh-stats", help="Recompute the daily query statistics"
+    )
+    since = stats.add_mutually_exclusive_group()
+    since.add_argument(
+        "--since",
+        type=date.fromisoformat,
+        help="First day to recompute (default: STATS_REFRESH_DAYS days ago)",
+    )
+    since.add_argument("--full", action="store_true", help="Recompute every day")
+    stats.set_defaults(run=refresh_stats_command)
+
+    partitions = commands.add_parser(
+        "partitions",
+        help=(
+            "Create the next monthly partitions of queries_ir, move the rows of "
+            "the default partition to their months and drop expired months"
+        ),
+    )
+    partitions.add_argument(
+        "--months-ahead",
+        type=int,
+        default=MONTHS_AHEAD,
+        help="Months to create partitions for, after the current one",
+    )
+    partitions.add_argument(
+        "--retention-months",
+        type=int,
+        default=int(RETENTION_MONTHS) if RETENTION_MONTHS else None,
+        help="Months of queries to keep, including the current one (default: all)",
+    )
+    partitions.add_argument(
+        "--detach-only",
+        action="store_true",
+        help=(
+            "Detach expired partitions from queries_ir instead of dropping them, "
+            "copying their feedback to feedback_YYYY_MM tables (the feedback and "
+            "jobs of expired months are deleted in both cases)"
+        ),
+    )
+    partitions.set_defaults(run=partitions_command)
+
+    traces = commands.add_parser(
+        "prune-traces",
+        help="Delete the summaries of unsampled traces that got no feedback",
+    )
+    traces.add_argument(
+        "--days",
+        type=int,
+        default=int(getenv("LANGFUSE_RETAINED_TRACE_DAYS", "30")),
+        help="Days to keep summaries for",
+    )
+    traces.set_defaults(run=prune_traces_command)
+
+    return parser.parse_args()
+
+
+async def main():
+    args = parse_args()
+    try:
+        await args.run(args)
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
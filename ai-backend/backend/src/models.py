@@ -1,15 +1,18 @@
 import uuid
-from datetime import datetime
-from typing import Optional
+from datetime import date, datetime
+from typing import Any, Optional
 
 from sqlalchemy import (
     ARRAY,
-    ForeignKey,
+    DDL,
+    ForeignKeyConstraint,
     Index,
     String,
+    event,
     func,
     text,
 )
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 
 
@@ -34,22 +37,41 @@ class QueryIr(Base):
     backend_version: Mapped[Optional[str]] = mapped_column()
     matomo_client_id: Mapped[Optional[uuid.UUID]] = mapped_column()
     user: Mapped[Optional[str]] = mapped_column()
-    timestamp: Mapped[datetime] = mapped_column(server_default=func.now())
+    # Partition key, hence part of the primary key, see backend.src.partitions
+    timestamp: Mapped[datetime] = mapped_column(
+        primary_key=True, server_default=func.now()
+    )
     response_time: Mapped[float] = mapped_column()
 
-    __table_args__ = (Index("idx_queries_ir_timestamp", "timestamp"),)
+    __table_args__ = (
+        Index("idx_queries_ir_timestamp", "timestamp"),
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
+
+
+# Catches the rows of months without a partition
+event.listen(
+    QueryIr.__table__,
+    "after_create",
+    DDL("CREATE TABLE queries_ir_default PARTITION OF queries_ir DEFAULT"),
+)
 
 
 class Feedback(Base):
     __tablename__ = "feedback"
 
-    query_id: Mapped[uuid.UUID] = mapped_column(
-        ForeignKey("queries_ir.id"), primary_key=True
-    )
+    query_id: Mapped[uuid.UUID] = mapped_column(primary_key=True)
+    query_timestamp: Mapped[datetime] = mapped_column()
     rating: Mapped[bool] = mapped_column()
     comment: Mapped[Optional[str]] = mapped_column()
 
-    __table_args__ = (Index("idx_feedback_rating", "rating"),)
+    __table_args__ = (
+        ForeignKeyConstraint(
+            ["query_id", "query_timestamp"],
+            ["queries_ir.id", "queries_ir.timestamp"],
+        ),
+        Index("idx_feedback_rating", "rating"),
+    )
 
 
 class SearchFeedback(Base):
@@ -62,3 +84,58 @@ class SearchFeedback(Base):
     additional: Mapped[Optional[str]] = mapped_column()
     matomo_client_id: Mapped[Optional[uuid.UUID]] = mapped_column()
     timestamp: Mapped[datetime] = mapped_column(server_default=func.now())
+
+
+class QueryJob(Base):
+    __tablename__ = "query_jobs"
+
+    id: Mapped[uuid.UUID] = mapped_column(
+        primary_key=True, server_default=text("gen_random_uuid()")
+    )
+    request: Mapped[dict[str, Any]] = mapped_column(JSONB)
+    # queued -> running -> done or failed; running jobs go back to queued on error
+    status: Mapped[str] = mapped_column(server_default="queued")
+    attempts: Mapped[int] = mapped_column(server_default="0")
+    error: Mapped[Optional[str]] = mapped_column()
+    query_id: Mapped[Optional[uuid.UUID]] = mapped_column()
+    query_timestamp: Mapped[Optional[datetime]] = mapped_column()
+    created_at: Mapped[datetime] = mapped_column(server_default=func.now())
+    started_at: Mapped[Optional[datetime]] = mapped_column()
+    finished_at: Mapped[Optional[datetime]] = mapped_column()
+
+    __table_args__ = (
+        ForeignKeyConstraint(
+            ["query_id", "query_timestamp"],
+            ["queries_ir.id", "queries_ir.timestamp"],
+        ),
+        Index("idx_query_jobs_status_created_at", "status", "created_at"),
+    )
+
+
+# Daily statistics of queries_ir and their feedback, see backend.src.stats
+class QueryStatsDaily(Base):
+    __tablename__ = "query_stats_daily"
+
+    day: Mapped[date] = mapped_column(primary_key=True)
+    model: Mapped[str] = mapped_column(primary_key=True)
+    queries: Mapped[int] = mapped_column()
+    mean_response_time: Mapped[float] = mapped_column()
+    p50_response_time: Mapped[float] = mapped_column()
+    p90_response_time: Mapped[float] = mapped_column()
+    p99_response_time: Mapped[float] = mapped_column()
+    max_response_time: Mapped[float] = mapped_column()
+    feedback: Mapped[int] = mapped_column()
+    positive_feedback: Mapped[int] = mapped_column()
+    refreshed_at: Mapped[datetime] = mapped_column(server_default=func.now())
+
+
+# Summary of an unsampled Langfuse trace, kept until its response gets feedback,
+# see backend.src.utils.tracing
+class RetainedTrace(Base):
+    __tablename__ = "retained_traces"
+
+    id: Mapped[uuid.UUID] = mapped_column(primary_key=True)
+    trace: Mapped[dict[str, Any]] = mapped_column(JSONB)
+    created_at: Mapped[datetime] = mapped_column(server_default=func.now())
+
+    __table_args__ = (Index("idx_retained_traces_created_at", "created_at"),)
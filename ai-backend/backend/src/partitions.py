@@ -0,0 +1,259 @@
+"""
+Monthly partitions of queries_ir. The table is partitioned by range of timestamp,
+with one partition per month named queries_ir_YYYY_MM, and a default partition
+for rows of months without one, e.g. spooled queries inserted late, until they
+are moved to their month's partition. Date range queries (exports, stats) only
+scan the partitions in range, and old months can be dropped as a whole.
+"""
+
+import logging
+import re
+from datetime import date, datetime, time
+from os import getenv
+from typing import Dict, List, Optional
+
+from backend.src.models import Feedback, QueryIr, QueryJob
+from sqlalchemy import delete, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+PARENT = QueryIr.__tablename__
+PARTITION_NAME = re.compile(rf"^{PARENT}_(\d{{4}})_(\d{{2}})$")
+DEFAULT_PARTITION = f"{PARENT}_default"
+# Feedback of the detached months, see drop_expired_partitions
+FEEDBACK_ARCHIVE_NAME = re.compile(rf"^{Feedback.__tablename__}_\d{{4}}_\d{{2}}$")
+
+MONTHS_AHEAD = int(getenv("QUERIES_IR_PARTITION_MONTHS_AHEAD", "3"))
+# Months of queries to keep, including the current one; unset keeps everything
+RETENTION_MONTHS = getenv("QUERIES_IR_RETENTION_MONTHS")
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{PARENT}_{month:%Y_%m}"
+
+
+def feedback_archive_name(month: date) -> str:
+    return f"{Feedback.__tablename__}_{month:%Y_%m}"
+
+
+def is_partition(name: str) -> bool:
+    return bool(PARTITION_NAME.match(name)) or name == DEFAULT_PARTITION
+
+
+def is_feedback_archive(name: str) -> bool:
+    return bool(FEEDBACK_ARCHIVE_NAME.match(name))
+
+
+def _bounds(month: date) -> Dict[str, datetime]:
+    """Bind parameters of the timestamp range of a month."""
+    return {
+        "start": datetime.combine(month, time()),
+        "end": datetime.combine(add_months(month, 1), time()),
+    }
+
+
+async def _lock_referencing_tables(db: AsyncSession):
+    """
+    Blocks writes to the tables referencing queries_ir (feedback upserts, job
+    claims and completions) until the end of the transaction, so that none
+    happens between copying rows and deleting them.
+    """
+    await db.execute(
+        text(
+            f"LOCK TABLE {Feedback.__tablename__}, {QueryJob.__tablename__} "
+            "IN SHARE ROW EXCLUSIVE MODE"
+        )
+    )
+
+
+async def list_partitions(db: AsyncSession) -> List[date]:
+    """Months that have a partition, in order."""
+    names = await db.scalars(
+        text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE parent.relname = :parent"
+        ).bindparams(parent=PARENT)
+    )
+    return sorted(
+        date(int(match[1]), int(match[2]), 1)
+        for name in names
+        if (match := PARTITION_NAME.match(name))
+    )
+
+
+async def create_partitions(
+    db: AsyncSession, months_ahead: int = MONTHS_AHEAD, today: Optional[date] = None
+) -> List[date]:
+    """
+    Creates the partitions of the current month and the next months_ahead months
+    that are missing, returning their months. A month whose rows already went to
+    the default partition is skipped, as its partition cannot be created until
+    they are moved, see move_default_rows.
+    """
+    current = (today or date.today()).replace(day=1)
+    existing = set(await list_partitions(db))
+    created = []
+    for month in (add_months(current, i) for i in range(months_ahead + 1)):
+        if month in existing:
+            continue
+        try:
+            async with db.begin_nested():
+                await db.execute(
+                    text(
+                        f"CREATE TABLE {partition_name(month)} PARTITION OF {PARENT} "
+                        f"FOR VALUES FROM ('{month}') TO ('{add_months(month, 1)}')"
+                    )
+                )
+        except Exception as e:
+            logger.error(f"Could not create partition for {month:%Y-%m}: {str(e)}")
+            continue
+        created.append(month)
+    await db.commit()
+    for month in created:
+        logger.info(f"Created partition {partition_name(month)}")
+    return created
+
+
+async def drop_expired_partitions(
+    db: AsyncSession,
+    retention_months: int,
+    detach_only: bool = False,
+    today: Optional[date] = None,
+) -> List[date]:
+    """
+    Drops the partitions of the months older than the last retention_months,
+    or only detaches them from queries_ir if detach_only, e.g. to archive them.
+    The feedback and jobs of their queries are deleted first, as their foreign
+    keys would block the detach. With detach_only, the feedback is copied to a
+    feedback_YYYY_MM table beforehand, to be archived with the partition.
+    """
+    cutoff = add_months((today or date.today()).replace(day=1), 1 - retention_months)
+    expired = [month for month in await list_partitions(db) if month < cutoff]
+    for month in expired:
+        start, end = month, add_months(month, 1)
+        # Maintenance statements may take longer than the API's timeout
+        await db.execute(text("SET LOCAL statement_timeout = 0"))
+        await _lock_referencing_tables(db)
+        if detach_only:
+            archive = feedback_archive_name(month)
+            await db.execute(
+                text(f"CREATE TABLE {archive} (LIKE {Feedback.__tablename__})")
+            )
+            await db.execute(
+                text(
+                    f"INSERT INTO {archive} SELECT * FROM {Feedback.__tablename__} "
+                    "WHERE query_timestamp >= :start AND query_timestamp < :end"
+                ).bindparams(**_bounds(month))
+            )
+        await db.execute(
+            delete(Feedback).where(
+                Feedback.query_timestamp >= start, Feedback.query_timestamp < end
+            )
+        )
+        await db.execute(
+            delete(QueryJob).where(
+                QueryJob.query_timestamp >= start, QueryJob.query_timestamp < end
+            )
+        )
+        name = partition_name(month)
+        await db.execute(text(f"ALTER TABLE {PARENT} DETACH PARTITION {name}"))
+        if not detach_only:
+            await db.execute(text(f"DROP TABLE {name}"))
+        # One transaction per month, so a failure leaves the others done
+        await db.commit()
+        logger.info(f"{'Detached' if detach_only else 'Dropped'} partition {name}")
+    return expired
+
+
+async def move_default_rows(db: AsyncSession) -> Dict[date, int]:
+    """
+    Moves the rows of the default partition to new partitions of their months,
+    returning the number of queries moved per month. As the foreign keys of
+    feedback and jobs block deleting their queries, these are moved as well,
+    each month in a single transaction during which feedback and jobs cannot be
+    written (the API and workers wait for it).
+    """
+    months = (
+        await db.scalars(
+            text(
+                f"SELECT DISTINCT date_trunc('month', timestamp)::date "
+                f"FROM {DEFAULT_PARTITION}"
+            )
+        )
+    ).all()
+    # Table, its timestamp column and the table its rows are moved to, queries
+    # first as the others reference them
+    tables = [
+        (DEFAULT_PARTITION, "timestamp", QueryIr.__table__),
+        (Feedback.__tablename__, "query_timestamp", Feedback.__table__),
+        (QueryJob.__tablename__, "query_timestamp", QueryJob.__table__),
+    ]
+    moved = {}
+    for month in sorted(months):
+        bounds = _bounds(month)
+        try:
+            await db.execute(text("SET LOCAL statement_timeout = 0"))
+            # Also blocks queries inserted into the default partition meanwhile
+            await db.execute(
+                text(f"LOCK TABLE {DEFAULT_PARTITION} IN SHARE ROW EXCLUSIVE MODE")
+            )
+            await _lock_referencing_tables(db)
+            for table, column, _ in tables:
+                in_month = f"{column} >= :start AND {column} < :end"
+                await db.execute(
+                    text(
+                        f"CREATE TEMP TABLE {table}_moved (LIKE {table}) ON COMMIT DROP"
+                    )
+                )
+                await db.execute(
+                    text(
+                        f"INSERT INTO {table}_moved SELECT * FROM {table} "
+                        f"WHERE {in_month}"
+                    ).bindparams(**bounds)
+                )
+            for table, column, _ in reversed(tables):
+                in_month = f"{column} >= :start AND {column} < :end"
+                await db.execute(
+                    text(f"DELETE FROM {table} WHERE {in_month}").bindparams(**bounds)
+                )
+            # DDL takes no parameters, the bounds are dates rather than input
+            await db.execute(
+                text(
+                    f"CREATE TABLE {partition_name(month)} PARTITION OF {PARENT} "
+                    f"FOR VALUES FROM ('{month}') TO ('{add_months(month, 1)}')"
+                )
+            )
+            counts = []
+            for table, _, target in tables:
+                names = ", ".join(f'"{column.name}"' for column in target.c)
+                result = await db.execute(
+                    text(
+                        f"INSERT INTO {target.name} ({names}) "
+                        f"SELECT {names} FROM {table}_moved"
+                    )
+                )
+                counts.append(result.rowcount)
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            logger.error(f"Could not move default rows of {month:%Y-%m}: {str(e)}")
+            continue
+        moved[month] = counts[0]
+        logger.info(
+            f"Moved {counts[0]} queries from {DEFAULT_PARTITION} "
+            f"to {partition_name(month)}"
+        )
+    return moved
+
+
+async def default_partition_rows(db: AsyncSession) -> int:
+    """Rows in the default partition, which should stay empty."""
+    return await db.scalar(text(f"SELECT count(*) FROM {DEFAULT_PARTITION}"))
@@ -1,11 +1,27 @@
-from typing import Optional
+from datetime import datetime
+from typing import List, Optional
 
-from pydantic import BaseModel
+from pydantic import UUID4, BaseModel, Field
 
 
 class FeedbackRequest(BaseModel):
     rating: bool
     comment: Optional[str] = None
+    # Timestamp of the query, if known, so only its partition is searched
+    query_timestamp: Optional[datetime] = None
+
+
+class FeedbackRecord(FeedbackRequest):
+    query_id: UUID4
+
+
+class BulkFeedbackRequest(BaseModel):
+    feedback: List[FeedbackRecord] = Field(max_length=1000)
+
+
+class BulkFeedbackResponse(BaseModel):
+    feedback: List[FeedbackRecord]
+    not_found: List[UUID4]
 
 
 class RagFeedbackRequest(BaseModel):
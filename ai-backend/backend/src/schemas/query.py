@@ -22,6 +22,10 @@ class Citation(BaseModel):
     doc_id: int
     control_number: int
     snippet: str
+    title: Optional[str] = None
+    authors: Optional[List[str]] = None
+    year: Optional[int] = None
+    doi: Optional[str] = None
 
 
 class QueryResponse(BaseModel):
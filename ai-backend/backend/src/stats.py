@@ -0,0 +1,163 @@
+import asyncio
+import contextlib
+import logging
+from datetime import date, datetime, timedelta
+from os import getenv
+from typing import Dict, Optional
+
+from backend.src.database import SessionLocal
+from backend.src.models import Feedback, QueryIr, QueryStatsDaily
+from prometheus_client import Summary
+from sqlalchemy import Date, cast, func, select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+REFRESH_SECONDS = Summary(
+    "query_stats_refresh_seconds",
+    "Time to refresh the daily query statistics",
+)
+
+# Feedback keeps arriving for recent queries, so their days are recomputed on
+# every refresh. Older days are left as they are.
+REFRESH_DAYS = int(getenv("STATS_REFRESH_DAYS", "7"))
+REFRESH_INTERVAL_SECONDS = float(getenv("STATS_REFRESH_SECONDS", "300"))
+# A full refresh scans every query, far longer than the API's statement timeout
+# (0 disables it)
+STATEMENT_TIMEOUT_MS = int(getenv("STATS_REFRESH_STATEMENT_TIMEOUT_MS", "0"))
+# Arbitrary key of the advisory lock letting a single process refresh at a time
+REFRESH_LOCK_KEY = 4901
+
+
+def _percentile(fraction: float):
+    return func.percentile_cont(fraction).within_group(QueryIr.response_time)
+
+
+async def refresh_stats(db: AsyncSession, since: Optional[date] = None) -> int:
+    """
+    Recomputes the daily statistics from since (by default, the last REFRESH_DAYS
+    days) and returns the number of (day, model) rows written. Returns 0 without
+    refreshing if another process is already refreshing them.
+    """
+    since = since or date.today() - timedelta(days=REFRESH_DAYS)
+    if not await db.scalar(
+        select(func.pg_try_advisory_xact_lock(REFRESH_LOCK_KEY)),
+    ):
+        logger.warning("Query stats are already being refreshed")
+        return 0
+
+    with REFRESH_SECONDS.time():
+        await db.execute(text(f"SET LOCAL statement_timeout = {STATEMENT_TIMEOUT_MS}"))
+        day = cast(func.date_trunc("day", QueryIr.timestamp), Date)
+        rows = (
+            select(
+                day,
+                QueryIr.model,
+                func.count(),
+                func.avg(QueryIr.response_time),
+                _percentile(0.5),
+                _percentile(0.9),
+                _percentile(0.99),
+                func.max(QueryIr.response_time),
+                func.count(Feedback.query_id),
+                func.count().filter(Feedback.rating),
+            )
+            .outerjoin(Feedback, Feedback.query_id == QueryIr.id)
+            .where(QueryIr.timestamp >= since)
+            .group_by(day, QueryIr.model)
+        )
+        columns = [
+            "day",
+            "model",
+            "queries",
+            "mean_response_time",
+            "p50_response_time",
+            "p90_response_time",
+            "p99_response_time",
+            "max_response_time",
+            "feedback",
+            "positive_feedback",
+        ]
+        statement = insert(QueryStatsDaily).from_select(columns, rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=["day", "model"],
+            set_={
+                **{column: statement.excluded[column] for column in columns[2:]},
+                "refreshed_at": func.now(),
+            },
+        )
+        result = await db.execute(statement)
+        await db.commit()
+    return result.rowcount
+
+
+async def refresh_stats_forever(stopping: asyncio.Event):
+    """
+    Refreshes the recent daily stats every REFRESH_INTERVAL_SECONDS until
+    stopping is set. Run by every query worker (and by the API without them),
+    the advisory lock lets a single process refresh at a time.
+    """
+    while not stopping.is_set():
+        try:
+            async with SessionLocal() as db:
+                await refresh_stats(db)
+        except Exception as e:
+            logger.error(f"Could not refresh query stats: {str(e)}", exc_info=True)
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(stopping.wait(), REFRESH_INTERVAL_SECONDS)
+
+
+async def get_stats(
+    db: AsyncSession, start_date: date, end_date: date, model: Optional[str] = None
+) -> Dict:
+    """Daily statistics per model in the date range, with totals per model."""
+    where = [QueryStatsDaily.day >= start_date, QueryStatsDaily.day <= end_date]
+    if model:
+        where.append(QueryStatsDaily.model == model)
+
+    days = (
+        await db.scalars(
+            select(QueryStatsDaily)
+            .where(*where)
+            .order_by(QueryStatsDaily.day, QueryStatsDaily.model)
+        )
+    ).all()
+
+    # Percentiles of several days cannot be combined, so totals only have means
+    totals = await db.execute(
+        select(
+            QueryStatsDaily.model,
+            func.sum(QueryStatsDaily.queries).label("queries"),
+            (
+                func.sum(QueryStatsDaily.mean_response_time * QueryStatsDaily.queries)
+                / func.sum(QueryStatsDaily.queries)
+            ).label("mean_response_time"),
+            func.max(QueryStatsDaily.max_response_time).label("max_response_time"),
+            func.sum(QueryStatsDaily.feedback).label("feedback"),
+            func.sum(QueryStatsDaily.positive_feedback).label("positive_feedback"),
+        )
+        .where(*where)
+        .group_by(QueryStatsDaily.model)
+        .order_by(QueryStatsDaily.model)
+    )
+
+    refreshed_at: Optional[datetime] = await db.scalar(
+        select(func.max(QueryStatsDaily.refreshed_at))
+    )
+
+    return {
+        "days": days,
+        "models": [
+            {
+                **row,
+                "positive_feedback_ratio": (
+                    row["positive_feedback"] / row["feedback"]
+                    if row["feedback"]
+                    else None
+                ),
+            }
+            for row in totals.mappings()
+        ],
+        "refreshed_at": refreshed_at,
+    }
@@ -0,0 +1,205 @@
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from os import getenv
+from typing import Deque, Dict, Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+IN_FLIGHT = Gauge(
+    "llm_admission_in_flight",
+    "Generations currently running per model",
+    ["model"],
+)
+QUEUE_DEPTH = Gauge(
+    "llm_admission_queue_depth",
+    "Requests waiting for a generation slot per model, by priority",
+    ["model", "priority"],
+)
+QUEUE_WAIT = Histogram(
+    "llm_admission_wait_seconds",
+    "Time spent waiting for a generation slot, including rejected requests",
+    ["model"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30),
+)
+REJECTIONS = Counter(
+    "llm_admission_rejections_total",
+    "Requests rejected by admission control, by reason",
+    ["model", "reason"],
+)
+
+
+INTERACTIVE, BACKGROUND = "interactive", "background"
+
+_priority: ContextVar[str] = ContextVar("generation_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def priority(value: str):
+    """Sets the priority of the generations started in the block."""
+    token = _priority.set(value)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class OverloadedError(RuntimeError):
+    """
+    Raised when a request is not admitted to a saturated model: 429 if the wait
+    queue is full, 503 if no slot freed up within the queue timeout.
+    """
+
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Bounds the generations in flight against one model. Requests over the limit
+    wait in a bounded FIFO queue for at most queue_timeout seconds; when the queue
+    is full they are rejected right away rather than piling up on the GPU server
+    until everything times out.
+
+    Background generations (see priority) only get a slot when no interactive
+    request is waiting for one, and hold at most max_background slots at a time.
+    They wait outside the bounded queue and without timeout, for as long as
+    interactive requests keep the model busy.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        max_concurrency: int,
+        max_queue: int,
+        queue_timeout: float,
+        max_background: Optional[int] = None,
+    ):
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.max_background = max_background or max(1, max_concurrency // 2)
+        self._waiters: Dict[str, Deque[asyncio.Future]] = {
+            INTERACTIVE: deque(),
+            BACKGROUND: deque(),
+        }
+        self._in_flight = {INTERACTIVE: 0, BACKGROUND: 0}
+
+    def _reject(self, reason: str, message: str, status_code: int):
+        REJECTIONS.labels(self.model, reason).inc()
+        logger.warning("Rejected request to %s: %s", self.model, message)
+        raise OverloadedError(
+            message, status_code, retry_after=max(1, round(self.queue_timeout))
+        )
+
+    def _has_slot(self, priority: str) -> bool:
+        if sum(self._in_flight.values()) >= self.max_concurrency:
+            return False
+        if priority == BACKGROUND:
+            return (
+                not self._waiters[INTERACTIVE]
+                and self._in_flight[BACKGROUND] < self.max_background
+            )
+        return True
+
+    def _take(self, priority: str):
+        self._in_flight[priority] += 1
+        IN_FLIGHT.labels(self.model).set(sum(self._in_flight.values()))
+
+    def _release(self, priority: str):
+        self._in_flight[priority] -= 1
+        IN_FLIGHT.labels(self.model).set(sum(self._in_flight.values()))
+        # Hand the free slots to the waiters, interactive ones first
+        for waiting_priority in (INTERACTIVE, BACKGROUND):
+            waiters = self._waiters[waiting_priority]
+            while waiters and self._has_slot(waiting_priority):
+                waiter = waiters.popleft()
+                if not waiter.done():
+                    self._take(waiting_priority)
+                    waiter.set_result(None)
+
+    def _set_queue_depth(self):
+        for priority, waiters in self._waiters.items():
+            QUEUE_DEPTH.labels(self.model, priority).set(len(waiters))
+
+    async def _acquire(self, priority: str):
+        if self._has_slot(priority) and not self._waiters[priority]:
+            self._take(priority)
+            return
+        if (
+            priority == INTERACTIVE
+            and len(self._waiters[INTERACTIVE]) >= self.max_queue
+        ):
+            self._reject(
+                "queue_full",
+                f"Too many requests to {self.model}, please retry later",
+                429,
+            )
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[priority].append(waiter)
+        self._set_queue_depth()
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(
+                waiter,
+                timeout=self.queue_timeout if priority == INTERACTIVE else None,
+            )
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as the wait ended
+                self._release(priority)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self._reject(
+                "queue_timeout",
+                f"{self.model} is overloaded, no slot freed up within "
+                f"{self.queue_timeout:g}s",
+                503,
+            )
+        finally:
+            if waiter in self._waiters[priority]:
+                self._waiters[priority].remove(waiter)
+            self._set_queue_depth()
+            QUEUE_WAIT.labels(self.model).observe(time.monotonic() - start)
+
+    @asynccontextmanager
+    async def slot(self):
+        """Holds a generation slot, at the current priority, for the block."""
+        priority = _priority.get()
+        await self._acquire(priority)
+        try:
+            yield
+        finally:
+            self._release(priority)
+
+
+ADMISSION_CONTROLLERS = {}
+
+
+def get_admission_controller(model: str) -> AdmissionController:
+    """
+    Admission controller of a model, created on first use. The concurrency limit
+    comes from LLM_CONCURRENCY_LIMITS (JSON map of model to limit) or
+    LLM_MAX_CONCURRENCY, background generations get at most
+    LLM_BACKGROUND_MAX_CONCURRENCY slots (half of them by default).
+    """
+    if model not in ADMISSION_CONTROLLERS:
+        limits = json.loads(getenv("LLM_CONCURRENCY_LIMITS", "{}"))
+        ADMISSION_CONTROLLERS[model] = AdmissionController(
+            model,
+            max_concurrency=int(limits.get(model, getenv("LLM_MAX_CONCURRENCY", "8"))),
+            max_queue=int(getenv("LLM_MAX_QUEUE", "32")),
+            queue_timeout=float(getenv("LLM_QUEUE_TIMEOUT_SECONDS", "10")),
+            max_background=int(getenv("LLM_BACKGROUND_MAX_CONCURRENCY", "0")) or None,
+        )
+    return ADMISSION_CONTROLLERS[model]
@@ -0,0 +1,87 @@
+import functools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from os import getenv
+from typing import Dict, Optional
+
+from prometheus_client import Counter
+
+logger = logging.getLogger(__name__)
+
+DEGRADATIONS = Counter(
+    "request_degradations_total",
+    "Pipeline stages degraded because the request deadline was close",
+    ["degradation"],
+)
+
+REQUEST_DEADLINE_SECONDS = float(getenv("REQUEST_DEADLINE_SECONDS", "45"))
+# Time kept for answer generation when deciding whether to run optional stages
+ANSWER_RESERVE_SECONDS = float(getenv("DEADLINE_ANSWER_RESERVE_SECONDS", "10"))
+
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceededError(TimeoutError):
+    """Raised when a request runs out of its end-to-end time budget."""
+
+
+@contextmanager
+def request_deadline(seconds: float = REQUEST_DEADLINE_SECONDS):
+    """Sets the deadline of the current request, unless an outer one is set."""
+    if _deadline.get() is not None:
+        yield
+        return
+    token = _deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+@contextmanager
+def no_deadline():
+    """Lifts the request deadline, e.g. for work continuing after the response."""
+    token = _deadline.set(None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def with_deadline(fn):
+    """Runs a coroutine function under a request deadline."""
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        with request_deadline():
+            return await fn(*args, **kwargs)
+
+    return wrapper
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the request deadline, or None outside a request."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def time_is_short(stage_seconds: float) -> bool:
+    """
+    Whether an optional stage taking up to stage_seconds would eat into the time
+    kept for generating the answer.
+    """
+    left = remaining()
+    return left is not None and left < stage_seconds + ANSWER_RESERVE_SECONDS
+
+
+def degrade(config: Dict, degradation: str):
+    """Records a degradation in the Langfuse metadata of the request."""
+    logger.warning(
+        "Degrading request (%s), %.1fs left before its deadline",
+        degradation,
+        remaining() or 0,
+    )
+    DEGRADATIONS.labels(degradation).inc()
+    config["metadata"].setdefault("degradations", []).append(degradation)
@@ -0,0 +1,192 @@
+import csv
+import io
+import json
+import uuid
+import zlib
+from datetime import datetime
+from os import getenv
+from typing import Any, AsyncIterator, Dict, List, Literal
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from backend.src.database import SessionLocal
+from sqlalchemy import Table, select, text
+
+ExportFormat = Literal["csv", "jsonl", "parquet"]
+
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+BATCH_SIZE = int(getenv("EXPORT_BATCH_SIZE", "1000"))
+# Exports scan a whole date range, so they get a longer timeout than the API
+STATEMENT_TIMEOUT_MS = int(getenv("EXPORT_STATEMENT_TIMEOUT_MS", "300000"))
+
+ARROW_TYPES = {
+    uuid.UUID: pa.string(),
+    str: pa.string(),
+    list: pa.list_(pa.string()),
+    datetime: pa.timestamp("us"),
+    float: pa.float64(),
+    int: pa.int64(),
+    bool: pa.bool_(),
+}
+
+Batch = List[Dict[str, Any]]
+
+
+async def fetch_batches(
+    table: Table, start_date: datetime, end_date: datetime
+) -> AsyncIterator[Batch]:
+    """
+    Rows of table within the date range, in batches read from a server-side
+    cursor. The session is opened here rather than taken from the request, as
+    the response body is sent after the request's dependencies are closed.
+    """
+    statement = (
+        select(table)
+        .where(table.c.timestamp >= start_date, table.c.timestamp <= end_date)
+        .order_by(table.c.timestamp)
+        .execution_options(yield_per=BATCH_SIZE)
+    )
+    async with SessionLocal() as db, db.begin():
+        await db.execute(text(f"SET LOCAL statement_timeout = {STATEMENT_TIMEOUT_MS}"))
+        result = await db.stream(statement)
+        async for partition in result.mappings().partitions():
+            yield [dict(row) for row in partition]
+
+
+def _arrow_value(value: Any) -> Any:
+    return str(value) if isinstance(value, uuid.UUID) else value
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file collecting the bytes written since the last drain."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class Encoder:
+    """Turns batches of rows into chunks of an export file."""
+
+    def __init__(self, table: Table):
+        self.columns = [column.name for column in table.columns]
+
+    def header(self) -> bytes:
+        return b""
+
+    def encode(self, batch: Batch) -> bytes:
+        raise NotImplementedError
+
+    def footer(self) -> bytes:
+        return b""
+
+
+class CsvEncoder(Encoder):
+    def header(self) -> bytes:
+        return self.encode_rows([self.columns])
+
+    def encode(self, batch: Batch) -> bytes:
+        return self.encode_rows(
+            [row[column] for column in self.columns] for row in batch
+        )
+
+    @staticmethod
+    def encode_rows(rows) -> bytes:
+        output = io.StringIO()
+        csv.writer(output).writerows(rows)
+        return output.getvalue().encode()
+
+
+class JsonlEncoder(Encoder):
+    def encode(self, batch: Batch) -> bytes:
+        return "".join(json.dumps(row, default=str) + "\n" for row in batch).encode()
+
+
+class ParquetEncoder(Encoder):
+    """Writes a row group per batch, sending each one as soon as it is written."""
+
+    def __init__(self, table: Table):
+        super().__init__(table)
+        self.schema = pa.schema(
+            [
+                (column.name, ARROW_TYPES[column.type.python_type])
+                for column in table.columns
+            ]
+        )
+        self.sink = _ChunkSink()
+        self.writer = pq.ParquetWriter(self.sink, self.schema)
+
+    def encode(self, batch: Batch) -> bytes:
+        arrays = {
+            column: [_arrow_value(row[column]) for row in batch]
+            for column in self.columns
+        }
+        self.writer.write_table(pa.Table.from_pydict(arrays, schema=self.schema))
+        return self.sink.drain()
+
+    def footer(self) -> bytes:
+        self.writer.close()
+        return self.sink.drain()
+
+
+ENCODERS = {"csv": CsvEncoder, "jsonl": JsonlEncoder, "parquet": ParquetEncoder}
+
+
+async def stream_export(
+    table: Table,
+    start_date: datetime,
+    end_date: datetime,
+    export_format: ExportFormat,
+    gzip: bool = False,
+) -> AsyncIterator[bytes]:
+    """
+    Export file of the rows of table within the date range, produced one batch at
+    a time so memory stays flat whatever the size of the range.
+    """
+    encoder = ENCODERS[export_format](table)
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16) if gzip else None
+
+    def emit(chunk: bytes) -> bytes:
+        return compressor.compress(chunk) if compressor else chunk
+
+    if header := encoder.header():
+        yield emit(header)
+    async for batch in fetch_batches(table, start_date, end_date):
+        if chunk := emit(encoder.encode(batch)):
+            yield chunk
+    if footer := emit(encoder.footer()):
+        yield footer
+    if compressor:
+        yield compressor.flush()
+
+
+def export_filename(
+    prefix: str,
+    start_date: datetime,
+    end_date: datetime,
+    export_format: ExportFormat,
+    gzip: bool = False,
+) -> str:
+    extension = f"{export_format}.gz" if gzip else export_format
+    return f"{prefix}_{start_date.date()}_{end_date.date()}.{extension}"
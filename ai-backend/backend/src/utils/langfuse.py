@@ -1,33 +1,185 @@
+import asyncio
+import json
 import logging
+import os
+import tempfile
+import threading
+from os import getenv
+from typing import Callable, Dict, List, Set
 
 from langchain_core.prompts import PromptTemplate
 from langfuse import Langfuse
 from langfuse.api.resources.commons.errors.not_found_error import NotFoundError
+from langfuse.api.resources.prompts.types import Prompt_Text
+from langfuse.model import TextPromptClient
 
 logger = logging.getLogger(__name__)
 
 langfuse = Langfuse()
 
+# Prompts loaded at startup, so that no request has to fetch one
+PROMPT_NAMES = [
+    "expand-query",
+    "generate-answer",
+    "generate-answer-playground",
+    "rag-query",
+    "rag-paper-query",
+    "summarize-history",
+]
+
 
 # Locally langfuse.environment should be unset (None)
-def get_prompt(prompt_name: str):
-    def fetch_prompt(label: str = None):
+def fetch_prompt(prompt_name: str) -> TextPromptClient:
+    def fetch(label: str = None):
         return langfuse.get_prompt(
             prompt_name,
-            cache_ttl_seconds=0 if langfuse.environment is None else None,
+            cache_ttl_seconds=0,
             label=label,
+            fetch_timeout_seconds=int(getenv("PROMPT_FETCH_TIMEOUT_SECONDS", "5")),
         )
 
     try:
         label = "latest" if langfuse.environment is None else langfuse.environment
-        langfuse_prompt = fetch_prompt(label=label)
+        return fetch(label=label)
     except NotFoundError:
         logger.warning(
             f"Prompt '{prompt_name}' or label '{label}' "
             f"not found in Langfuse, trying label 'production'"
         )
-        langfuse_prompt = fetch_prompt()
+        return fetch()
+
+
+class PromptRegistry:
+    """
+    In-memory copy of the Langfuse prompts, refreshed in the background and saved
+    to a snapshot file after every change. At startup the snapshot is loaded
+    first, so the service can serve even if Langfuse is slow or unreachable.
+    Subscribers are called with the names of the prompts whose version changed.
+    """
+
+    def __init__(self, names: List[str], snapshot_path: str, refresh_interval: float):
+        self.names = list(names)
+        self.snapshot_path = snapshot_path
+        self.refresh_interval = refresh_interval
+        self._prompts: Dict[str, TextPromptClient] = {}
+        self._subscribers: List[Callable[[Set[str]], None]] = []
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def subscribe(self, callback: Callable[[Set[str]], None]):
+        self._subscribers.append(callback)
+
+    def load_snapshot(self):
+        try:
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.error(f"Could not read prompt snapshot: {str(e)}")
+            return
+        with self._lock:
+            for name, prompt in snapshot.items():
+                self._prompts[name] = TextPromptClient(
+                    Prompt_Text(type="text", **prompt)
+                )
+        logger.info(f"Loaded {len(snapshot)} prompts from {self.snapshot_path}")
+
+    def save_snapshot(self):
+        with self._lock:
+            snapshot = {
+                name: {
+                    "name": prompt.name,
+                    "version": prompt.version,
+                    "prompt": prompt.prompt,
+                    "config": prompt.config,
+                    "labels": prompt.labels,
+                    "tags": prompt.tags,
+                }
+                for name, prompt in self._prompts.items()
+            }
+        # Write then rename, so a crash never leaves a truncated snapshot
+        directory = os.path.dirname(os.path.abspath(self.snapshot_path))
+        with tempfile.NamedTemporaryFile(
+            "w", dir=directory, suffix=".tmp", delete=False
+        ) as f:
+            json.dump(snapshot, f)
+        os.replace(f.name, self.snapshot_path)
 
+    def refresh(self, names: List[str] = None) -> Set[str]:
+        """Fetches prompts from Langfuse, returning the names of the changed ones."""
+        changed = set()
+        for name in names or self.names:
+            try:
+                prompt = fetch_prompt(name)
+            except Exception as e:
+                logger.warning(f"Could not refresh prompt '{name}': {str(e)}")
+                continue
+            with self._lock:
+                if self._prompts.get(name) != prompt:
+                    self._prompts[name] = prompt
+                    changed.add(name)
+        if changed:
+            try:
+                self.save_snapshot()
+            except Exception as e:
+                logger.error(f"Could not save prompt snapshot: {str(e)}")
+        return changed
+
+    def load(self):
+        """Loads the snapshot, then fetches the prompts it doesn't have."""
+        self.load_snapshot()
+        missing = [name for name in self.names if name not in self._prompts]
+        if missing:
+            self.refresh(missing)
+        self._loaded = True
+
+    async def refresh_forever(self):
+        while True:
+            changed = await asyncio.to_thread(self.refresh)
+            if changed:
+                logger.warning(f"Prompts changed: {sorted(changed)}")
+                for callback in self._subscribers:
+                    try:
+                        callback(changed)
+                    except Exception as e:
+                        logger.error(
+                            f"Could not apply prompt changes: {str(e)}", exc_info=True
+                        )
+            await asyncio.sleep(self.refresh_interval)
+
+    def get(self, name: str) -> TextPromptClient:
+        # The app loads the prompts at startup, scripts on first use
+        if not self._loaded:
+            self.load()
+        with self._lock:
+            prompt = self._prompts.get(name)
+        if prompt is not None:
+            return prompt
+        # Known prompts that could not be loaded are left to the background
+        # refresh; only prompts missing from PROMPT_NAMES are fetched here
+        if name in self.names:
+            raise NotFoundError(f"Prompt '{name}' is not available")
+        self.names.append(name)
+        self.refresh([name])
+        with self._lock:
+            if name not in self._prompts:
+                raise NotFoundError(f"Prompt '{name}' is not available")
+            return self._prompts[name]
+
+
+PROMPTS = PromptRegistry(
+    PROMPT_NAMES,
+    snapshot_path=getenv(
+        "PROMPT_SNAPSHOT_PATH",
+        os.path.join(tempfile.gettempdir(), "feynbot-prompts.json"),
+    ),
+    refresh_interval=float(getenv("PROMPT_REFRESH_SECONDS", "60")),
+)
+
+
+def get_prompt(prompt_name: str):
+    langfuse_prompt = PROMPTS.get(prompt_name)
     prompt_template = PromptTemplate.from_template(
         langfuse_prompt.get_langchain_prompt(),
         metadata={"langfuse_prompt": langfuse_prompt},
@@ -0,0 +1,334 @@
+import asyncio
+import functools
+import logging
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from os import getenv
+from typing import Optional, Tuple
+
+from backend.src.utils.deadline import DeadlineExceededError, remaining
+from prometheus_client import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+BREAKER_STATE = Gauge(
+    "backend_circuit_breaker_state",
+    "Circuit breaker state per backend (0=closed, 1=half-open, 2=open)",
+    ["backend"],
+)
+BACKEND_CALLS = Counter(
+    "backend_calls_total",
+    "Calls made through the resilience layer, by outcome",
+    ["backend", "outcome"],
+)
+BACKEND_LATENCY = Histogram(
+    "backend_call_duration_seconds",
+    "Latency of successful backend calls",
+    ["backend"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 40, 60),
+)
+HEDGED_REQUESTS = Counter(
+    "backend_hedged_requests_total",
+    "Duplicate requests sent because the primary exceeded the hedge delay",
+    ["backend"],
+)
+HEDGE_WINS = Counter(
+    "backend_hedge_wins_total",
+    "Hedged duplicate requests that returned before the primary",
+    ["backend"],
+)
+ADAPTIVE_TIMEOUT = Gauge(
+    "backend_adaptive_timeout_seconds",
+    "Timeout currently applied to calls to each backend",
+    ["backend"],
+)
+
+_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(getenv("RESILIENCE_MAX_WORKERS", "32")),
+    thread_name_prefix="backend-call",
+)
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised when a call is rejected because the backend's circuit is open."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class BackendTimeoutError(TimeoutError):
+    """Raised when a backend does not answer within its (adaptive) timeout."""
+
+
+class LatencyWindow:
+    """Sliding window of recent successful call latencies."""
+
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self._samples = deque(maxlen=size)
+        self._min_samples = min_samples
+        self._lock = threading.Lock()
+
+    def add(self, latency: float):
+        with self._lock:
+            self._samples.append(latency)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Returns the p-th percentile (0-1), or None until enough samples exist."""
+        with self._lock:
+            if len(self._samples) < self._min_samples:
+                return None
+            samples = sorted(self._samples)
+        return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+
+class CircuitBreaker:
+    """Classic closed/open/half-open breaker, tripped by consecutive failures."""
+
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+    def __init__(self, name: str, failure_threshold: int, recovery_time: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        BREAKER_STATE.labels(name).set(self.CLOSED)
+
+    @property
+    def state(self) -> int:
+        return self._state
+
+    def _set_state(self, state: int):
+        if state != self._state:
+            logger.warning(
+                "Circuit breaker for %s changed state %d -> %d",
+                self.name,
+                self._state,
+                state,
+            )
+        self._state = state
+        BREAKER_STATE.labels(self.name).set(state)
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.recovery_time:
+                    return False
+                self._set_state(self.HALF_OPEN)
+            # Half-open: let a single probe through until it reports back
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def retry_after(self) -> int:
+        """Seconds until the breaker lets a probe through, at least 1."""
+        left = self.recovery_time - (time.monotonic() - self._opened_at)
+        return max(1, math.ceil(left))
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probe_in_flight = False
+            self._set_state(self.CLOSED)
+
+    def release_probe(self):
+        """Lets another probe through after one ended without telling anything."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if (
+                self._state == self.HALF_OPEN
+                or self._failures >= self.failure_threshold
+            ):
+                self._opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+
+class ResilientBackend:
+    """
+    Wraps calls to a single backend (embedding, vector store, reranker, LLM...)
+    with a circuit breaker and a timeout derived from observed latency, capped by
+    the time left before the request deadline. For idempotent backends, a
+    duplicate request is hedged once the primary is slower than the hedge
+    percentile of recent calls, and the first answer wins.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        timeout: float,
+        hedge: bool = False,
+        hedge_percentile: Optional[float] = None,
+        timeout_percentile: Optional[float] = None,
+        timeout_multiplier: Optional[float] = None,
+        min_timeout: Optional[float] = None,
+        failure_threshold: Optional[int] = None,
+        recovery_time: Optional[float] = None,
+        ignored_exceptions: tuple = (),
+    ):
+        # Settings not given are read from the environment when the backend is
+        # created, not when this module is imported
+        if hedge_percentile is None:
+            hedge_percentile = float(getenv("HEDGE_PERCENTILE", "0.95"))
+        if timeout_percentile is None:
+            timeout_percentile = float(getenv("ADAPTIVE_TIMEOUT_PERCENTILE", "0.99"))
+        if timeout_multiplier is None:
+            timeout_multiplier = float(getenv("ADAPTIVE_TIMEOUT_MULTIPLIER", "3"))
+        if min_timeout is None:
+            min_timeout = float(getenv("ADAPTIVE_TIMEOUT_MIN_SECONDS", "2"))
+        if failure_threshold is None:
+            failure_threshold = int(getenv("CIRCUIT_BREAKER_FAILURES", "5"))
+        if recovery_time is None:
+            recovery_time = float(getenv("CIRCUIT_BREAKER_RECOVERY_SECONDS", "30"))
+        self.name = name
+        self.timeout = timeout
+        self.hedge = hedge and getenv("HEDGING_ENABLED", "true").lower() == "true"
+        self.hedge_percentile = hedge_percentile
+        self.timeout_percentile = timeout_percentile
+        self.timeout_multiplier = timeout_multiplier
+        self.min_timeout = min_timeout
+        # Errors raised after the backend answered (e.g. output parsing) must not
+        # trip the breaker
+        self.ignored_exceptions = ignored_exceptions
+        self.latencies = LatencyWindow()
+        self.breaker = CircuitBreaker(name, failure_threshold, recovery_time)
+        ADAPTIVE_TIMEOUT.labels(name).set(timeout)
+
+    def current_timeout(self) -> float:
+        """Observed tail latency times a safety factor, capped by the static timeout."""
+        observed = self.latencies.percentile(self.timeout_percentile)
+        if observed is None:
+            return self.timeout
+        adaptive = max(self.min_timeout, observed * self.timeout_multiplier)
+        return min(self.timeout, adaptive)
+
+    def expected_latency(self, default: float) -> float:
+        """Typical (p95) latency of recent calls, or default until known."""
+        observed = self.latencies.percentile(0.95)
+        return default if observed is None else observed
+
+    def hedge_delay(self) -> Optional[float]:
+        if not self.hedge:
+            return None
+        return self.latencies.percentile(self.hedge_percentile)
+
+    def _before_call(self, timeout: Optional[float]) -> Tuple[float, bool]:
+        """
+        Returns the timeout of the call and whether it is the request deadline
+        (rather than the backend's own timeout) that bounds it.
+        """
+        left = remaining()
+        if left is not None and left <= 0:
+            BACKEND_CALLS.labels(self.name, "deadline").inc()
+            raise DeadlineExceededError(f"No time left to call {self.name}")
+        if not self.breaker.allow():
+            BACKEND_CALLS.labels(self.name, "circuit_open").inc()
+            raise CircuitOpenError(
+                f"Circuit breaker for {self.name} is open",
+                retry_after=self.breaker.retry_after(),
+            )
+        effective_timeout = self.current_timeout()
+        if timeout is not None:
+            effective_timeout = min(effective_timeout, timeout)
+        ADAPTIVE_TIMEOUT.labels(self.name).set(effective_timeout)
+        if left is not None and left < effective_timeout:
+            return left, True
+        return effective_timeout, False
+
+    def _on_success(self, latency: float):
+        self.latencies.add(latency)
+        self.breaker.record_success()
+        BACKEND_LATENCY.labels(self.name).observe(latency)
+        BACKEND_CALLS.labels(self.name, "success").inc()
+
+    def _on_failure(self, outcome: str, error: Optional[BaseException] = None):
+        if isinstance(error, self.ignored_exceptions):
+            self.breaker.record_success()
+            BACKEND_CALLS.labels(self.name, "ignored_error").inc()
+            return
+        self.breaker.record_failure()
+        BACKEND_CALLS.labels(self.name, outcome).inc()
+
+    def _on_timeout(self, timeout: float, deadline_bound: bool):
+        # Running out of request budget says nothing about the backend's health
+        if deadline_bound:
+            self.breaker.release_probe()
+            BACKEND_CALLS.labels(self.name, "deadline").inc()
+            raise DeadlineExceededError(
+                f"{self.name} did not answer before the request deadline"
+            )
+        self._on_failure("timeout")
+        raise BackendTimeoutError(f"{self.name} did not answer within {timeout:.1f}s")
+
+    def _attempt(self, fn, args, kwargs) -> asyncio.Future:
+        """Starts a call: coroutine functions on the loop, blocking ones in a thread."""
+        if asyncio.iscoroutinefunction(fn):
+            return asyncio.ensure_future(fn(*args, **kwargs))
+        return asyncio.get_running_loop().run_in_executor(
+            _EXECUTOR, functools.partial(fn, *args, **kwargs)
+        )
+
+    async def acall(self, fn, *args, timeout: Optional[float] = None, **kwargs):
+        """
+        Awaits a call to the backend without blocking the event loop, hedging it
+        if the backend is idempotent. fn is a coroutine function or a blocking
+        function, which runs in a worker thread.
+        """
+        timeout, deadline_bound = self._before_call(timeout)
+        start = time.monotonic()
+        deadline = start + timeout
+
+        primary = self._attempt(fn, args, kwargs)
+        pending = {primary}
+        try:
+            hedge_delay = self.hedge_delay()
+            if hedge_delay is not None and hedge_delay < timeout:
+                done, _ = await asyncio.wait(pending, timeout=hedge_delay)
+                if not done:
+                    HEDGED_REQUESTS.labels(self.name).inc()
+                    pending.add(self._attempt(fn, args, kwargs))
+
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=max(0.0, deadline - time.monotonic()),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    break
+                for future in done:
+                    if future.exception() is None:
+                        if future is not primary:
+                            HEDGE_WINS.labels(self.name).inc()
+                        self._on_success(time.monotonic() - start)
+                        return future.result()
+                    error = future.exception()
+        except asyncio.CancelledError:
+            # The caller gave up, which says nothing about the backend's health
+            self.breaker.release_probe()
+            raise
+        finally:
+            # Coroutines are cancelled; blocking requests keep running in their
+            # worker threads until their own client timeout fires.
+            for future in pending:
+                future.cancel()
+
+        if error is not None and not pending:
+            self._on_failure("error", error)
+            raise error
+        self._on_timeout(timeout, deadline_bound)
@@ -0,0 +1,196 @@
+import asyncio
+import contextlib
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from os import getenv
+from typing import Any, Awaitable, Callable, Optional
+
+from backend.src.utils.admission import BACKGROUND, INTERACTIVE, priority
+from prometheus_client import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+QUEUED = Gauge(
+    "scheduler_queued_jobs",
+    "Requests or jobs waiting for a worker, by priority class",
+    ["priority"],
+)
+RUNNING = Gauge(
+    "scheduler_running_jobs",
+    "Requests or jobs being served, by priority class",
+    ["priority"],
+)
+BACKGROUND_ALLOWED = Gauge(
+    "scheduler_background_workers_allowed",
+    "Background workers currently allowed to start jobs",
+)
+DROPPED_JOBS = Counter(
+    "scheduler_dropped_jobs_total",
+    "Background jobs rejected because the queue was full",
+)
+
+
+class RecentLatencies:
+    """Latencies observed in the last `window` seconds."""
+
+    def __init__(self, window: float, min_samples: int = 10):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples = deque()
+
+    def add(self, latency: float):
+        self._samples.append((time.monotonic(), latency))
+
+    def percentile(self, p: float) -> Optional[float]:
+        """p-th percentile (0-1), or None without enough recent samples."""
+        cutoff = time.monotonic() - self.window
+        while self._samples and self._samples[0][0] < cutoff:
+            self._samples.popleft()
+        if len(self._samples) < self.min_samples:
+            return None
+        latencies = sorted(latency for _, latency in self._samples)
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+
+class PriorityScheduler:
+    """
+    Shares the backends between interactive requests, served inline, and
+    background jobs, run by a fixed pool of workers from a bounded queue.
+
+    A background worker only starts a job when no interactive request is waiting
+    for a slot. When the p95 latency of recent interactive requests exceeds
+    latency_target, only a single background worker keeps running. Jobs run at
+    background priority, so their generations also yield to interactive ones in
+    the LLM admission control.
+    """
+
+    def __init__(
+        self,
+        interactive_workers: int,
+        background_workers: int,
+        background_queue_size: int,
+        latency_target: float,
+        latency_window: float = 60,
+    ):
+        self.interactive_workers = interactive_workers
+        self.background_workers = background_workers
+        self.latency_target = latency_target
+        self.latencies = RecentLatencies(latency_window)
+        self._interactive_slots = asyncio.Semaphore(interactive_workers)
+        self._interactive_waiting = 0
+        self._interactive_running = 0
+        self._queue = asyncio.Queue(maxsize=background_queue_size)
+        self._workers = []
+        self._closing = False
+        # Set whenever interactive requests start waiting, start or finish
+        self._interactive_changed = asyncio.Event()
+
+    def background_allowed(self) -> int:
+        """Number of background workers allowed to start a job right now."""
+        if self._interactive_waiting:
+            return 0
+        p95 = self.latencies.percentile(0.95)
+        if p95 is not None and p95 > self.latency_target:
+            return 1
+        return self.background_workers
+
+    @asynccontextmanager
+    async def interactive(self):
+        """Serves an interactive request within its class's worker budget."""
+        start = time.monotonic()
+        self._interactive_waiting += 1
+        QUEUED.labels(INTERACTIVE).set(self._interactive_waiting)
+        self._interactive_changed.set()
+        try:
+            await self._interactive_slots.acquire()
+        finally:
+            self._interactive_waiting -= 1
+            QUEUED.labels(INTERACTIVE).set(self._interactive_waiting)
+            self._interactive_changed.set()
+
+        self._interactive_running += 1
+        RUNNING.labels(INTERACTIVE).set(self._interactive_running)
+        try:
+            yield
+        finally:
+            self._interactive_running -= 1
+            RUNNING.labels(INTERACTIVE).set(self._interactive_running)
+            self._interactive_slots.release()
+            self.latencies.add(time.monotonic() - start)
+            self._interactive_changed.set()
+
+    def submit_background(self, fn: Callable[..., Awaitable[Any]], *args) -> bool:
+        """Queues a background job, returning False if the queue is full or closed."""
+        if self._closing:
+            logger.warning("Scheduler closed, dropping %s", fn.__name__)
+            return False
+        if not self._workers:
+            self._workers = [
+                asyncio.create_task(self._work(index))
+                for index in range(self.background_workers)
+            ]
+        try:
+            self._queue.put_nowait((fn, args))
+        except asyncio.QueueFull:
+            DROPPED_JOBS.inc()
+            logger.warning("Background queue full, dropping %s", fn.__name__)
+            return False
+        QUEUED.labels(BACKGROUND).set(self._queue.qsize())
+        return True
+
+    async def close(self, timeout: float):
+        """
+        Stops accepting background jobs, lets the workers finish the queued ones
+        for up to timeout seconds, then cancels them.
+        """
+        self._closing = True
+        if not self._workers:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                "Cancelling background jobs, %d still queued", self._queue.qsize()
+            )
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def _wait_until_allowed(self, index: int):
+        while True:
+            self._interactive_changed.clear()
+            allowed = self.background_allowed()
+            BACKGROUND_ALLOWED.set(allowed)
+            if index < allowed:
+                return
+            # Recent latencies also age out of their window without any request
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(
+                    self._interactive_changed.wait(), self.latencies.window
+                )
+
+    async def _work(self, index: int):
+        while True:
+            fn, args = await self._queue.get()
+            await self._wait_until_allowed(index)
+            QUEUED.labels(BACKGROUND).set(self._queue.qsize())
+            RUNNING.labels(BACKGROUND).inc()
+            try:
+                with priority(BACKGROUND):
+                    await fn(*args)
+            except Exception as e:
+                logger.error(f"Background job failed: {str(e)}", exc_info=True)
+            finally:
+                RUNNING.labels(BACKGROUND).dec()
+                self._queue.task_done()
+
+
+SCHEDULER = PriorityScheduler(
+    interactive_workers=int(getenv("SCHEDULER_INTERACTIVE_WORKERS", "64")),
+    background_workers=int(getenv("SCHEDULER_BACKGROUND_WORKERS", "2")),
+    background_queue_size=int(getenv("SCHEDULER_BACKGROUND_QUEUE_SIZE", "1000")),
+    latency_target=float(getenv("SCHEDULER_INTERACTIVE_LATENCY_TARGET", "15")),
+)
@@ -0,0 +1,57 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+from prometheus_client import Counter, Gauge
+
+COALESCED_REQUESTS = Counter(
+    "coalesced_requests_total",
+    "Requests that attached to an identical in-flight computation",
+    ["endpoint"],
+)
+INFLIGHT_COMPUTATIONS = Gauge(
+    "singleflight_inflight_computations",
+    "Distinct computations currently shared through single-flight",
+    ["endpoint"],
+)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into a single computation. Use
+    one instance per endpoint, as keys are only compared within an instance.
+
+    The computation runs in its own task, so a caller that disconnects (and gets
+    cancelled) does not cancel the work the other callers are waiting for.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+            INFLIGHT_COMPUTATIONS.labels(self.name).dec()
+        # Mark the exception as retrieved in case every caller went away
+        if not task.cancelled():
+            task.exception()
+
+    async def do(
+        self,
+        key: Hashable,
+        fn: Callable[..., Awaitable[Any]],
+        *args,
+        **kwargs,
+    ) -> Tuple[Any, bool]:
+        """Returns the result of fn and whether it was shared with another caller."""
+        task = self._inflight.get(key)
+        shared = task is not None
+        if shared:
+            COALESCED_REQUESTS.labels(self.name).inc()
+        else:
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self._inflight[key] = task
+            INFLIGHT_COMPUTATIONS.labels(self.name).inc()
+            task.add_done_callback(lambda t: self._forget(key, t))
+
+        return await asyncio.shield(task), shared
@@ -0,0 +1,287 @@
+import functools
+import logging
+import queue
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from os import getenv
+from typing import Any, Callable, Dict, Optional
+
+from backend.src.database import SessionLocal
+from backend.src.models import RetainedTrace
+from backend.src.utils.write_behind import RETAINED_TRACES_WRITER, WriteBehindBuffer
+from langfuse.callback import CallbackHandler
+from prometheus_client import Counter, Gauge, Summary
+from sqlalchemy import delete
+
+logger = logging.getLogger(__name__)
+
+TRACES = Counter(
+    "langfuse_traces_total",
+    "Requests by tracing decision",
+    ["sampled"],
+)
+CALLBACK_SECONDS = Summary(
+    "langfuse_callback_seconds",
+    "Time spent in Langfuse callbacks on the request path, by event",
+    ["event"],
+)
+EXPORT_QUEUE_DEPTH = Gauge(
+    "langfuse_export_queue_depth",
+    "Tracing exports (scores, traces) waiting for the export worker",
+)
+EXPORT_DROPPED = Counter(
+    "langfuse_export_dropped_total",
+    "Tracing exports dropped because the export queue was full",
+)
+RETAINED_LOOKUPS = Counter(
+    "langfuse_retained_trace_lookups_total",
+    "Feedback on unsampled traces, by where their summary was found "
+    "(memory, database or missing)",
+    ["source"],
+)
+EXPORT_ERRORS = Counter(
+    "langfuse_export_errors_total",
+    "Tracing exports that raised an error",
+)
+
+
+def _timed(name: str, method: Callable) -> Callable:
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            CALLBACK_SECONDS.labels(name).observe(time.perf_counter() - start)
+
+    return wrapper
+
+
+class TimedCallbackHandler(CallbackHandler):
+    """
+    Langfuse callback handler measuring the time its callbacks take, as they run
+    in the request's own thread. The overhead per request is the sum of
+    langfuse_callback_seconds over the sampled langfuse_traces_total.
+    """
+
+
+for _name in dir(CallbackHandler):
+    if _name.startswith("on_"):
+        setattr(
+            TimedCallbackHandler, _name, _timed(_name, getattr(CallbackHandler, _name))
+        )
+
+
+class ExportQueue:
+    """
+    Bounded queue of tracing calls run by a background thread, so the request
+    path never waits on Langfuse. Calls are dropped when the queue is full.
+    """
+
+    def __init__(self, maxsize: int):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._work, name="langfuse-export", daemon=True
+            )
+            self._thread.start()
+
+    def close(self, timeout: float):
+        """Stops the worker thread once the queued calls are done, or timeout."""
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+        self._thread = None
+
+    def submit(self, fn: Callable, *args, **kwargs) -> bool:
+        try:
+            self._queue.put_nowait((fn, args, kwargs))
+        except queue.Full:
+            EXPORT_DROPPED.inc()
+            logger.warning("Langfuse export queue full, dropping %s", fn.__name__)
+            return False
+        EXPORT_QUEUE_DEPTH.set(self._queue.qsize())
+        return True
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            EXPORT_QUEUE_DEPTH.set(self._queue.qsize())
+            if item is None:
+                return
+            fn, args, kwargs = item
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                EXPORT_ERRORS.inc()
+                logger.error(f"Langfuse export failed: {str(e)}", exc_info=True)
+
+
+class Tracer:
+    """
+    Traces a sample_rate fraction of requests with the Langfuse callback handler.
+    For the others, a short summary (input, output, metadata) is retained, so a
+    trace can still be created if the response receives feedback. Summaries are
+    written to the retained_traces table, as feedback may reach another replica,
+    and the latest ones are also kept in memory, along with the IDs of the latest
+    sampled traces, which need no lookup.
+    """
+
+    def __init__(
+        self,
+        handler: CallbackHandler,
+        sample_rate: float,
+        export_queue: ExportQueue,
+        retained_traces: int,
+        store: WriteBehindBuffer,
+    ):
+        self.handler = handler
+        self.sample_rate = sample_rate
+        self.exports = export_queue
+        self.retained_traces = retained_traces
+        self.store = store
+        self._retained: OrderedDict[str, Dict[str, Any]] = OrderedDict()
+        self._sampled: OrderedDict[str, None] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember_sampled(self, trace_id: str):
+        """Records a trace that exists in Langfuse, sampled or already scored."""
+        with self._lock:
+            self._sampled[trace_id] = None
+            if len(self._sampled) > self.retained_traces:
+                self._sampled.popitem(last=False)
+
+    def config(self, user: Optional[str] = None) -> Dict:
+        """LangChain run config of a request, with a manual trace ID for feedback."""
+        sampled = random.random() < self.sample_rate
+        TRACES.labels(str(sampled).lower()).inc()
+        run_id = str(uuid.uuid4())
+        if sampled:
+            self._remember_sampled(run_id)
+        return {
+            "callbacks": [self.handler] if sampled else [],
+            "metadata": {
+                "langfuse_session_id": str(uuid.uuid4()),
+                **({"langfuse_user_id": user} if user else {}),
+                "trace_sampled": sampled,
+            },
+            "run_id": run_id,
+        }
+
+    def retain(self, config: Dict, name: str, input: Any, output: Any):
+        """Keeps the summary of an unsampled trace until it may get feedback."""
+        if config["metadata"]["trace_sampled"]:
+            return
+        metadata = config["metadata"]
+        trace_id = str(config["run_id"])
+        retained = {
+            "name": name,
+            "input": input,
+            "output": output,
+            "user_id": metadata.get("langfuse_user_id"),
+            "session_id": metadata.get("langfuse_session_id"),
+            "metadata": {
+                key: value
+                for key, value in metadata.items()
+                if not key.startswith("langfuse_")
+            },
+        }
+        with self._lock:
+            self._retained[trace_id] = retained
+            if len(self._retained) > self.retained_traces:
+                self._retained.popitem(last=False)
+        self.store.add({"id": uuid.UUID(trace_id), "trace": retained})
+
+    async def _take_retained(self, trace_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Removes the summary of an unsampled trace, returning it if found. Traces
+        known to exist in Langfuse, and all of them when every request is
+        sampled, are not looked up.
+        """
+        with self._lock:
+            if self.sample_rate >= 1 or trace_id in self._sampled:
+                return None
+            retained = self._retained.pop(trace_id, None)
+        if retained is not None:
+            # Its row is left to prune-traces, a replica scoring it again would
+            # only update the same trace
+            RETAINED_LOOKUPS.labels("memory").inc()
+            return retained
+        try:
+            async with SessionLocal() as db, db.begin():
+                stored = await db.scalar(
+                    delete(RetainedTrace)
+                    .where(RetainedTrace.id == uuid.UUID(trace_id))
+                    .returning(RetainedTrace.trace)
+                )
+        except ValueError:
+            stored = None
+        except Exception as e:
+            logger.error(f"Could not load retained trace {trace_id}: {str(e)}")
+            stored = None
+        RETAINED_LOOKUPS.labels("database" if stored is not None else "missing").inc()
+        return stored
+
+    def link(self, trace_id: str, user: Optional[str], coalesced_with: str):
+        """Traces a request that shared the result of the trace coalesced_with."""
+        config = self.config(user)
+        config["run_id"] = trace_id
+        config["metadata"]["coalesced_with"] = coalesced_with
+        if not config["metadata"]["trace_sampled"]:
+            self.retain(config, "coalesced-request", None, None)
+            return
+        self._remember_sampled(trace_id)
+        self.exports.submit(
+            self.handler.langfuse.trace,
+            id=trace_id,
+            name="coalesced-request",
+            user_id=user,
+            metadata={"coalesced_with": coalesced_with},
+        )
+
+    async def score(
+        self, trace_id: str, score_id: Optional[str] = None, **score
+    ) -> str:
+        """
+        Queues a score for a trace, creating the trace first if it was not
+        sampled. The score ID is generated here, so callers get it right away
+        and can update the score later; updates need no trace.
+        """
+        retained = None if score_id else await self._take_retained(trace_id)
+        score_id = score_id or str(uuid.uuid4())
+        if retained:
+            self.exports.submit(
+                self.handler.langfuse.trace,
+                id=trace_id,
+                **retained,
+                tags=["unsampled"],
+            )
+            self._remember_sampled(trace_id)
+        self.exports.submit(
+            self.handler.langfuse.score, id=score_id, trace_id=trace_id, **score
+        )
+        return score_id
+
+
+TRACER = Tracer(
+    handler=TimedCallbackHandler(
+        public_key=getenv("LANGFUSE_PUBLIC_KEY"),
+        secret_key=getenv("LANGFUSE_SECRET_KEY"),
+        host=getenv("LANGFUSE_HOST"),
+        release=getenv("BACKEND_VERSION"),
+    ),
+    sample_rate=float(getenv("LANGFUSE_SAMPLE_RATE", "1")),
+    export_queue=ExportQueue(maxsize=int(getenv("LANGFUSE_EXPORT_QUEUE_SIZE", "1000"))),
+    retained_traces=int(getenv("LANGFUSE_RETAINED_TRACES", "10000")),
+    store=RETAINED_TRACES_WRITER,
+)
@@ -0,0 +1,193 @@
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import datetime
+from os import getenv
+from typing import Any, Dict, List
+
+from backend.src.database import SessionLocal
+from backend.src.models import QueryIr, RetainedTrace
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import Table
+from sqlalchemy.dialects.postgresql import insert
+
+logger = logging.getLogger(__name__)
+
+ROWS_WRITTEN = Counter(
+    "write_behind_rows_total",
+    "Rows handled by write-behind buffers, by table and outcome",
+    ["table", "outcome"],
+)
+FLUSH_SECONDS = Histogram(
+    "write_behind_flush_seconds",
+    "Time to insert a batch of buffered rows, by table",
+    ["table"],
+)
+BUFFERED = Gauge(
+    "write_behind_buffered_rows",
+    "Rows waiting in a write-behind buffer, by table",
+    ["table"],
+)
+SPOOLED = Gauge(
+    "write_behind_spooled_rows",
+    "Rows waiting in the spool file of a write-behind buffer, by table",
+    ["table"],
+)
+
+Row = Dict[str, Any]
+
+
+class WriteBehindBuffer:
+    """
+    Collects rows and inserts them in bulk once max_batch rows are buffered or
+    flush_interval seconds have passed. Rows that cannot be inserted are appended
+    to a spool file and inserted again after the next successful flush.
+
+    Rows are given their ID here (their primary key with their timestamp), and
+    inserted with ON CONFLICT DO NOTHING, so replaying the spool after a partial
+    failure is safe.
+    """
+
+    def __init__(
+        self, table: Table, max_batch: int, flush_interval: float, spool_path: str
+    ):
+        self.table = table
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.spool_path = spool_path
+        self._rows: List[Row] = []
+        self._full = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+        self._stopping = False
+
+    def add(self, row: Row):
+        self._rows.append({"id": uuid.uuid4(), **row})
+        BUFFERED.labels(self.table.name).set(len(self._rows))
+        if len(self._rows) >= self.max_batch:
+            self._full.set()
+
+    def start(self):
+        # Refuse to start rather than lose rows when the database is down
+        directory = os.path.dirname(self.spool_path)
+        os.makedirs(directory, exist_ok=True)
+        if not os.access(directory, os.W_OK):
+            raise RuntimeError(f"Spool directory {directory} is not writable")
+        if os.path.exists(self.spool_path):
+            with open(self.spool_path) as f:
+                SPOOLED.labels(self.table.name).set(sum(1 for _ in f))
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Stops the flush loop and flushes the rows still buffered."""
+        # Let an ongoing flush finish rather than cancelling it halfway
+        self._stopping = True
+        self._full.set()
+        if self._task:
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while not self._stopping:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._full.wait(), self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        async with self._flush_lock:
+            self._full.clear()
+            rows, self._rows = self._rows, []
+            BUFFERED.labels(self.table.name).set(len(self._rows))
+            for start in range(0, len(rows), self.max_batch):
+                batch = rows[start : start + self.max_batch]
+                if not await self._insert(batch):
+                    await asyncio.to_thread(self._spool, rows[start:])
+                    return
+            await self._replay_spool()
+
+    async def _insert(self, rows: List[Row]) -> bool:
+        if not rows:
+            return True
+        start = time.perf_counter()
+        try:
+            async with SessionLocal() as db, db.begin():
+                await db.execute(
+                    insert(self.table).on_conflict_do_nothing(
+                        index_elements=[
+                            column.name for column in self.table.primary_key
+                        ]
+                    ),
+                    rows,
+                )
+        except Exception as e:
+            logger.error(
+                f"Could not insert {len(rows)} rows into {self.table.name}: {str(e)}"
+            )
+            return False
+        FLUSH_SECONDS.labels(self.table.name).observe(time.perf_counter() - start)
+        ROWS_WRITTEN.labels(self.table.name, "inserted").inc(len(rows))
+        return True
+
+    def _spool(self, rows: List[Row]):
+        with open(self.spool_path, "a") as f:
+            for row in rows:
+                f.write(json.dumps(row, default=str) + "\n")
+        ROWS_WRITTEN.labels(self.table.name, "spooled").inc(len(rows))
+        SPOOLED.labels(self.table.name).inc(len(rows))
+        logger.warning(f"Spooled {len(rows)} rows to {self.spool_path}")
+
+    def _read_spool(self) -> List[Row]:
+        if not os.path.exists(self.spool_path):
+            return []
+        columns = {column.name: column.type.python_type for column in self.table.c}
+        rows = []
+        with open(self.spool_path) as f:
+            for line in f:
+                row = json.loads(line)
+                for name, value in row.items():
+                    if value is not None and columns[name] is uuid.UUID:
+                        row[name] = uuid.UUID(value)
+                    elif value is not None and columns[name] is datetime:
+                        row[name] = datetime.fromisoformat(value)
+                rows.append(row)
+        return rows
+
+    async def _replay_spool(self):
+        rows = await asyncio.to_thread(self._read_spool)
+        for start in range(0, len(rows), self.max_batch):
+            if not await self._insert(rows[start : start + self.max_batch]):
+                return
+        if rows:
+            os.remove(self.spool_path)
+            SPOOLED.labels(self.table.name).set(0)
+            logger.warning(f"Replayed {len(rows)} spooled rows into {self.table.name}")
+
+
+# Spool files must outlive the container (a volume), or they are lost with the
+# rows they hold on restart. Each process needs its own directory.
+SPOOL_DIR = getenv("WRITE_BEHIND_SPOOL_DIR", "/var/lib/feynbot/spool")
+
+QUERIES_IR_WRITER = WriteBehindBuffer(
+    QueryIr.__table__,
+    max_batch=int(getenv("QUERY_WRITE_BATCH_SIZE", "100")),
+    flush_interval=float(getenv("QUERY_WRITE_FLUSH_SECONDS", "2")),
+    spool_path=getenv(
+        "QUERY_SPOOL_PATH",
+        os.path.join(SPOOL_DIR, "queries-ir.spool.jsonl"),
+    ),
+)
+
+RETAINED_TRACES_WRITER = WriteBehindBuffer(
+    RetainedTrace.__table__,
+    max_batch=int(getenv("RETAINED_TRACES_WRITE_BATCH_SIZE", "100")),
+    flush_interval=float(getenv("RETAINED_TRACES_WRITE_FLUSH_SECONDS", "2")),
+    spool_path=getenv(
+        "RETAINED_TRACES_SPOOL_PATH",
+        os.path.join(SPOOL_DIR, "retained-traces.spool.jsonl"),
+    ),
+)
@@ -0,0 +1,133 @@
+"""
+Worker processing the /v1/query jobs queued in the query_jobs table. Run one or
+more with `python -m backend.src.worker`; each runs QUERY_WORKER_CONCURRENCY jobs
+at a time and exposes its metrics on QUERY_WORKER_METRICS_PORT. Workers also
+refresh the daily query stats every STATS_REFRESH_SECONDS.
+"""
+
+import asyncio
+import contextlib
+import logging
+import signal
+from os import getenv
+
+from backend.src.database import SessionLocal, engine
+from backend.src.ir_pipeline.utils.context_packer import preload_token_counters
+from backend.src.ir_pipeline.utils.model_router import get_model_router
+from backend.src.jobs import (
+    MAX_ATTEMPTS,
+    claim_jobs,
+    complete_job,
+    fail_job,
+    run_query,
+)
+from backend.src.schemas.query import QueryRequest
+from backend.src.stats import refresh_stats_forever
+from backend.src.utils.langfuse import PROMPTS
+from backend.src.utils.tracing import TRACER
+from backend.src.utils.write_behind import RETAINED_TRACES_WRITER
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+logging.basicConfig(format="%(levelname)s - %(name)s:%(lineno)d - %(message)s")
+logger = logging.getLogger(__name__)
+
+JOBS = Counter(
+    "query_worker_jobs_total",
+    "Query jobs processed by the worker, by outcome",
+    ["outcome"],
+)
+JOB_SECONDS = Histogram(
+    "query_worker_job_seconds",
+    "Time to run a query job, from claim to result",
+)
+BUSY = Gauge(
+    "query_worker_busy_slots",
+    "Worker slots currently running a job",
+)
+
+CONCURRENCY = int(getenv("QUERY_WORKER_CONCURRENCY", "4"))
+POLL_SECONDS = float(getenv("QUERY_WORKER_POLL_SECONDS", "1"))
+
+
+async def process(job):
+    if job.attempts > MAX_ATTEMPTS:
+        # Claimed again after its lease expired too many times
+        async with SessionLocal() as db:
+            await fail_job(db, job, "Lease expired too many times")
+        JOBS.labels("failed").inc()
+        return
+
+    with JOB_SECONDS.time():
+        try:
+            row = await run_query(QueryRequest(**job.request))
+        except Exception as e:
+            logger.error(f"Query job {job.id} failed: {str(e)}", exc_info=True)
+            async with SessionLocal() as db:
+                await fail_job(db, job, str(e))
+            JOBS.labels("error").inc()
+            return
+
+        async with SessionLocal() as db:
+            if await complete_job(db, job, row):
+                JOBS.labels("done").inc()
+            else:
+                logger.warning(f"Query job {job.id} was claimed by another worker")
+                JOBS.labels("lost").inc()
+
+
+async def work(stopping: asyncio.Event):
+    """Claims and runs jobs one at a time, until stopping is set."""
+    while not stopping.is_set():
+        try:
+            async with SessionLocal() as db:
+                jobs = await claim_jobs(db, 1)
+        except Exception as e:
+            logger.error(f"Could not claim query jobs: {str(e)}")
+            jobs = []
+
+        if not jobs:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(stopping.wait(), POLL_SECONDS)
+            continue
+
+        BUSY.inc()
+        try:
+            await process(jobs[0])
+        except Exception as e:
+            # The job stays running and is claimed again once its lease expires
+            logger.error(f"Could not process query job: {str(e)}", exc_info=True)
+        finally:
+            BUSY.dec()
+
+
+async def main():
+    await asyncio.to_thread(PROMPTS.load)
+    refresh_task = asyncio.create_task(PROMPTS.refresh_forever())
+    await preload_token_counters(get_model_router().models)
+    # Summaries of unsampled traces, for feedback received by the API
+    RETAINED_TRACES_WRITER.start()
+    TRACER.exports.start()
+
+    # On SIGTERM, finish the running jobs and stop claiming new ones
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopping.set)
+
+    logger.warning(f"Query worker started with {CONCURRENCY} slots")
+    await asyncio.gather(
+        refresh_stats_forever(stopping),
+        *(work(stopping) for _ in range(CONCURRENCY)),
+    )
+
+    refresh_task.cancel()
+    await RETAINED_TRACES_WRITER.close()
+    await asyncio.to_thread(
+        TRACER.exports.close, float(getenv("LANGFUSE_EXPORT_SHUTDOWN_SECONDS", "5"))
+    )
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    start_http_server(int(getenv("QUERY_WORKER_METRICS_PORT", "9000")))
+    asyncio.run(main())
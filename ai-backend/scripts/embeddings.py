@@ -27,6 +27,7 @@ def get_control_number_range(es_client, os_query, index):
 def worker_process(
     worker_id, cn_start, cn_end, reprocess, indexed_control_numbers, os_query
 ):
+    from backend.src.ir_pipeline.utils.record_store import get_record_store
     from backend.src.utils.embeddings import VLLMOpenAIEmbeddings
     from langchain_text_splitters import RecursiveCharacterTextSplitter
     from utils import (
@@ -47,8 +48,12 @@ def worker_process(
         timeout=60,
     )
     vector_store = get_vector_os_client(embeddings, index_name=VECTOR_INDEX_NAME)
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=512, chunk_overlap=50)
+    # start_index orders the chunks of a paper in the context of paper chats
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=512, chunk_overlap=50, add_start_index=True
+    )
     inspire_os_client = get_inspire_os_client()
+    record_store = get_record_store()
 
     query = {
         "bool": {
@@ -86,6 +91,8 @@ def worker_process(
             cn = hit["_source"].get("control_number") or hit["_source"].get(
                 "metadata", {}
             ).get("control_number")
+            if record_store:
+                record_store.upsert_records([hit])
             if not reprocess and cn in indexed_control_numbers:
                 pbar.update(1)
                 continue
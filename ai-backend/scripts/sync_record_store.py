@@ -0,0 +1,92 @@
+"""
+Incrementally refreshes the local record store (RECORD_STORE_PATH) used to cite
+records, with the records-hep records updated since the last run.
+"""
+
+from datetime import datetime, timezone
+from os import getenv
+
+from opensearchpy.helpers import scan
+from tqdm import tqdm
+
+RECORDS_INDEX_NAME = "records-hep"
+SYNC_STATE_KEY = "records-hep:_updated"
+SOURCE_FIELDS = [
+    "control_number",
+    "titles.title",
+    "authors.full_name",
+    "publication_info.year",
+    "dois.value",
+]
+
+
+def main():
+    import argparse
+
+    from backend.src.ir_pipeline.utils.record_store import RecordStore
+    from utils import get_inspire_os_client
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--store",
+        default=getenv("RECORD_STORE_PATH", "records.sqlite"),
+        help="Path of the SQLite record store",
+    )
+    parser.add_argument(
+        "--since",
+        help="Only sync records updated after this date (default: last sync)",
+    )
+    parser.add_argument(
+        "--full", action="store_true", help="Sync all records, ignoring last sync"
+    )
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    store = RecordStore(args.store)
+    inspire_os_client = get_inspire_os_client()
+
+    since = None if args.full else args.since or store.get_sync_state(SYNC_STATE_KEY)
+    # Same records as the ones the full text search tool can return
+    query = {
+        "bool": {
+            "filter": [
+                {"terms": {"_collections": ["Literature"]}},
+                {"exists": {"field": "arxiv_eprints"}},
+            ]
+        }
+    }
+    if since:
+        query["bool"]["filter"].append({"range": {"_updated": {"gte": since}}})
+
+    started_at = datetime.now(timezone.utc).isoformat()
+    total = inspire_os_client.count(index=RECORDS_INDEX_NAME, body={"query": query})[
+        "count"
+    ]
+    print(f"🔎 Syncing {total} records updated since {since or 'the beginning'}...")
+
+    hits = scan(
+        client=inspire_os_client,
+        query={"query": query, "_source": SOURCE_FIELDS},
+        index=RECORDS_INDEX_NAME,
+        size=args.batch_size,
+        scroll="10m",
+    )
+
+    batch = []
+    with tqdm(unit="records", total=total) as pbar:
+        for hit in hits:
+            batch.append(hit)
+            if len(batch) >= args.batch_size:
+                store.upsert_records(batch, updated=started_at)
+                pbar.update(len(batch))
+                batch = []
+        if batch:
+            store.upsert_records(batch, updated=started_at)
+            pbar.update(len(batch))
+
+    store.set_sync_state(SYNC_STATE_KEY, started_at)
+    print(f"🎉 Record store {args.store} is up to date as of {started_at}.")
+
+
+if __name__ == "__main__":
+    main()
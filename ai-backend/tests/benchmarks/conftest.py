@@ -0,0 +1,139 @@
+import random
+
+import pytest
+from backend.src.ir_pipeline.utils.hits import HIGHLIGHT_FIELD
+from langchain_core.documents import Document
+
+N_HITS = 25
+N_AUTHORS = 1000
+N_SNIPPETS = 5
+N_CITATIONS = 400
+N_DOCS = 25
+
+WORDS = [
+    "the",
+    "cross",
+    "section",
+    "of",
+    "top",
+    "quark",
+    "pair",
+    "production",
+    "lattice",
+    "anomaly",
+]
+
+
+def sentence(rng, n_words):
+    return " ".join(rng.choice(WORDS) for _ in range(n_words)) + "."
+
+
+def make_record(rng, control_number):
+    return {
+        "control_number": control_number,
+        "titles": [{"title": sentence(rng, 15)}],
+        "abstracts": [{"value": " ".join(sentence(rng, 20) for _ in range(10))}],
+        "authors": [
+            {"full_name": f"Author, {i}", "affiliations": [{"value": "CERN"}]}
+            for i in range(N_AUTHORS)
+        ],
+        "publication_info": [{"year": 2020}],
+        "dois": [{"value": f"10.1103/PhysRevD.{control_number}"}],
+    }
+
+
+@pytest.fixture(scope="session")
+def api_response():
+    """INSPIRE API search response, with records in `metadata`."""
+    # Seeded per fixture, so the data does not depend on which tests run
+    rng = random.Random(0)
+    return {
+        "hits": {
+            "hits": [{"metadata": make_record(rng, i)} for i in range(N_HITS)],
+            "total": N_HITS,
+        }
+    }
+
+
+@pytest.fixture(scope="session")
+def opensearch_response():
+    """Full text OpenSearch response, with records in `_source` and highlights."""
+    rng = random.Random(0)
+    return {
+        "hits": {
+            "hits": [
+                {
+                    "_id": str(i),
+                    "_source": make_record(rng, i),
+                    "highlight": {
+                        HIGHLIGHT_FIELD: [
+                            "\n ".join(sentence(rng, 25) for _ in range(8)).replace(
+                                "quark", "<em>quark</em>"
+                            )
+                            for _ in range(N_SNIPPETS)
+                        ]
+                    },
+                }
+                for i in range(N_HITS)
+            ],
+            "total": {"value": N_HITS},
+        }
+    }
+
+
+@pytest.fixture(scope="session")
+def answer():
+    """Long LLM answer citing search results as [i], with out of range citations."""
+    rng = random.Random(0)
+    return " ".join(
+        sentence(rng, 30) + f" [{rng.randint(0, N_HITS + 2)}]"
+        for _ in range(N_CITATIONS)
+    )
+
+
+@pytest.fixture(scope="session")
+def snippet_answer():
+    """Long LLM answer citing snippets as [paper:snippet]."""
+    rng = random.Random(0)
+    return " ".join(
+        sentence(rng, 30)
+        + f" [{rng.randint(0, N_HITS + 2)}:{rng.randint(0, N_SNIPPETS)}]"
+        for _ in range(N_CITATIONS)
+    )
+
+
+@pytest.fixture(scope="session")
+def rag_answer():
+    """Long LLM answer citing reranked documents as [n], from 1."""
+    rng = random.Random(0)
+    return " ".join(
+        sentence(rng, 30) + f" [{rng.randint(1, N_DOCS + 2)}]"
+        for _ in range(N_CITATIONS)
+    )
+
+
+@pytest.fixture(scope="session")
+def cited_rag_answer():
+    """Same as rag_answer, citing only existing documents."""
+    rng = random.Random(0)
+    return " ".join(
+        sentence(rng, 30) + f" [{rng.randint(1, N_DOCS)}]" for _ in range(N_CITATIONS)
+    )
+
+
+@pytest.fixture(scope="session")
+def docs():
+    """Reranker output: 25 chunks of a few papers, with their metadata."""
+    rng = random.Random(0)
+    return [
+        Document(
+            page_content=" ".join(sentence(rng, 20) for _ in range(15)),
+            metadata={
+                "control_number": i // 3,
+                "embedding_type": "fulltext",
+                "start_index": i * 1000,
+                "relevance_score": 1 - i / N_DOCS,
+            },
+        )
+        for i in range(N_DOCS)
+    ]
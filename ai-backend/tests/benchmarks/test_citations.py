@@ -0,0 +1,38 @@
+import re
+
+import pytest
+from backend.src.ir_pipeline.utils.inspire_formatter import format_refs
+
+
+def replace_per_index(answer, docs):
+    """The previous renumbering: a str.replace per cited index, then a sentinel pass."""
+    unique_ordered = []
+    for match in re.finditer(r"\[(\d+)\]", answer):
+        ref_num = int(match.group(1))
+        if ref_num not in unique_ordered:
+            unique_ordered.append(ref_num)
+
+    doc_id_map = {}
+    new_i = 1
+    for i in unique_ordered:
+        control_number = docs[i - 1].metadata.get("control_number")
+        if control_number in doc_id_map:
+            doc_id = doc_id_map[control_number]
+        else:
+            doc_id = new_i
+            doc_id_map[control_number] = new_i
+            new_i += 1
+        answer = answer.replace(f"[{i}]", f"[__NEW_REF_ID_{doc_id}]")
+    return answer.replace("__NEW_REF_ID_", "")
+
+
+@pytest.mark.benchmark(group="citation-renumbering")
+def test_replace_per_index(benchmark, cited_rag_answer, docs):
+    renumbered = benchmark(replace_per_index, cited_rag_answer, docs)
+    assert renumbered == format_refs(cited_rag_answer, docs)[0]
+
+
+@pytest.mark.benchmark(group="citation-renumbering")
+def test_single_pass(benchmark, cited_rag_answer, docs):
+    renumbered, _ = benchmark(format_refs, cited_rag_answer, docs)
+    assert renumbered == replace_per_index(cited_rag_answer, docs)
@@ -0,0 +1,77 @@
+import gc
+import json
+import re
+import tracemalloc
+
+import pytest
+from backend.src.ir_pipeline.utils.hits import HIGHLIGHT_FIELD, parse_hits
+from backend.src.ir_pipeline.utils.inspire_formatter import (
+    extract_context,
+    format_reference,
+)
+
+
+@pytest.fixture(scope="module")
+def payload(opensearch_response):
+    """The search response serialized, as the client receives it."""
+    return json.dumps(opensearch_response)
+
+
+def retained_bytes(build):
+    """Bytes still allocated after build() returns, i.e. kept for the request."""
+    gc.collect()
+    tracemalloc.start()
+    kept = build()
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return current
+
+
+def format_raw(results):
+    """The formatters as they walked the raw response before Hits existed."""
+    context = []
+    for i, hit in enumerate(results["hits"]["hits"]):
+        source = hit["_source"]
+        snippets = hit.get("highlight", {}).get(HIGHLIGHT_FIELD, [])
+        context.append(
+            f"Result [{i}] {source.get('titles', [{}])[0].get('title', 'N/A')} "
+            + "".join(re.sub(r"\s+|</?em>", " ", s) for s in snippets)
+        )
+    references = []
+    for hit in results["hits"]["hits"]:
+        metadata = hit["_source"]
+        references.append(
+            ", ".join(a.get("full_name", "") for a in metadata.get("authors", []))
+            + str(metadata.get("publication_info", [{}])[0].get("year", "N/A"))
+            + metadata.get("titles", [{}])[0].get("title", "N/A")
+            + metadata.get("dois", [{}])[0].get("value", "N/A")
+        )
+    return context, references
+
+
+def parse_and_format(results):
+    hits = parse_hits(results, use_highlights=True)
+    return (
+        extract_context(hits, use_highlights=True),
+        [format_reference(hit) for hit in hits],
+    )
+
+
+def test_hits_retain_less_than_raw_response(payload):
+    raw = retained_bytes(lambda: json.loads(payload))
+    hits = retained_bytes(lambda: parse_hits(json.loads(payload), use_highlights=True))
+    assert hits < raw / 2
+
+
+@pytest.mark.benchmark(group="hit-formatting")
+def test_format_raw_response(benchmark, opensearch_response):
+    context, _ = benchmark(format_raw, opensearch_response)
+    assert len(context) == len(opensearch_response["hits"]["hits"])
+
+
+@pytest.mark.benchmark(group="hit-formatting")
+def test_parse_and_format_hits(benchmark, opensearch_response):
+    context, references = benchmark(parse_and_format, opensearch_response)
+    assert len(references) == len(opensearch_response["hits"]["hits"])
@@ -0,0 +1,64 @@
+import pytest
+from backend.src.ir_pipeline.utils.hits import parse_hits
+from backend.src.ir_pipeline.utils.inspire_formatter import (
+    clean_refs,
+    clean_refs_with_snippets,
+    extract_context,
+    format_docs,
+    format_refs,
+)
+
+
+@pytest.fixture(scope="module")
+def hits(api_response):
+    return parse_hits(api_response)
+
+
+@pytest.fixture(scope="module")
+def highlight_hits(opensearch_response):
+    return parse_hits(opensearch_response, use_highlights=True)
+
+
+def test_parse_hits(benchmark, api_response):
+    hits = benchmark(parse_hits, api_response)
+    assert len(hits) == len(api_response["hits"]["hits"])
+
+
+def test_parse_hits_highlights(benchmark, opensearch_response):
+    hits = benchmark(parse_hits, opensearch_response, use_highlights=True)
+    assert all(hit.snippets for hit in hits)
+
+
+def test_extract_context(benchmark, hits):
+    context = benchmark(extract_context, hits)
+    assert context.count("Result [") == len(hits)
+
+
+def test_extract_context_highlights(benchmark, highlight_hits):
+    context = benchmark(extract_context, highlight_hits, use_highlights=True)
+    assert "<em>" not in context
+
+
+def test_clean_refs(benchmark, answer, hits):
+    cleaned, references = benchmark(clean_refs, answer, hits)
+    assert len(references) == len(hits)
+    assert "**[1]**" in cleaned
+
+
+def test_clean_refs_with_snippets(benchmark, snippet_answer, highlight_hits):
+    _, citations = benchmark(clean_refs_with_snippets, snippet_answer, highlight_hits)
+    assert {citation["display"] for citation in citations.values()} == set(
+        range(1, len(highlight_hits) + 1)
+    )
+
+
+def test_format_docs(benchmark, docs):
+    formatted = benchmark(format_docs, docs)
+    assert formatted.startswith("Document 1:")
+
+
+def test_format_refs(benchmark, rag_answer, docs):
+    _, citations = benchmark(format_refs, rag_answer, docs)
+    assert {citation.doc_id for citation in citations} == {
+        doc.metadata["control_number"] + 1 for doc in docs
+    }
@@ -0,0 +1,114 @@
+import random
+import re
+from collections import OrderedDict
+
+import pytest
+from backend.src.ir_pipeline.utils.inspire_formatter import chunk_order, format_docs
+from langchain_core.documents import Document
+
+CHATS = 20
+TURNS = 6
+INSTRUCTIONS = (
+    "You are an assistant answering questions about a high-energy physics paper. "
+    "Answer using only the documents below and cite them as [n]. " * 8
+)
+# The layout of the paper chat prompt, and the one it replaced
+CONTEXT_FIRST = "{instructions}\n{context}\n{history}\n{question}"
+HISTORY_FIRST = "{instructions}\n{history}\n{context}\n{question}"
+TOKEN = re.compile(r"\w+|[^\w\s]")
+
+
+class PrefixCacheStandIn:
+    """
+    Mimics vLLM's automatic prefix caching: the prompt is split in blocks of
+    block_size tokens, each identified by its tokens and all the previous ones,
+    and blocks already computed (kept in an LRU) are not recomputed.
+    """
+
+    def __init__(self, block_size=16, capacity_blocks=20000):
+        self.block_size = block_size
+        self.capacity_blocks = capacity_blocks
+        self.blocks = OrderedDict()
+
+    def complete(self, prompt):
+        """Returns the prompt tokens and how many of them were cached."""
+        tokens = TOKEN.findall(prompt)
+        cached, parent, hit = 0, None, True
+        for start in range(0, len(tokens) - self.block_size + 1, self.block_size):
+            block = hash((parent, tuple(tokens[start : start + self.block_size])))
+            if hit and block in self.blocks:
+                cached += self.block_size
+                self.blocks.move_to_end(block)
+            else:
+                hit = False
+                self.blocks[block] = True
+                if len(self.blocks) > self.capacity_blocks:
+                    self.blocks.popitem(last=False)
+            parent = block
+        return len(tokens), cached
+
+
+def make_paper(rng, control_number, n_chunks=25):
+    words = ["lattice", "gauge", "quark", "anomaly", "decay", "boson", "coupling"]
+    return [
+        Document(
+            page_content=" ".join(rng.choice(words) for _ in range(90)),
+            metadata={
+                "control_number": control_number,
+                "embedding_type": "fulltext",
+                "start_index": i * 462,
+            },
+        )
+        for i in range(n_chunks)
+    ]
+
+
+def rerank(rng, chunks, top_n=10):
+    """Chat turns on the same paper retrieve overlapping, differently ranked chunks."""
+    scores = [rng.random() for _ in chunks]
+    order = sorted(range(len(chunks)), key=lambda i: -scores[i])[:top_n]
+    return [chunks[i] for i in order]
+
+
+def cached_ratio(layout, stable_order):
+    """Fraction of the prompt tokens of CHATS paper chats served from the cache."""
+    rng = random.Random(0)
+    server = PrefixCacheStandIn()
+    prompt_tokens = cached_tokens = 0
+    papers = [make_paper(rng, control_number) for control_number in range(CHATS)]
+    for turn in range(TURNS):
+        for chunks in papers:
+            docs = rerank(rng, chunks[:14])
+            if stable_order:
+                docs = sorted(docs, key=chunk_order)
+            history = "\n".join(
+                f"user: question {t}\nassistant: answer {t}" for t in range(turn)
+            )
+            prompt = layout.format(
+                instructions=INSTRUCTIONS,
+                context=format_docs(docs),
+                history=history,
+                question=f"question {turn}",
+            )
+            tokens, cached = server.complete(prompt)
+            prompt_tokens += tokens
+            cached_tokens += cached
+    return cached_tokens / prompt_tokens
+
+
+def test_paper_chat_layout_caches_most():
+    assert cached_ratio(CONTEXT_FIRST, True) > max(
+        cached_ratio(CONTEXT_FIRST, False), cached_ratio(HISTORY_FIRST, True)
+    )
+
+
+@pytest.mark.benchmark(group="prefix-cache")
+@pytest.mark.parametrize("stable_order", [False, True], ids=["rerank", "chunk"])
+@pytest.mark.parametrize(
+    "layout", [CONTEXT_FIRST, HISTORY_FIRST], ids=["context-first", "history-first"]
+)
+def test_prefix_cache(benchmark, layout, stable_order):
+    ratio = benchmark.pedantic(
+        cached_ratio, args=(layout, stable_order), rounds=3, iterations=1
+    )
+    benchmark.extra_info["cached_ratio"] = ratio
@@ -0,0 +1,23 @@
+import pytest
+from backend.src.utils.reranker import CustomJinaRerank
+
+
+@pytest.fixture
+def reranker(monkeypatch, docs):
+    """Reranker returning a canned response, to benchmark the client side only."""
+    results = [
+        {"index": i, "document": doc.page_content, "relevance_score": 1 / (i + 1)}
+        for i, doc in reversed(list(enumerate(docs)))
+    ]
+    monkeypatch.setattr(
+        CustomJinaRerank, "rerank", lambda self, documents, query: results
+    )
+    return CustomJinaRerank(
+        openai_api_base="http://reranker", openai_api_key="key", top_n=len(docs)
+    )
+
+
+def test_compress_documents(benchmark, reranker, docs):
+    compressed = benchmark(reranker.compress_documents, docs, "top quark mass")
+    assert len(compressed) == len(docs)
+    assert compressed[0].metadata["relevance_score"] == 1 / len(docs)
@@ -0,0 +1,86 @@
+import asyncio
+
+from backend.src.utils.admission import BACKGROUND, AdmissionController, priority
+from backend.src.utils.scheduler import PriorityScheduler
+
+
+def test_interactive_generations_are_admitted_first():
+    admission = AdmissionController(
+        "model", max_concurrency=1, max_queue=10, queue_timeout=5
+    )
+    order = []
+
+    async def generate(name, hold: asyncio.Event = None):
+        async with admission.slot():
+            order.append(name)
+            if hold:
+                await hold.wait()
+
+    async def background(name):
+        with priority(BACKGROUND):
+            await generate(name)
+
+    async def run():
+        hold = asyncio.Event()
+        first = asyncio.create_task(generate("first", hold))
+        await asyncio.sleep(0)
+        waiting = [asyncio.create_task(background("background"))]
+        await asyncio.sleep(0)
+        waiting.append(asyncio.create_task(generate("interactive")))
+        await asyncio.sleep(0)
+        hold.set()
+        await asyncio.gather(first, *waiting)
+
+    asyncio.run(run())
+    assert order == ["first", "interactive", "background"]
+
+
+def test_background_generations_keep_slots_free():
+    admission = AdmissionController(
+        "model", max_concurrency=4, max_queue=10, queue_timeout=5, max_background=1
+    )
+    running = []
+
+    async def run():
+        hold = asyncio.Event()
+
+        async def background():
+            with priority(BACKGROUND):
+                async with admission.slot():
+                    running.append(BACKGROUND)
+                    await hold.wait()
+
+        tasks = [asyncio.create_task(background()) for _ in range(3)]
+        await asyncio.sleep(0)
+        assert running == [BACKGROUND]
+        # Interactive requests still get the other slots right away
+        async with admission.slot():
+            pass
+        hold.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    assert len(running) == 3
+
+
+def test_scheduler_drains_background_jobs_on_close():
+    done = []
+
+    async def job(i):
+        await asyncio.sleep(0.01)
+        done.append(i)
+
+    async def run():
+        scheduler = PriorityScheduler(
+            interactive_workers=1,
+            background_workers=2,
+            background_queue_size=10,
+            latency_target=1,
+        )
+        for i in range(5):
+            assert scheduler.submit_background(job, i)
+        await scheduler.close(timeout=5)
+        assert not scheduler.submit_background(job, 5)
+
+    asyncio.run(run())
+    assert sorted(done) == [0, 1, 2, 3, 4]
@@ -0,0 +1,57 @@
+import asyncio
+
+from backend.src.ir_pipeline.utils.history import SUMMARY_PREFIX, HistoryManager
+
+
+def count(text):
+    return len(text.split())
+
+
+def conversation(turns):
+    return [
+        {"role": role, "content": f"{role} message {turn}."}
+        for turn in range(turns)
+        for role in ("user", "assistant")
+    ]
+
+
+def test_summary_is_folded_in_the_background():
+    manager = HistoryManager(keep_messages=2, token_budget=1000)
+    summarized = asyncio.Event()
+    calls = []
+
+    async def summarize(previous, messages):
+        calls.append((previous, len(messages)))
+        await summarized.wait()
+        return f"summary of {len(messages)}"
+
+    async def turns():
+        messages = conversation(3)
+        history, _ = manager.prepare(messages, count, summarize)
+        # Not waiting for the LLM: the first turn gets an extractive summary
+        assert history[0]["content"].startswith(
+            SUMMARY_PREFIX + "user: user message 0."
+        )
+        assert history[1:] == messages[-2:]
+
+        summarized.set()
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+
+        # The next turn resumes from the LLM summary of the first four messages
+        history, _ = manager.prepare(conversation(4), count, summarize)
+        assert history[0]["content"].startswith(SUMMARY_PREFIX + "summary of 4 user:")
+        await asyncio.sleep(0)
+
+    asyncio.run(turns())
+    assert calls == [(None, 4), ("summary of 4", 2)]
+
+
+def test_last_message_is_truncated_to_budget():
+    manager = HistoryManager(keep_messages=2, token_budget=40)
+    messages = [{"role": "assistant", "content": "Long answer. " * 50}]
+
+    history, tokens = manager.prepare(messages, count)
+
+    assert tokens <= 40 - manager.summary_budget
+    assert history[0]["content"].startswith("Long answer.")
@@ -0,0 +1,53 @@
+import pytest
+from backend.src.ir_pipeline.schema import Terms
+from backend.src.ir_pipeline.tools import inspire
+from backend.src.ir_pipeline.tools.inspire import InspireSearchTool
+from backend.src.ir_pipeline.utils.query_classifier import classify_query, fast_expand
+
+
+@pytest.fixture
+def sent_queries(monkeypatch):
+    """The q parameter of the INSPIRE API searches, which return no hits."""
+    queries = []
+
+    class Response:
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return {"hits": {"hits": []}}
+
+    def get(url, params):
+        queries.append(params["q"])
+        return Response()
+
+    monkeypatch.setattr(inspire.requests, "get", get)
+    return queries
+
+
+def test_keywords_are_full_text_terms(sent_queries):
+    expanded = fast_expand("lattice QCD")
+    InspireSearchTool().run(expanded)
+    assert isinstance(expanded, Terms)
+    assert sent_queries == [expanded.inspire_query()]
+    assert sent_queries[0].startswith('ft "lattice QCD"')
+
+
+def test_quoted_phrases_are_terms():
+    assert fast_expand('"dark matter" "axion"').terms[:2] == ["dark matter", "axion"]
+
+
+@pytest.mark.parametrize(
+    ("query", "kind"),
+    [
+        ("a Witten and t anomalies", "inspire"),
+        ('find a E.Witten.1 or t "gravitational anomalies"', "inspire"),
+        ("arXiv:2101.00001", "arxiv"),
+        ("effects of gravity", "question"),
+        ("what is the top quark mass", "question"),
+    ],
+)
+def test_other_queries_go_to_llm(query, kind):
+    # The full text search does not parse INSPIRE syntax
+    assert classify_query(query)[0] == kind
+    assert fast_expand(query) is None
@@ -0,0 +1,42 @@
+import asyncio
+
+import pytest
+from backend.src.ir_pipeline.utils.hits import Hit
+from backend.src.ir_pipeline.utils.record_store import RecordStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = RecordStore(str(tmp_path / "records.sqlite"))
+    store.upsert_many([Hit(control_number=1, title="Stored", authors=("A",))])
+    return store
+
+
+def test_enrich_fetches_records_missing_from_store(store):
+    fetched = []
+
+    async def fetch(control_numbers):
+        fetched.append(control_numbers)
+        return [Hit(control_number=2, title="Fetched", authors=("B", "C"), year=2025)]
+
+    hits = asyncio.run(
+        store.enrich([Hit(control_number=1), Hit(control_number=2)], fetch=fetch)
+    )
+
+    assert fetched == [[2]]
+    assert [hit.title for hit in hits] == ["Stored", "Fetched"]
+    assert hits[1].authors == ("B", "C")
+    assert hits[1].year == 2025
+    # Stored for the next searches
+    assert store.get_many([2])[2].title == "Fetched"
+
+
+def test_enrich_keeps_hits_when_fetch_fails(store):
+    async def fetch(control_numbers):
+        raise ConnectionError("INSPIRE is down")
+
+    hits = asyncio.run(
+        store.enrich([Hit(control_number=1), Hit(control_number=2)], fetch=fetch)
+    )
+
+    assert hits == [Hit(control_number=1, title="Stored", authors=("A",)), Hit(2)]
@@ -0,0 +1,19 @@
+import asyncio
+
+import pytest
+from backend.src.utils.resilience import CircuitOpenError, ResilientBackend
+
+
+def test_settings_are_read_when_the_backend_is_created(monkeypatch):
+    monkeypatch.setenv("CIRCUIT_BREAKER_FAILURES", "1")
+    monkeypatch.setenv("CIRCUIT_BREAKER_RECOVERY_SECONDS", "60")
+    backend = ResilientBackend("flaky", timeout=1)
+
+    async def fail():
+        raise ConnectionError("down")
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(backend.acall(fail))
+    with pytest.raises(CircuitOpenError) as error:
+        asyncio.run(backend.acall(fail))
+    assert 59 <= error.value.retry_after <= 60
@@ -1,7 +1,6 @@
 import logging
 import sys
 import os
-import re
 import yaml
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
@@ -9,6 +8,7 @@ logging.getLogger().addHandler(logging.StreamHandler(stream=sys.stdout))
 from llama_index.llms.ollama import Ollama
 
 from os import getenv
+from feynbot_ir.citations import renumber_citations
 from llama_index.core import (
     VectorStoreIndex,
     SimpleDirectoryReader,
@@ -100,58 +100,20 @@ def postprocess_response(response):
         for i, node in enumerate(response.source_nodes)
     }
 
-    # create a set to keep track of encountered files
-    encountered_files = set()
-
-    # create a new dictionary to store the updated data
-    new_references = {}
-
-    # initialize a variable to track the new index
-    new_index = 1
-
-    # create a dictionary to store the mapping of old indices to new indices
-    index_mapping = {}
-
-    for key, reference in references.items():
-        # check if the file has been encountered before
-        if reference not in encountered_files:
-            # if not encountered, add it to the set and the new dictionary with updated index
-            encountered_files.add(reference)
-            new_references[new_index] = reference
-            index_mapping[key] = new_index
-            new_index += 1
-        else:
-            # if encountered, update the index mapping
-            index_mapping[key] = min(
-                index_mapping.get(k, float("inf"))
-                for k, v in references.items()
-                if v == reference
-            )
-
     response = response.response if not isinstance(response, str) else response
 
-    print("-" * 20)
-    print("BEFORE posprocessing")
-    print("Index mapping:", index_mapping)
-    print("References:", references)
-    print("New References:", new_references)
-    print("Response:", response)
-    print("-" * 20)
-
-    # replace indices in the text according to the index_mapping
-    for old_index, new_index in index_mapping.items():
-        response = response.replace(f"[{old_index + 1}]", f"[{new_index}]")
-
-    indices_in_text = set(map(int, re.findall(r"\[(\d+)\]", response)))
-    # filter new_data to keep only items with indices appearing in the text
+    # renumber the citations in a single pass, giving chunks of the same file the
+    # same number, in order of first appearance in the text
+    response, cited = renumber_citations(
+        response, key=lambda index: references.get(index - 1)
+    )
     new_references_filtered = {
-        index: file_name
-        for index, file_name in new_references.items()
-        if index in indices_in_text
+        new_index: references[old_index - 1] for _, (old_index,), new_index in cited
     }
 
     print("-" * 20)
     print("AFTER posprocessing")
+    print("References:", references)
     print("New References filtered:", new_references_filtered)
     print("Response:", response)
     print("-" * 20)
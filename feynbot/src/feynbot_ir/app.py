@@ -1,9 +1,10 @@
 import requests
 import gradio as gr
 import time
-import re
 from os import getenv
 
+from feynbot_ir.citations import renumber_citations
+
 
 def search_inspire(query, size=10):
     """
@@ -144,30 +145,17 @@ def llm_generate_answer(prompt, model="llama3.2"):
 
 def clean_refs(answer, results):
     """Clean the references from the answer"""
+    hits = results["hits"]["hits"]
+    answer, cited = renumber_citations(
+        answer,
+        key=lambda i: i if i < len(hits) else None,
+        template=" **[{}]**",
+    )
 
-    # Find references
-    unique_ordered = []
-    for match in re.finditer(r"\[(\d+)\]", answer):
-        ref_num = int(match.group(1))
-        if ref_num not in unique_ordered:
-            unique_ordered.append(ref_num)
-
-    # Filter references
-    new_i = 1
     new_results = ""
-    for i, hit in enumerate(results["hits"]["hits"]):
-        if i not in unique_ordered:
-            continue
-        metadata = hit["metadata"]
+    for _, (i,), new_i in cited:
         new_results += f"**[{new_i}]** "
-        new_results += format_reference(metadata)
-        new_i += 1
-
-    new_i = 1
-    for i in unique_ordered:
-        answer = answer.replace(f"[{i}]", f" **[__NEW_REF_ID_{new_i}]**")
-        new_i += 1
-    answer = answer.replace("__NEW_REF_ID_", "")
+        new_results += format_reference(hits[i]["metadata"])
 
     return answer, new_results
 
@@ -5,6 +5,7 @@ from os import getenv
 
 import gradio as gr
 import requests
+from feynbot_ir.citations import renumber_citations
 from feynbot_ir.schemas import LLMResponse, Terms
 from opensearchpy import OpenSearch
 
@@ -231,28 +232,17 @@ def llm_generate_answer(prompt, model):
 
 def clean_refs(answer, results):
     """Clean the references from the answer"""
+    hits = results["hits"]["hits"]
+    answer, cited = renumber_citations(
+        answer,
+        key=lambda i: i if i < len(hits) else None,
+        template=" **[{}]**",
+    )
 
-    # Find references
-    unique_ordered = []
-    for match in re.finditer(r"\[(\d+)\]", answer):
-        ref_num = int(match.group(1))
-        if ref_num not in unique_ordered:
-            unique_ordered.append(ref_num)
-
-    # Filter references
-    new_i = 1
-    formatted_references = []
-    for i, hit in enumerate(results["hits"]["hits"]):
-        if i not in unique_ordered:
-            continue
-        formatted_references.append(f"**[{new_i}]** {format_reference(hit['_source'])}")
-        new_i += 1
-
-    new_i = 1
-    for i in unique_ordered:
-        answer = answer.replace(f"[{i}]", f" **[__NEW_REF_ID_{new_i}]**")
-        new_i += 1
-    answer = answer.replace("__NEW_REF_ID_", "")
+    formatted_references = [
+        f"**[{new_i}]** {format_reference(hits[i]['_source'])}"
+        for _, (i,), new_i in cited
+    ]
 
     return answer, formatted_references
 
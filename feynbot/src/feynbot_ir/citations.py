@@ -0,0 +1,52 @@
+import re
+from typing import Callable, Hashable, List, NamedTuple, Optional, Tuple
+
+CITATION_PATTERN = re.compile(r"\[(\d+)\]")
+SNIPPET_CITATION_PATTERN = re.compile(r"\[(\d+):(\d+)\]")
+
+
+class CitedMarker(NamedTuple):
+    marker: str  # e.g. "[3]" or "[0:2]"
+    indices: Tuple[int, ...]  # e.g. (3,) or (0, 2)
+    number: int  # new citation number, from 1
+
+
+def renumber_citations(
+    answer: str,
+    key: Callable[..., Optional[Hashable]],
+    template: Optional[str] = "[{}]",
+    pattern: re.Pattern = CITATION_PATTERN,
+) -> Tuple[str, List[CitedMarker]]:
+    """
+    Parses the citation markers of an answer and renumbers them from 1 in order of
+    first appearance, in a single pass.
+
+    key is called once per distinct marker with its indices and returns what a
+    number is given to (markers with the same key share a number, e.g. two chunks
+    of the same paper), or None for an invalid citation, left untouched. Markers
+    are rewritten with template, or kept as they are if template is None.
+
+    Returns the answer and the valid markers, in order of first appearance.
+    """
+    numbers = {}
+    cited = {}
+
+    def replace(match: re.Match) -> str:
+        marker = match.group(0)
+        if marker not in cited:
+            indices = tuple(int(group) for group in match.groups())
+            marker_key = key(*indices)
+            cited[marker] = (
+                None
+                if marker_key is None
+                else CitedMarker(
+                    marker, indices, numbers.setdefault(marker_key, len(numbers) + 1)
+                )
+            )
+        cited_marker = cited[marker]
+        if cited_marker is None or template is None:
+            return marker
+        return template.format(cited_marker.number)
+
+    answer = pattern.sub(replace, answer)
+    return answer, [marker for marker in cited.values() if marker is not None]